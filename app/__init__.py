@@ -6,6 +6,7 @@ from routes.web_routes import web_bp
 from routes.api_routes import api_bp
 from routes.line_webhook_routes import line_bp, alias_bp
 from utils.log import logger
+from utils.model_residency import start_residency_manager
 
 def create_app() -> Flask:
     """
@@ -31,5 +32,8 @@ def create_app() -> Flask:
     app.register_blueprint(line_bp, url_prefix='/line')
     app.register_blueprint(alias_bp)  # /webhook 無前綴別名
     logger.info("已註冊所有路由Blueprint")
+
+    # 模型常駐（config.ollama.residency）：背景預先載入模型並定期續約
+    start_residency_manager()
     
     return app
@@ -0,0 +1,48 @@
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Mount
+from app import create_app
+from utils.log import logger
+from utils.ollama_client import close_async_clients
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    yield
+    # 關閉非同步連線池（Ollama / 地理反查 / LINE API）
+    from routes.api_routes import geo_reverser
+    from routes.line_webhook_routes import line_handler
+    await close_async_clients()
+    await geo_reverser.aclose()
+    await line_handler.aclose()
+    logger.info("已關閉非同步連線")
+
+
+def create_asgi_app() -> Starlette:
+    """
+    建立ASGI應用：/api/ask 與 LINE Webhook 走非同步路由，其餘路由沿用Flask應用（WSGI 轉接）
+    啟動方式：uvicorn app.asgi:app，或於 config.server.asgi 設為 true 後執行 run.py
+    """
+    flask_app = create_app()
+    from routes.asgi_routes import routes
+    app = Starlette(
+        routes=routes + [Mount("/", app=WSGIMiddleware(flask_app))],
+        middleware=[
+            Middleware(
+                CORSMiddleware,
+                allow_origins=["*"],
+                allow_methods=["*"],
+                allow_headers=["*"],
+                allow_credentials=True
+            )
+        ],
+        lifespan=lifespan
+    )
+    logger.info("已建立ASGI應用（非同步路由：/api/ask、/line/webhook、/webhook）")
+    return app
+
+
+app = create_asgi_app()
@@ -1,5 +1,5 @@
-from flask import Blueprint, request, jsonify
-from typing import Dict, List
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from typing import Dict, List, Optional
 from datetime import datetime
 from utils.log import logger
 from utils.geo_utils import GeoReverser
@@ -7,6 +7,10 @@ from services.scam_classifier import ScamClassifier
 from services.intent_classifier import IntentClassifier
 from services.scam_related_check import ScamRelatedChecker
 from services.reply_formatter import ReplyFormatter
+from services.ask_pipeline import AskPipeline
+from services.keyword_engine import get_keyword_engine
+from utils.ollama_scheduler import set_current_user
+from utils import deadline
 from storage.memory_manager import MemoryManager
 from storage.csv_logger import CSVLogger
 from storage.mysql_logger import MySQLLogger
@@ -14,6 +18,7 @@ from config.paths import STORAGE_BASE_DIR
 import storage.data_merger
 from config import config
 import pymysql
+import json
 import os
 import sqlite3
 from typing import Dict, Any
@@ -31,12 +36,142 @@ memory_manager = MemoryManager()
 csv_logger = CSVLogger()
 mysql_logger = MySQLLogger()
 
+# /api/ask 的 LLM 階段管線（循序/併發、分開/合併分類由 config.pipeline 決定）
+ask_pipeline = AskPipeline(intent_classifier, scam_related_checker, scam_classifier)
+
+def _early_reply(stages, intent: str, user_input: str, user_memory: Dict) -> Optional[Dict[str, str]]:
+    """
+    處理不需詐騙分析的情況（閒聊、查詢記憶、與詐騙無關）
+    回傳響應內容；需繼續分析時回傳None
+    """
+    early = _intent_reply(stages, intent, user_input, user_memory)
+    if early:
+        return early
+    # 5.3 非閒聊/查詢記憶：檢查是否與詐騙相關
+    return _unrelated_reply(stages, intent, user_input, stages.get("related"))
+
+
+def _intent_reply(stages, intent: str, user_input: str, user_memory: Dict) -> Optional[Dict[str, str]]:
+    """閒聊與查詢記憶意圖的直接回覆；其他意圖回傳None"""
+    scam_type = "無法分類"
+
+    # 5.1 閒聊意圖：直接返回預設回覆
+    if intent == "閒聊":
+        stages.discard()
+        return {
+            "answer": ReplyFormatter.get_default_reply(intent),
+            "scam_type": scam_type,
+            "intent": intent
+        }
+
+    # 5.2 查詢記憶意圖：返回歷史記憶
+    if intent == "查詢記憶":
+        stages.discard()
+        # 從記憶中提取上次分析結果
+        last_memory = user_memory["memory"]
+        last_scam_type = last_memory.get("lastScamType", "未知")
+        last_summary = last_memory.get("lastEventSummary", "目前沒有摘要。")
+        last_response = last_memory.get("lastResponse", "目前沒有記錄回覆內容。")
+
+        # 根據使用者查詢關鍵字返回對應記憶
+        if any(keyword in user_input for keyword in ["類型", "什麼詐騙", "哪種類型"]):
+            final_reply = f"🧠 你上次的詐騙類型是「{last_scam_type}」。"
+        elif any(keyword in user_input for keyword in ["機率", "風險", "可能性"]):
+            # 與最新用語一致：不顯示百分比，改用風險等級
+            final_reply = "📊 我記得你上次問到的案件，詐騙風險：高。"
+        elif any(keyword in user_input for keyword in ["內容", "回覆", "分析"]):
+            final_reply = f"📋 上次的回覆內容是：\n{last_response[:100]}..."
+        elif any(keyword in user_input for keyword in ["摘要", "描述", "提到"]):
+            final_reply = f"📌 你上次提到的內容是：{last_summary[:100]}..."
+        else:
+            final_reply = f"🧠 你上次的詐騙類型是「{last_scam_type}」，內容是：{last_summary[:50]}..."
+
+        return {
+            "answer": final_reply,
+            "scam_type": last_scam_type,
+            "intent": intent
+        }
+
+    return None
+
+
+def _unrelated_reply(stages, intent: str, user_input: str, is_related: bool) -> Optional[Dict[str, str]]:
+    """與詐騙無關時的回覆（命中高信號關鍵詞仍視為相關）；需繼續分析時回傳None"""
+    scam_type = "無法分類"
+    if not is_related:
+        # 與 LINE 一致的保守策略：命中高信號關鍵詞則視為相關
+        # （關鍵字表見 scam_related_check.FALLBACK_HIGH_SIGNAL_KEYWORDS）
+        if get_keyword_engine().scan(user_input).any_hit("high_signal", "fallback"):
+            logger.warning("相關性檢查為 False，但命中高信號關鍵詞，改視為相關並繼續分析。")
+        else:
+            stages.discard()
+            return {
+                "answer": "抱歉，您的問題似乎與詐騙無關，我目前專注於詐騙相關問題。",
+                "scam_type": scam_type,
+                "intent": intent
+            }
+
+    return None
+
+
+def _finalize_reply(
+    session_id: str,
+    user_input: str,
+    user_memory: Dict,
+    intent: str,
+    scam_type: str,
+    answer: str,
+    latitude=None,
+    longitude=None,
+    county: Optional[str] = None
+) -> str:
+    """
+    分析完成後的收尾：地理反查、寫入日誌、格式化回覆、更新記憶
+    回傳最終回覆內容（county：呼叫端已反查的縣市，例如非同步路徑，此時不再反查）
+    """
+    if county is None:
+        county = "未知地區"  # 預設縣市
+
+        # 5.4.3 地理位置反查（若提供經緯度）
+        if latitude and longitude:
+            county = geo_reverser.reverse_geo(float(latitude), float(longitude))
+            # 更新縣市統計
+            geo_reverser.update_location_stats(county)
+
+    # 5.4.4 寫入日誌（CSV + MySQL）
+    csv_logger.log_scam(user_input, scam_type, county)
+    if deadline.expired():
+        # MySQL 連線可能需數秒；時間預算用盡時只寫 CSV（可由 /api/admin/import-csv 補匯入）
+        logger.warning("時間預算已用盡，略過 MySQL 紀錄")
+    else:
+        mysql_logger.log_scam(user_input, scam_type, county)
+
+    # 5.4.5 格式化回覆
+    if ReplyFormatter.should_format(intent, scam_type, answer):
+        final_reply = ReplyFormatter.format_reply(scam_type, answer)
+    else:
+        final_reply = answer
+
+    # 5.4.6 更新使用者記憶（僅「描述事件」意圖更新記憶）
+    if intent == "描述事件":
+        # 更新對話歷史
+        user_memory["history"].append({"role": "user", "content": user_input})
+        user_memory["history"].append({"role": "assistant", "content": final_reply})
+        # 更新業務記憶（上次詐騙類型、摘要、回覆）
+        user_memory["memory"]["lastScamType"] = scam_type
+        user_memory["memory"]["lastEventSummary"] = user_input
+        user_memory["memory"]["lastResponse"] = final_reply
+        # 寫回記憶檔
+        memory_manager.update_user_memory(session_id, user_memory)
+
+    return final_reply
+
 @api_bp.route("/ask", methods=["POST"])
 def ask():
     """
     核心API路由：處理使用者查詢，返回分析結果
     請求參數：{"question": "使用者輸入", "latitude": 緯度, "longitude": 經度}
-    響應格式：{"answer": "回覆內容", "scam_type": "詐騙類型", "intent": "意圖"}
+    響應格式：{"answer": "回覆內容", "scam_type": "詐騙類型", "intent": "意圖", "degraded": 是否為降級模式}
     """
     try:
         # 1. 解析請求參數
@@ -45,6 +180,7 @@ def ask():
         session_id = request.remote_addr  # 以使用者IP作為session_id
         latitude = request_data.get("latitude")
         longitude = request_data.get("longitude")
+        set_current_user(session_id)  # Ollama 排程依使用者輪流
         
         logger.info(f"收到使用者查詢：session_id={session_id} | input={user_input[:50]}...")
         
@@ -52,141 +188,151 @@ def ask():
         if not user_input:
             logger.warning("使用者輸入為空")
             return jsonify({"answer": "⚠️ 請輸入問題。"}), 400
+
+        # 時間預算：分類、檢索、生成、地理反查、日誌各階段共用；預估排隊已超過預算時直接快速回覆
+        deadline.start(deadline.WEB_SECONDS)
+        if ask_pipeline.should_shed():
+            return jsonify(ask_pipeline.shed_reply(user_input))
         
-        # 2. 初始化變數
-        county = "未知地區"  # 預設縣市
-        final_reply = ""
-        scam_type = "無法分類"
-        intent = "描述事件"
-        
-        # 3. 讀取使用者記憶
+        # 2. 讀取使用者記憶
         user_memory = memory_manager.get_user_memory(session_id)
         history = user_memory["history"]  # 對話歷史（最近5條）
         
-        # 4. 意圖判斷
-        intent = intent_classifier.classify_intent(user_input, history)
-        
-        # 5. 處理不同意圖
-        # 5.1 閒聊意圖：直接返回預設回覆
-        if intent == "閒聊":
-            final_reply = ReplyFormatter.get_default_reply(intent)
-            return jsonify({
-                "answer": final_reply,
-                "scam_type": scam_type,
-                "intent": intent
-            })
-        
-        # 5.2 查詢記憶意圖：返回歷史記憶
-        if intent == "查詢記憶":
-            # 從記憶中提取上次分析結果
-            last_memory = user_memory["memory"]
-            last_scam_type = last_memory.get("lastScamType", "未知")
-            last_summary = last_memory.get("lastEventSummary", "目前沒有摘要。")
-            last_response = last_memory.get("lastResponse", "目前沒有記錄回覆內容。")
-            
-            # 根據使用者查詢關鍵字返回對應記憶
-            if any(keyword in user_input for keyword in ["類型", "什麼詐騙", "哪種類型"]):
-                final_reply = f"🧠 你上次的詐騙類型是「{last_scam_type}」。"
-            elif any(keyword in user_input for keyword in ["機率", "風險", "可能性"]):
-                # 與最新用語一致：不顯示百分比，改用風險等級
-                final_reply = "📊 我記得你上次問到的案件，詐騙風險：高。"
-            elif any(keyword in user_input for keyword in ["內容", "回覆", "分析"]):
-                final_reply = f"📋 上次的回覆內容是：\n{last_response[:100]}..."
-            elif any(keyword in user_input for keyword in ["摘要", "描述", "提到"]):
-                final_reply = f"📌 你上次提到的內容是：{last_summary[:100]}..."
-            else:
-                final_reply = f"🧠 你上次的詐騙類型是「{last_scam_type}」，內容是：{last_summary[:50]}..."
-            
-            return jsonify({
-                "answer": final_reply,
-                "scam_type": last_scam_type,
-                "intent": intent
-            })
+        # 3. 意圖判斷（併發模式下其餘階段同時送出，結果與循序模式相同）
+        stages = ask_pipeline.start(user_input, history)
+        intent = stages.get("intent")
         
-        # 5.3 非閒聊/查詢記憶：檢查是否與詐騙相關
-        is_related = scam_related_checker.is_related(user_input, history)
-        if not is_related:
-            # 與 LINE 一致的保守策略：命中高信號關鍵詞則視為相關
-            high_signal_keywords = [
-                "銀行", "客服", "帳戶", "帳號", "轉帳", "匯款", "ATM", "異常交易", "驗證碼", "OTP",
-                "檢察官", "法院", "拘票", "地檢署", "警察", "逮捕", "不配合", "保密"
-            ]
-            if any(kw in user_input for kw in high_signal_keywords):
-                logger.warning("相關性檢查為 False，但命中高信號關鍵詞，改視為相關並繼續分析。")
-            else:
-                final_reply = "抱歉，您的問題似乎與詐騙無關，我目前專注於詐騙相關問題。"
-                return jsonify({
-                    "answer": final_reply,
-                    "scam_type": scam_type,
-                    "intent": intent
-                })
+        # 4. 處理不需分析的意圖（閒聊 / 查詢記憶 / 與詐騙無關）
+        early = _early_reply(stages, intent, user_input, user_memory)
+        if early:
+            early["degraded"] = stages.degraded
+            return jsonify(early)
         
-        # 5.4 詐騙相關：呼叫Ollama獲取分析結果
+        # 5. 詐騙相關：呼叫Ollama獲取分析結果
         # 5.4.1 呼叫Ollama生成回答（詐騙分析）
-        system_prompt = (
-            "你是一位專業的詐騙分析助手。"
-            "嚴格限制回答只針對詐騙相關問題，若使用者提問與詐騙無關，"
-            "請禮貌回覆「抱歉，我只能回答詐騙相關問題」。"
-            "回答內容請精準且聚焦於詐騙分析，不得漫談其他主題。"
-            "請不要主動提及今天日期。"
-        )
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(history)
-        messages.append({"role": "user", "content": f"請分析：{user_input}"})
-        
-        from utils.ollama_client import OllamaClient
-        from config import config
-        ollama_config = config["ollama"]
-        ollama_client = OllamaClient(ollama_config["base_url"], ollama_config["web_model"])
-        answer = ollama_client.send_chat_request(messages)
-        
-        # 處理Ollama呼叫失敗
-        if not answer:
-            answer = "對不起，我無法連接到伺服器，請稍後再試。"
-        
         # 5.4.2 詐騙類型分類
-        scam_type = scam_classifier.classify_scam_type(user_input, history)
+        answer = stages.get("answer")
+        scam_type = stages.get("scam_type")
         
-        # 5.4.3 地理位置反查（若提供經緯度）
-        if latitude and longitude:
-            county = geo_reverser.reverse_geo(float(latitude), float(longitude))
-            # 更新縣市統計
-            geo_reverser.update_location_stats(county)
-        
-        # 5.4.4 寫入日誌（CSV + MySQL）
-        csv_logger.log_scam(user_input, scam_type, county)
-        mysql_logger.log_scam(user_input, scam_type, county)
-        
-        # 5.4.5 格式化回覆
-        if ReplyFormatter.should_format(intent, scam_type, answer):
-            final_reply = ReplyFormatter.format_reply(scam_type, answer)
-        else:
-            final_reply = answer
-        
-        # 5.4.6 更新使用者記憶（僅「描述事件」意圖更新記憶）
-        if intent == "描述事件":
-            # 更新對話歷史
-            user_memory["history"].append({"role": "user", "content": user_input})
-            user_memory["history"].append({"role": "assistant", "content": final_reply})
-            # 更新業務記憶（上次詐騙類型、摘要、回覆）
-            user_memory["memory"]["lastScamType"] = scam_type
-            user_memory["memory"]["lastEventSummary"] = user_input
-            user_memory["memory"]["lastResponse"] = final_reply
-            # 寫回記憶檔
-            memory_manager.update_user_memory(session_id, user_memory)
+        # 5.4.3 ~ 5.4.6 地理反查、寫入日誌、格式化回覆、更新記憶
+        final_reply = _finalize_reply(
+            session_id, user_input, user_memory, intent, scam_type, answer, latitude, longitude
+        )
         
         # 6. 返回響應
         logger.info(f"處理完成：session_id={session_id} | scam_type={scam_type} | intent={intent}")
         return jsonify({
             "answer": final_reply,
             "scam_type": scam_type,
-            "intent": intent
+            "intent": intent,
+            "degraded": stages.degraded
         })
+
+    except deadline.DeadlineExceeded as e:
+        logger.warning(f"{e}，改用快速回覆")
+        return jsonify(ask_pipeline.shed_reply(user_input))
     
     except Exception as e:
         logger.error(f"處理/ask請求失敗：{str(e)}", exc_info=True)
         return jsonify({"answer": "⚠️ 發生錯誤，請稍後再試。"}), 500
 
+    finally:
+        deadline.clear()
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """組合一則 Server-Sent Events 訊息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@api_bp.route("/ask/stream", methods=["POST"])
+def ask_stream():
+    """
+    串流版 /api/ask（Server-Sent Events）
+    請求參數：同 /api/ask
+    事件依序：
+      intent     {"intent": "..."}
+      token      {"text": "..."}          分析內容逐段輸出
+      scam_type  {"scam_type": "..."}
+      header     {"header": "..."}        格式化回覆的標題區塊（類型/風險）
+      done       {"answer": "...", "scam_type": "...", "intent": "...", "degraded": false}  與 /api/ask 相同的最終結果
+      error      {"answer": "..."}
+    """
+    request_data = request.get_json(silent=True) or {}
+    user_input = (request_data.get("question") or "").strip()
+    session_id = request.remote_addr  # 以使用者IP作為session_id
+    latitude = request_data.get("latitude")
+    longitude = request_data.get("longitude")
+
+    logger.info(f"收到串流查詢：session_id={session_id} | input={user_input[:50]}...")
+
+    if not user_input:
+        logger.warning("使用者輸入為空")
+        return jsonify({"answer": "⚠️ 請輸入問題。"}), 400
+
+    def generate():
+        try:
+            set_current_user(session_id)  # Ollama 排程依使用者輪流
+            deadline.start(deadline.WEB_SECONDS)
+            if ask_pipeline.should_shed():
+                yield _sse_event("done", ask_pipeline.shed_reply(user_input))
+                return
+            user_memory = memory_manager.get_user_memory(session_id)
+            history = user_memory["history"]
+
+            stages = ask_pipeline.start(user_input, history, stream_answer=True)
+            intent = stages.get("intent")
+            yield _sse_event("intent", {"intent": intent})
+
+            early = _early_reply(stages, intent, user_input, user_memory)
+            if early:
+                early["degraded"] = stages.degraded
+                yield _sse_event("done", early)
+                return
+
+            # 分析內容邊生成邊輸出；類型分類在背景（併發模式）或生成完成後取得
+            chunks = []
+            for chunk in ask_pipeline.analyze_stream(user_input, stages.history):
+                chunks.append(chunk)
+                yield _sse_event("token", {"text": chunk})
+            answer = "".join(chunks).strip()
+            degraded = stages.degraded
+            if not answer:
+                # 與 /api/ask 相同：時間預算用盡或熔斷中改用降級回覆，其餘為連線錯誤訊息
+                answer = ask_pipeline._failed_answer(user_input)
+                degraded = degraded or deadline.expired()
+
+            scam_type = stages.get("scam_type")
+            yield _sse_event("scam_type", {"scam_type": scam_type})
+
+            final_reply = _finalize_reply(
+                session_id, user_input, user_memory, intent, scam_type, answer, latitude, longitude
+            )
+            if final_reply != answer:
+                header = final_reply.split("🔍 分析內容：", 1)[0].strip()
+                yield _sse_event("header", {"header": header})
+
+            logger.info(f"串流處理完成：session_id={session_id} | scam_type={scam_type} | intent={intent}")
+            yield _sse_event("done", {
+                "answer": final_reply,
+                "scam_type": scam_type,
+                "intent": intent,
+                "degraded": degraded
+            })
+        except deadline.DeadlineExceeded as e:
+            logger.warning(f"{e}，改用快速回覆")
+            yield _sse_event("done", ask_pipeline.shed_reply(user_input))
+        except Exception as e:
+            logger.error(f"處理/ask/stream請求失敗：{str(e)}", exc_info=True)
+            yield _sse_event("error", {"answer": "⚠️ 發生錯誤，請稍後再試。"})
+        finally:
+            deadline.clear()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_bp.route("/memory", methods=["GET"])
 def get_memory():
     """
@@ -216,24 +362,54 @@ def health_check():
     健康檢查路由（用於監控）
     響應格式：{"status": "healthy", "collection_ready": 是否準備就緒}
     """
-    from src.data_loader import DataLoader
-    from config import config
-    
-    # 檢查資料集合是否準備就緒（需嘗試載入）
-    data_loader = DataLoader(config)
-    try:
-        data_loader.load_embeddings()
-    except Exception:
-        pass
+    # 檢查資料集合是否準備就緒（唯讀：只查看 LINE 端啟動時載入的 collection，不重新載入）
+    from routes.line_webhook_routes import data_loader
     collection_ready = bool(data_loader.get_collection())
     
+    from utils.ollama_balancer import all_pools_status
+    from utils.result_cache import all_cache_stats
+    from utils.ollama_scheduler import scheduler
+    from utils.model_residency import get_residency_manager
+    from routes.line_webhook_routes import line_handler
+    residency = get_residency_manager()
+
     return jsonify({
         "status": "healthy",
         "collection_ready": collection_ready,
+        "ollama_backends": all_pools_status(),
+        "ollama_scheduler": scheduler.status(),
+        "ollama_models": residency.status() if residency else None,
+        "caches": all_cache_stats(),
+        "semantic_cache": ask_pipeline.semantic_cache.stats() if ask_pipeline.semantic_cache else None,
+        "line_queue": line_handler.dispatcher.status() if line_handler.dispatcher else None,
+        "line_dedup": line_handler.dedup_store.stats() if line_handler.dedup_store else None,
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     })
 
 
+@api_bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    匯出行程內指標（計數器、量測值、分佈），並附上各分類器信心閘門的 LLM 略過率
+    響應格式：{"counters": {}, "gauges": {}, "observations": {}, "classifier_gate": {"intent": {"skipped": 1, "llm": 3, "skip_rate": 0.25}, ...}}
+    """
+    from utils import metrics
+
+    data = metrics.snapshot()
+    gate = {}
+    for name in ("intent", "related", "scam_type"):
+        skipped = data["counters"].get(f"classifier_gate.{name}.skipped", 0)
+        called = data["counters"].get(f"classifier_gate.{name}.llm", 0)
+        total = skipped + called
+        gate[name] = {
+            "skipped": skipped,
+            "llm": called,
+            "skip_rate": round(skipped / total, 4) if total else 0.0
+        }
+    data["classifier_gate"] = gate
+    return jsonify(data)
+
+
 @api_bp.route("/fraud-stats", methods=["GET"])
 def fraud_stats():
     """
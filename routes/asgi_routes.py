@@ -0,0 +1,113 @@
+import asyncio
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from utils.log import logger
+from utils.ollama_scheduler import set_current_user
+from utils import deadline
+from routes.api_routes import (
+    ask_pipeline, memory_manager, geo_reverser,
+    _intent_reply, _unrelated_reply, _finalize_reply
+)
+from routes.line_webhook_routes import line_handler
+
+# 非同步路由（ASGI 部署，見 app/asgi.py）：與 Flask 版共用相同的服務實例與回覆邏輯
+# LLM / embedding / 地理反查走非同步 HTTP；記憶檔、日誌、Chroma 等同步 I/O 交由執行緒執行
+
+
+async def ask(request: Request):
+    """
+    /api/ask 的非同步版本（請求/響應格式與 Flask 版相同）
+    """
+    try:
+        # 1. 解析請求參數
+        request_data = await request.json()
+        user_input = (request_data.get("question") or "").strip()
+        session_id = request.client.host if request.client else ""  # 以使用者IP作為session_id
+        latitude = request_data.get("latitude")
+        longitude = request_data.get("longitude")
+        set_current_user(session_id)  # Ollama 排程依使用者輪流（僅影響此請求的 task）
+
+        logger.info(f"收到使用者查詢（async）：session_id={session_id} | input={user_input[:50]}...")
+
+        if not user_input:
+            logger.warning("使用者輸入為空")
+            return JSONResponse({"answer": "⚠️ 請輸入問題。"}, status_code=400)
+
+        # 時間預算（同 Flask 版）：預估排隊已超過預算時直接快速回覆
+        deadline.start(deadline.WEB_SECONDS)
+        if ask_pipeline.should_shed():
+            return JSONResponse(ask_pipeline.shed_reply(user_input))
+
+        # 2. 讀取使用者記憶
+        user_memory = await asyncio.to_thread(memory_manager.get_user_memory, session_id)
+
+        # 3. 意圖判斷（併發模式下其餘階段同時以 task 送出）
+        stages = ask_pipeline.start_async(user_input, user_memory["history"])
+        intent = await stages.get("intent")
+
+        # 4. 處理不需分析的意圖（閒聊 / 查詢記憶 / 與詐騙無關）
+        early = _intent_reply(stages, intent, user_input, user_memory)
+        if not early:
+            early = _unrelated_reply(stages, intent, user_input, await stages.get("related"))
+        if early:
+            early["degraded"] = stages.degraded
+            return JSONResponse(early)
+
+        # 5. 詐騙分析與類型分類
+        answer = await stages.get("answer")
+        scam_type = await stages.get("scam_type")
+
+        # 6. 地理反查（非同步），其餘收尾（日誌、格式化、記憶）於執行緒執行
+        county = None
+        if latitude and longitude:
+            county = await geo_reverser.reverse_geo_async(float(latitude), float(longitude))
+            await asyncio.to_thread(geo_reverser.update_location_stats, county)
+        final_reply = await asyncio.to_thread(
+            _finalize_reply,
+            session_id, user_input, user_memory, intent, scam_type, answer, latitude, longitude, county
+        )
+
+        logger.info(f"處理完成（async）：session_id={session_id} | scam_type={scam_type} | intent={intent}")
+        return JSONResponse({
+            "answer": final_reply,
+            "scam_type": scam_type,
+            "intent": intent,
+            "degraded": stages.degraded
+        })
+
+    except deadline.DeadlineExceeded as e:
+        logger.warning(f"{e}，改用快速回覆")
+        return JSONResponse(ask_pipeline.shed_reply(user_input))
+
+    except Exception as e:
+        logger.error(f"處理/ask請求失敗：{str(e)}", exc_info=True)
+        return JSONResponse({"answer": "⚠️ 發生錯誤，請稍後再試。"}, status_code=500)
+
+
+async def line_webhook(request: Request):
+    """
+    LINE Webhook 的非同步版本（/line/webhook 與 /webhook）
+    """
+    try:
+        signature = request.headers.get("X-Line-Signature", "")
+        request_body = (await request.body()).decode("utf-8")
+
+        logger.info(f"收到Line Webhook請求（async, {request.url.path}）")
+
+        if await line_handler.handle_webhook_async(request_body, signature):
+            logger.info("Line Webhook處理成功")
+            return PlainTextResponse("OK", status_code=200)
+        logger.warning("Line Webhook處理失敗（簽章無效或請求錯誤）")
+        return PlainTextResponse("Invalid request", status_code=400)
+
+    except Exception as e:
+        logger.error(f"處理Line Webhook失敗：{str(e)}", exc_info=True)
+        return PlainTextResponse("Internal Server Error", status_code=500)
+
+
+routes = [
+    Route("/api/ask", ask, methods=["POST"]),
+    Route("/line/webhook", line_webhook, methods=["POST"]),
+    Route("/webhook", line_webhook, methods=["POST"]),
+]
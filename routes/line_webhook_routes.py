@@ -1,9 +1,10 @@
 from flask import Blueprint, request
 from utils.log import logger
 from src.line_handler import LineHandler
-from src.query_engine import QueryEngine
+from src.query_engine import QueryEngine, retrieval_mode
 from src.response_generator import ResponseGenerator
-from src.data_loader import DataLoader
+from src.data_loader import DataLoader, current_corpus_version
+from src.semantic_cache import SemanticCache
 from config import config
 
 # 建立Blueprint
@@ -15,10 +16,17 @@ data_loader = DataLoader(config)
 data_loader.load_embeddings()  # 載入嵌入資料
 # 建立Line專用的查詢引擎與回應生成器（從配置獲取參數）
 line_ollama_config = config["ollama"]["line"]
-line_query_engine = QueryEngine(data_loader.get_collection(), line_ollama_config)
+# hybrid / lexical 檢索模式需要語料的 BM25 倒排索引（啟動時建立）
+line_lexical_index = data_loader.get_lexical_index() if retrieval_mode(line_ollama_config) != "vector" else None
+line_query_engine = QueryEngine(data_loader.get_collection(), line_ollama_config, lexical_index=line_lexical_index)
 line_response_generator = ResponseGenerator(line_ollama_config)
+# 可選：語意快取（config.cache.semantic.enabled）
+line_semantic_cache = SemanticCache.from_config(
+    (config.get("cache", {}) or {}).get("semantic", {}),
+    version_fn=current_corpus_version
+)
 # 初始化Line Handler
-line_handler = LineHandler(config, line_query_engine, line_response_generator)
+line_handler = LineHandler(config, line_query_engine, line_response_generator, line_semantic_cache)
 
 @line_bp.route("/webhook", methods=["POST"])
 def webhook():
@@ -6,15 +6,23 @@ def main():
     """
     應用入口函數：建立應用並啟動伺服器
     """
-    # 1. 建立Flask應用
-    app = create_app()
-    
-    # 2. 從配置獲取伺服器參數
+    # 1. 從配置獲取伺服器參數
     server_config = config["server"]
     host = server_config["host"]
     port = server_config["port"]
     debug = server_config.get("debug", False)  # 除錯模式（生產環境關閉）
     
+    # ASGI 模式：/api/ask 與 LINE Webhook 走非同步路徑（uvicorn），其餘路由沿用Flask
+    # Flask應用由 app.asgi 匯入時建立，此處不另建，避免藍圖註冊與啟動程序執行兩次
+    if server_config.get("asgi", False):
+        import uvicorn
+        logger.info(f"啟動ASGI伺服器：http://{host}:{port}")
+        uvicorn.run("app.asgi:app", host=host, port=port, log_level="debug" if debug else "info")
+        return
+
+    # 2. 建立Flask應用
+    app = create_app()
+
     # 3. 啟動伺服器
     logger.info(f"啟動伺服器：http://{host}:{port} | debug={debug}")
     app.run(
@@ -0,0 +1,361 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Iterator, Optional
+from utils.ollama_client import OllamaClient
+from utils.ollama_balancer import resolve_backends
+from utils.log import logger
+from utils import deadline, metrics
+from utils.ollama_scheduler import scheduler
+from config import config
+from services.intent_classifier import IntentClassifier
+from services.scam_related_check import ScamRelatedChecker
+from services.scam_classifier import ScamClassifier
+from services.combined_classifier import CombinedClassifier
+from src.query_engine import QueryEngine
+from src.semantic_cache import SemanticCache
+from src.data_loader import current_corpus_version
+from utils.result_cache import history_digest
+from utils.prompt_budget import compact_history, report_prompt
+
+# 分類相關階段（合併分類模式下由同一次 LLM 呼叫提供）
+CLASSIFICATION_STAGES = ("intent", "related", "scam_type")
+
+ANALYSIS_SYSTEM_PROMPT = (
+    "你是一位專業的詐騙分析助手。"
+    "嚴格限制回答只針對詐騙相關問題，若使用者提問與詐騙無關，"
+    "請禮貌回覆「抱歉，我只能回答詐騙相關問題」。"
+    "回答內容請精準且聚焦於詐騙分析，不得漫談其他主題。"
+    "請不要主動提及今天日期。"
+)
+
+
+class AskPipeline:
+    def __init__(
+        self,
+        intent_classifier: IntentClassifier,
+        scam_related_checker: ScamRelatedChecker,
+        scam_classifier: ScamClassifier
+    ):
+        """
+        初始化 /api/ask 的 LLM 階段管線（設定來自 config.pipeline）
+
+        - concurrent：各階段同時送出到有界執行緒池，否則循序執行
+        - combined_classification：意圖/相關性/類型改為單次 JSON 分類呼叫
+        """
+        pipeline_config = config.get("pipeline", {}) or {}
+        self.concurrent = bool(pipeline_config.get("concurrent", False))
+        self.intent_classifier = intent_classifier
+        self.scam_related_checker = scam_related_checker
+        self.scam_classifier = scam_classifier
+        self.combined_classifier: Optional[CombinedClassifier] = None
+        if pipeline_config.get("combined_classification", False):
+            self.combined_classifier = CombinedClassifier(
+                intent_classifier, scam_related_checker, scam_classifier
+            )
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(pipeline_config.get("max_workers", 8)),
+            thread_name_prefix="ask-llm"
+        )
+        ollama_config = config["ollama"]
+        self.ollama_client = OllamaClient(resolve_backends(ollama_config), ollama_config["web_model"])
+        # 可選：語意快取（沿用 QueryEngine 的 embedding 路徑；僅需向量，不需 collection）
+        self.semantic_cache = SemanticCache.from_config(
+            (config.get("cache", {}) or {}).get("semantic", {}),
+            version_fn=current_corpus_version
+        )
+        self.embedder = QueryEngine(None, ollama_config.get("line", {})) if self.semantic_cache else None
+
+    def is_degraded(self) -> bool:
+        """Ollama 熔斷中：各分類器會立即改用關鍵字啟發式，分析改用降級回覆"""
+        return self.ollama_client.is_degraded()
+
+    def degraded_answer(self, user_input: str) -> str:
+        """
+        降級模式的分析內容：僅依關鍵字啟發式判斷詐騙類型，立即回覆
+        """
+        scam_type = self.scam_classifier.resolve_scam_type(user_input, None)
+        notice = "⚠️ 分析服務暫時忙碌，以下為關鍵字初步判斷，建議稍後再試以取得完整分析。"
+        if scam_type == "無法分類":
+            return f"{notice}\n目前無法從關鍵字判斷詐騙類型，請提供更多細節，或撥打 165 反詐騙專線查證。"
+        return (
+            f"{notice}\n您的描述與「{scam_type}」的常見手法相符，詐騙風險：高。\n"
+            "請勿依對方指示轉帳、提供帳戶或驗證碼。"
+        )
+
+    def should_shed(self) -> bool:
+        """
+        負載卸除：預估排隊時間已超過本次請求剩餘的時間預算時回傳 True
+        （呼叫端改以 shed_reply 立即回覆，不佔用 Ollama）
+        """
+        left = deadline.remaining()
+        if left is None:
+            return False
+        predicted = scheduler.predicted_wait(self.ollama_client.request_class)
+        if predicted <= left:
+            return False
+        metrics.increment("ask.shed")
+        logger.warning(f"預估排隊 {predicted:.1f}s 超過時間預算 {left:.1f}s，改用快速回覆")
+        return True
+
+    def shed_reply(self, user_input: str) -> Dict[str, Any]:
+        """
+        快速回覆（負載卸除或時間預算用盡時）：意圖/類型皆採關鍵字啟發式，分析內容同降級模式
+        """
+        return {
+            "answer": self.degraded_answer(user_input),
+            "scam_type": self.scam_classifier.resolve_scam_type(user_input, None),
+            "intent": self.intent_classifier.resolve_intent(user_input, None),
+            "degraded": True
+        }
+
+    def _failed_answer(self, user_input: str) -> str:
+        """分析呼叫失敗時的回覆：時間預算用盡或熔斷中（含試探失敗、試探進行中被拒）改用降級回覆，其餘為連線錯誤訊息"""
+        if deadline.expired() or self.is_degraded():
+            return self.degraded_answer(user_input)
+        return "對不起，我無法連接到伺服器，請稍後再試。"
+
+    def _analysis_messages(self, user_input: str, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """組合分析訊息（對話歷史依 analyze 階段的 token 預算整理）"""
+        messages = [{"role": "system", "content": ANALYSIS_SYSTEM_PROMPT}]
+        messages.extend(compact_history(history, "analyze"))
+        messages.append({"role": "user", "content": f"請分析：{user_input}"})
+        report_prompt("analyze", messages)
+        return messages
+
+    def analyze(self, user_input: str, history: List[Dict[str, str]]) -> str:
+        """
+        呼叫Ollama生成詐騙分析內容（失敗時回傳預設錯誤訊息；熔斷中回傳降級回覆）
+        """
+        if self.is_degraded():
+            return self.degraded_answer(user_input)
+
+        embedding, namespace, cached = self._semantic_lookup(user_input, history)
+        if cached:
+            return cached
+
+        messages = self._analysis_messages(user_input, history)
+
+        answer = self.ollama_client.send_chat_request(messages)
+
+        # 處理Ollama呼叫失敗
+        if not answer:
+            return self._failed_answer(user_input)
+        self._semantic_store(embedding, namespace, answer)
+        return answer
+
+    def _semantic_lookup(self, user_input: str, history: List[Dict[str, str]]):
+        """
+        語意快取查詢：回傳 (embedding, namespace, 命中的分析內容或None)
+        namespace 含對話歷史摘要，避免不同上下文共用同一分析
+        """
+        if not self.semantic_cache:
+            return None, "", None
+        namespace = f"web:{history_digest(history)}"
+        embedding = self.embedder.embed(user_input)
+        return embedding, namespace, self.semantic_cache.lookup(embedding, namespace)
+
+    def _semantic_store(self, embedding, namespace: str, answer: str) -> None:
+        if self.semantic_cache and embedding is not None:
+            self.semantic_cache.store(embedding, answer, namespace)
+
+    async def analyze_async(self, user_input: str, history: List[Dict[str, str]]) -> str:
+        """
+        analyze 的非同步版本（ASGI 路徑）
+        """
+        if self.is_degraded():
+            return self.degraded_answer(user_input)
+
+        embedding, namespace = None, ""
+        if self.semantic_cache:
+            namespace = f"web:{history_digest(history)}"
+            embedding = await self.embedder.embed_async(user_input)
+            cached = self.semantic_cache.lookup(embedding, namespace)
+            if cached:
+                return cached
+
+        messages = self._analysis_messages(user_input, history)
+
+        answer = await self.ollama_client.send_chat_request_async(messages)
+        if not answer:
+            return self._failed_answer(user_input)
+        self._semantic_store(embedding, namespace, answer)
+        return answer
+
+    def analyze_stream(self, user_input: str, history: List[Dict[str, str]]) -> Iterator[str]:
+        """
+        串流版 analyze：逐段產出Ollama生成的分析內容（失敗時不產出任何內容；熔斷中產出降級回覆）
+        """
+        if self.is_degraded():
+            yield self.degraded_answer(user_input)
+            return
+
+        embedding, namespace, cached = self._semantic_lookup(user_input, history)
+        if cached:
+            yield cached
+            return
+
+        messages = self._analysis_messages(user_input, history)
+        chunks = []
+        stream = self.ollama_client.stream_chat_request(messages)
+        while True:
+            try:
+                chunk = next(stream)
+            except StopIteration as stop:
+                # 僅完整生成的內容寫入語意快取（中途失敗的片段不快取）
+                if stop.value:
+                    self._semantic_store(embedding, namespace, "".join(chunks).strip())
+                break
+            chunks.append(chunk)
+            yield chunk
+
+    def start(
+        self,
+        user_input: str,
+        history: List[Dict[str, str]],
+        stream_answer: bool = False
+    ) -> "AskStages":
+        """
+        建立單次請求的階段集合；併發模式下立即送出所有互不依賴的階段
+
+        Args:
+            stream_answer: 分析內容由呼叫端以 analyze_stream 串流取得，不送出 answer 階段
+        """
+        return AskStages(self, user_input, history, stream_answer)
+
+    def start_async(self, user_input: str, history: List[Dict[str, str]]) -> "AsyncAskStages":
+        """
+        非同步版 start（需在事件迴圈中呼叫）；併發模式下各階段以 asyncio task 同時送出
+        """
+        return AsyncAskStages(self, user_input, history)
+
+
+class AskStages:
+    def __init__(
+        self,
+        pipeline: AskPipeline,
+        user_input: str,
+        history: List[Dict[str, str]],
+        stream_answer: bool = False
+    ):
+        """
+        單次請求的 LLM 階段：依需要取得結果，結果與循序模式一致
+        history 先複製一份，避免後續更新記憶時影響執行中的階段
+        """
+        self.pipeline = pipeline
+        self.user_input = user_input
+        self.history = list(history)
+        self.stream_answer = stream_answer
+        # 降級模式：各階段皆為本地啟發式，不需送到執行緒池
+        self._degraded_at_start = pipeline.is_degraded()
+        self._futures: Dict[str, Future] = {}
+        self._classification: Optional[Dict[str, Any]] = None
+        if pipeline.concurrent and not self._degraded_at_start:
+            self._submit_all()
+
+    @property
+    def degraded(self) -> bool:
+        """本次請求是否（部分）由降級模式回答"""
+        return self._degraded_at_start or self.pipeline.is_degraded()
+
+    def _runner(self, name: str):
+        """回傳指定階段的實際執行函式"""
+        pipeline = self.pipeline
+        if name == "classification":
+            return pipeline.combined_classifier.classify
+        return {
+            "intent": pipeline.intent_classifier.classify_intent,
+            "related": pipeline.scam_related_checker.is_related,
+            "answer": pipeline.analyze,
+            "scam_type": pipeline.scam_classifier.classify_scam_type,
+        }[name]
+
+    def _submit_all(self) -> None:
+        if self.pipeline.combined_classifier:
+            names = ["classification", "answer"]
+        else:
+            names = ["intent", "related", "answer", "scam_type"]
+        if self.stream_answer:
+            names.remove("answer")
+        for name in names:
+            self._futures[name] = self._submit(name)
+
+    def _submit(self, name: str) -> Future:
+        # 帶入目前的 contextvars（如排程用的使用者識別）到執行緒池
+        context = contextvars.copy_context()
+        return self.pipeline.executor.submit(context.run, self._runner(name), self.user_input, self.history)
+
+    def _run(self, name: str):
+        """
+        取得階段結果：已送出者等待完成，否則就地執行
+        等待時間受請求的時間預算限制，逾時拋出 DeadlineExceeded
+        """
+        future = self._futures.pop(name, None)
+        if future is not None:
+            try:
+                return future.result(timeout=deadline.remaining())
+            except FutureTimeoutError:
+                future.cancel()
+                raise deadline.DeadlineExceeded(f"等待階段結果超過時間預算：{name}")
+        deadline.check(name)
+        return self._runner(name)(self.user_input, self.history)
+
+    def get(self, name: str):
+        """
+        取得階段結果（intent / related / answer / scam_type）
+        """
+        if name in CLASSIFICATION_STAGES and self.pipeline.combined_classifier:
+            if self._classification is None:
+                self._classification = self._run("classification")
+            return self._classification[name]
+        return self._run(name)
+
+    def discard(self) -> None:
+        """
+        捨棄不再需要的階段：尚未開始者直接取消，已在執行者讓其結束後丟棄結果
+        """
+        if not self._futures:
+            return
+        cancelled = [name for name, future in self._futures.items() if future.cancel()]
+        logger.info(f"捨棄未使用的 LLM 階段：{list(self._futures)}（已取消：{cancelled}）")
+        self._futures.clear()
+
+
+class AsyncAskStages(AskStages):
+    """
+    AskStages 的非同步版本（ASGI 路徑）：各階段為 asyncio task，get 需 await
+    discard 會直接取消進行中的 task（連同其 HTTP 請求）
+    """
+
+    def _runner(self, name: str):
+        pipeline = self.pipeline
+        if name == "classification":
+            return pipeline.combined_classifier.classify_async
+        return {
+            "intent": pipeline.intent_classifier.classify_intent_async,
+            "related": pipeline.scam_related_checker.is_related_async,
+            "answer": pipeline.analyze_async,
+            "scam_type": pipeline.scam_classifier.classify_scam_type_async,
+        }[name]
+
+    def _submit(self, name: str) -> "asyncio.Task":
+        return asyncio.ensure_future(self._runner(name)(self.user_input, self.history))
+
+    async def _run(self, name: str):
+        task = self._futures.pop(name, None)
+        if task is None:
+            deadline.check(name)
+            task = asyncio.ensure_future(self._runner(name)(self.user_input, self.history))
+        left = deadline.remaining()
+        try:
+            return await asyncio.wait_for(task, None if left is None else max(0.0, left))
+        except asyncio.TimeoutError:
+            raise deadline.DeadlineExceeded(f"等待階段結果超過時間預算：{name}")
+
+    async def get(self, name: str):
+        """取得階段結果（intent / related / answer / scam_type）"""
+        if name in CLASSIFICATION_STAGES and self.pipeline.combined_classifier:
+            if self._classification is None:
+                self._classification = await self._run("classification")
+            return self._classification[name]
+        return await self._run(name)
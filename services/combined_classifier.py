@@ -0,0 +1,167 @@
+import json
+import re
+from typing import List, Dict, Any, Optional
+from utils.ollama_client import OllamaClient
+from utils.ollama_balancer import resolve_backends
+from utils.log import logger
+from utils.result_cache import get_classifier_cache, make_cache_key
+from utils.prompt_budget import compact_history, report_prompt
+from config import config
+from services.intent_classifier import IntentClassifier, VALID_INTENTS
+from services.scam_related_check import ScamRelatedChecker
+from services.scam_classifier import ScamClassifier, VALID_SCAM_TYPES
+
+
+class CombinedClassifier:
+    def __init__(
+        self,
+        intent_classifier: IntentClassifier,
+        scam_related_checker: ScamRelatedChecker,
+        scam_classifier: ScamClassifier
+    ):
+        """
+        初始化合併分類器：一次 LLM 呼叫同時取得意圖、相關性與詐騙類型
+        各欄位的驗證與啟發式備援沿用原本三個分類器的決策邏輯
+        """
+        ollama_config = config["ollama"]
+        self.ollama_client = OllamaClient(
+            base_url=resolve_backends(ollama_config),
+            default_model=ollama_config["web_model"],
+            request_class="classify"
+        )
+        # LLM 原始輸出快取（鍵：正規化輸入 + 歷史摘要 + 模型）
+        self.cache = get_classifier_cache("combined")
+        self.intent_classifier = intent_classifier
+        self.scam_related_checker = scam_related_checker
+        self.scam_classifier = scam_classifier
+        self.system_prompt = self._build_system_prompt()
+
+    def _build_system_prompt(self) -> str:
+        """
+        構建合併分類的System Prompt（要求只輸出JSON物件）
+        """
+        intents = "、".join(VALID_INTENTS)
+        scam_types = "、".join(VALID_SCAM_TYPES)
+        return (
+            "你是一個對話分類助手，請用繁體中文判斷使用者輸入，並只輸出一個JSON物件，勿加任何解釋：\n"
+            '{"intent": "...", "related": true, "scam_type": "..."}\n'
+            f"- intent：使用者意圖，只能是以下之一：{intents}\n"
+            "- related：輸入是否與詐騙主題相關（true 或 false）\n"
+            f"- scam_type：事件所屬的詐騙類型，只能是以下之一：{scam_types}。"
+            "若事件不屬於任何類型，或描述的是政府、銀行或郵局的「正常合法流程」，請填「無法分類」。"
+        )
+
+    @staticmethod
+    def _parse_json(raw: Optional[str]) -> Dict[str, Any]:
+        """
+        從LLM輸出擷取JSON物件（容錯：允許前後夾雜文字）；失敗時回傳空dict
+        """
+        if not raw:
+            return {}
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            m = re.search(r"\{.*\}", raw, re.DOTALL)
+            if not m:
+                return {}
+            try:
+                data = json.loads(m.group(0))
+            except ValueError:
+                return {}
+        return data if isinstance(data, dict) else {}
+
+    @staticmethod
+    def _parse_related(value: Any) -> Optional[bool]:
+        """將 related 欄位解析為布林；無法判斷時回傳 None"""
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str):
+            return ScamRelatedChecker._parse_llm_yes_no(value)
+        return None
+
+    def _build_messages(self, user_input: str, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": self.system_prompt}]
+        # 對話歷史依分類階段的 token 預算整理（先前的格式化回覆改為摘要）
+        messages.extend(compact_history(history, "classify"))
+        messages.append({"role": "user", "content": user_input})
+        report_prompt("combined", messages)
+        return messages
+
+    def classify(
+        self,
+        user_input: str,
+        history: List[Dict[str, str]]
+    ) -> Dict[str, Any]:
+        """
+        單次LLM呼叫取得三項分類結果，逐欄驗證並在無效時回退到各自的啟發式
+
+        Args:
+            user_input: 使用者輸入
+            history: 對話歷史
+
+        Returns:
+            Dict: {"intent": str, "related": bool, "scam_type": str}
+        """
+        raw_result = None
+        try:
+            messages = self._build_messages(user_input, history)
+            raw_result = self.cache.get_or_compute(
+                make_cache_key(user_input, history, self.ollama_client.default_model),
+                lambda: self.ollama_client.send_chat_request(messages, response_format="json")
+            )
+        except Exception as e:
+            logger.error(f"合併分類呼叫失敗：{str(e)}")
+        return self._resolve(user_input, raw_result)
+
+    async def classify_async(
+        self,
+        user_input: str,
+        history: List[Dict[str, str]]
+    ) -> Dict[str, Any]:
+        """classify 的非同步版本（ASGI 路徑），欄位驗證與回退邏輯相同"""
+        raw_result = None
+        try:
+            messages = self._build_messages(user_input, history)
+            raw_result = await self.cache.get_or_compute_async(
+                make_cache_key(user_input, history, self.ollama_client.default_model),
+                lambda: self.ollama_client.send_chat_request_async(messages, response_format="json")
+            )
+        except Exception as e:
+            logger.error(f"合併分類呼叫失敗：{str(e)}")
+        return self._resolve(user_input, raw_result)
+
+    def _resolve(self, user_input: str, raw_result: Optional[str]) -> Dict[str, Any]:
+        """解析合併分類輸出，逐欄驗證並交由各分類器決定最終結果"""
+        data = self._parse_json(raw_result)
+        if raw_result and not data:
+            logger.warning(f"合併分類輸出無法解析為JSON，全部改用啟發式：{raw_result!r}")
+
+        # 各欄位只接受合法值，否則以 None 交由對應分類器的啟發式決定
+        raw_intent = data.get("intent")
+        llm_intent = (
+            self.intent_classifier._parse_intent_from_llm(raw_intent)
+            if isinstance(raw_intent, str) else None
+        )
+        raw_scam_type = data.get("scam_type")
+        llm_scam_type = (
+            ScamClassifier.parse_scam_type(raw_scam_type)
+            if isinstance(raw_scam_type, str) else None
+        )
+        llm_related = self._parse_related(data.get("related"))
+
+        result = {"intent": "描述事件", "related": True, "scam_type": "無法分類"}
+        try:
+            result["intent"] = self.intent_classifier.resolve_intent(user_input, llm_intent, raw_result)
+        except Exception as e:
+            logger.error(f"意圖判斷失敗：{str(e)}")
+        try:
+            result["related"] = self.scam_related_checker.resolve_related(user_input, llm_related, raw_result)
+        except Exception as e:
+            logger.error(f"詐騙相關性檢查失敗：{str(e)}")
+        try:
+            result["scam_type"] = self.scam_classifier.resolve_scam_type(user_input, llm_scam_type, raw_result)
+        except Exception as e:
+            logger.error(f"詐騙類型分類失敗：{str(e)}")
+
+        logger.info(f"合併分類結果：{result}")
+        return result
@@ -0,0 +1,156 @@
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+from utils.log import logger
+
+# 連續多少位數字視為疑似帳號/卡號（與原本的 \d{8,} 相同）
+LONG_NUMBER_DIGITS = 8
+
+
+class KeywordFeatures:
+    def __init__(self, matches: Dict[str, Dict[str, Set[str]]], max_digit_run: int):
+        """
+        單次掃描的特徵向量（唯讀）
+
+        Args:
+            matches: group -> label -> 命中的關鍵字集合（同一關鍵字只計一次）
+            max_digit_run: 最長連續數字長度
+        """
+        self.matches = matches
+        self.max_digit_run = max_digit_run
+
+    def count(self, group: str, label: str) -> int:
+        """某分組標籤命中的相異關鍵字數（等同原本逐一 `kw in text` 的累加）"""
+        return len(self.matches.get(group, {}).get(label, ()))
+
+    def counts(self, group: str) -> Dict[str, int]:
+        return {label: len(kws) for label, kws in self.matches.get(group, {}).items()}
+
+    def matched(self, group: str, label: str) -> Set[str]:
+        return self.matches.get(group, {}).get(label, set())
+
+    def any_hit(self, group: str, label: str) -> bool:
+        return bool(self.matches.get(group, {}).get(label))
+
+    @property
+    def long_number(self) -> bool:
+        """是否含連續 LONG_NUMBER_DIGITS 位以上數字（疑似帳號/卡號）"""
+        return self.max_digit_run >= LONG_NUMBER_DIGITS
+
+
+class KeywordEngine:
+    def __init__(self, groups: Dict[str, Dict[str, List[str]]], cache_size: int = 256):
+        """
+        Aho-Corasick 多樣式比對：所有關鍵字表編譯成一個自動機，單次掃描輸入即得全部命中
+
+        Args:
+            groups: group -> label -> 關鍵字列表（如 scam_type -> 假投資詐騙 -> [...]）
+            cache_size: 最近掃描結果快取筆數（同一輸入在一次請求中會被多個分類器使用）
+        """
+        self._groups = groups
+        # 關鍵字 -> 所屬 (group, label) 列表；同一關鍵字可出現在多個分組
+        self._owners: List[List[Tuple[str, str]]] = []
+        keyword_ids: Dict[str, int] = {}
+        for group, labels in groups.items():
+            for label, keywords in labels.items():
+                for kw in keywords:
+                    if not kw:
+                        continue
+                    if kw not in keyword_ids:
+                        keyword_ids[kw] = len(self._owners)
+                        self._owners.append([])
+                    self._owners[keyword_ids[kw]].append((group, label))
+        self._keywords = list(keyword_ids)
+        self._build(self._keywords)
+        self.scan = lru_cache(maxsize=cache_size)(self._scan)
+        logger.info(f"關鍵字引擎建立完成：{len(self._keywords)} 個關鍵字、{len(self._goto)} 個狀態")
+
+    def _build(self, keywords: List[str]) -> None:
+        """建立 goto / fail / output 表"""
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[List[int]] = [[]]
+        for kid, kw in enumerate(keywords):
+            state = 0
+            for ch in kw:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._output.append([])
+                state = nxt
+            self._output[state].append(kid)
+
+        # BFS 計算失敗連結，並把失敗狀態的輸出併入（掃描時不需再沿 fail 收集）
+        self._fail: List[int] = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def _scan(self, text: Optional[str]) -> KeywordFeatures:
+        goto, fail, output = self._goto, self._fail, self._output
+        hit_ids: Set[int] = set()
+        state = 0
+        digit_run = max_digit_run = 0
+        for ch in text or "":
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                hit_ids.update(output[state])
+            if ch.isdecimal():
+                digit_run += 1
+                if digit_run > max_digit_run:
+                    max_digit_run = digit_run
+            else:
+                digit_run = 0
+
+        # 每個分組皆列出所有標籤（未命中為空集合），維持原本計分字典的鍵順序
+        matches: Dict[str, Dict[str, Set[str]]] = {
+            group: {label: set() for label in labels} for group, labels in self._groups.items()
+        }
+        for kid in hit_ids:
+            kw = self._keywords[kid]
+            for group, label in self._owners[kid]:
+                matches[group][label].add(kw)
+        return KeywordFeatures(matches, max_digit_run)
+
+
+_engine: Optional[KeywordEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_keyword_engine() -> KeywordEngine:
+    """
+    取得行程內共用的關鍵字引擎（首次呼叫時編譯）
+
+    分組：
+        scam_type: 各詐騙類型關鍵字（SCAM_KEYWORDS_MAP）
+        intent: 各意圖啟發式關鍵字
+        high_signal: intent / related / fallback 三組高信號關鍵字
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            # 延遲匯入：關鍵字表定義在各分類器模組，而分類器模組也會匯入本模組
+            from services.intent_classifier import INTENT_KEYWORDS, INTENT_HIGH_SIGNAL_KEYWORDS
+            from services.scam_related_check import RELATED_HIGH_SIGNAL_KEYWORDS, FALLBACK_HIGH_SIGNAL_KEYWORDS
+            from services.scam_classifier import SCAM_KEYWORDS_MAP
+            _engine = KeywordEngine({
+                "scam_type": SCAM_KEYWORDS_MAP,
+                "intent": INTENT_KEYWORDS,
+                "high_signal": {
+                    "intent": INTENT_HIGH_SIGNAL_KEYWORDS,
+                    "related": RELATED_HIGH_SIGNAL_KEYWORDS,
+                    "fallback": FALLBACK_HIGH_SIGNAL_KEYWORDS,
+                },
+            })
+        return _engine
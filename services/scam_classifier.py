@@ -1,6 +1,11 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 from utils.ollama_client import OllamaClient
+from utils.ollama_balancer import resolve_backends
 from utils.log import logger
+from utils import metrics
+from utils.result_cache import get_classifier_cache, make_cache_key
+from utils.prompt_budget import compact_history, report_prompt
+from services.keyword_engine import get_keyword_engine
 from config import config
 
 # (列表不變)
@@ -46,10 +51,19 @@ class ScamClassifier:
         """
         ollama_config = config["ollama"]
         self.ollama_client = OllamaClient(
-            base_url=ollama_config["base_url"],
-            default_model=ollama_config["web_model"]
+            base_url=resolve_backends(ollama_config),
+            default_model=ollama_config["web_model"],
+            request_class="classify"
         )
+        # LLM 原始輸出快取（鍵：正規化輸入 + 歷史摘要 + 模型）
+        self.cache = get_classifier_cache("scam_type")
         self.system_prompt = self._build_system_prompt()
+        self.keywords = get_keyword_engine()
+        # 信心閘門：關鍵字命中數達門檻時略過 LLM（config.classifier_gate.scam_type）
+        # 預設 2 與決策規則 1 一致：命中 >= 2 時最終結果必為啟發式類型，LLM 呼叫不影響結果
+        gate_config = (config.get("classifier_gate", {}) or {}).get("scam_type", {}) or {}
+        self.gate_enabled = bool(gate_config.get("enabled", False))
+        self.gate_min_score = int(gate_config.get("min_score", 2))
 
     def _build_system_prompt(self) -> str:
         """
@@ -84,15 +98,81 @@ class ScamClassifier:
         """
         計算每個詐騙類型的關鍵字命中次數
         """
-        # (此函式保持不變)
-        scores = {scam_type: 0 for scam_type in VALID_SCAM_TYPES}
-        for scam_type, keywords in SCAM_KEYWORDS_MAP.items():
-            count = 0
-            for kw in keywords:
-                if kw in user_input:
-                    count += 1
-            scores[scam_type] = count
-        return scores
+        # 由共用關鍵字引擎單次掃描取得各類型命中數（鍵順序維持 VALID_SCAM_TYPES，同分時排序結果不變）
+        features = self.keywords.scan(user_input)
+        return {scam_type: features.count("scam_type", scam_type) for scam_type in VALID_SCAM_TYPES}
+
+    @staticmethod
+    def parse_scam_type(raw_result: Optional[str]) -> Optional[str]:
+        """
+        從LLM回傳中擷取第一個合法的詐騙類型（無法解析時回傳None）
+        """
+        if not raw_result:
+            return None
+        for valid_type in VALID_SCAM_TYPES:
+            if valid_type in raw_result:
+                return valid_type
+        return None
+
+    def resolve_scam_type(
+        self,
+        user_input: str,
+        llm_scam_type: Optional[str],
+        raw_result: Optional[str] = None
+    ) -> str:
+        """
+        依 LLM 類型（可為 None）與關鍵字啟發式決定最終詐騙類型
+        供 classify_scam_type 與合併分類器（CombinedClassifier）共用
+        """
+        logger.info(f"LLM 判斷類型：{llm_scam_type}（原始：{raw_result}）")
+
+        # 2. 啟發式關鍵字判斷
+        heuristic_scores = self._heuristic_score(user_input)
+        sorted_scores = sorted(heuristic_scores.items(), key=lambda x: x[1], reverse=True)
+        heuristic_scam_type = sorted_scores[0][0]
+        top_score = sorted_scores[0][1]
+        
+        logger.info(f"啟發式判斷類型：{heuristic_scam_type} (分數: {top_score})")
+
+        # 3. 決策邏輯
+        
+        # 規則 1：如果啟發式分數很高（命中 >= 2 個關鍵字），且 LLM 判錯 (或判斷為 "無法分類")
+        if top_score >= 2 and llm_scam_type != heuristic_scam_type:
+            logger.warning(f"LLM 判斷 ({llm_scam_type}) 與高分啟發式 ({heuristic_scam_type}, score={top_score}) 衝突，採用啟發式。")
+            return heuristic_scam_type
+        
+        # 規則 2：如果 LLM 有成功判斷 (且與啟發式不衝突或啟發式分數低)，採用 LLM
+        if llm_scam_type and llm_scam_type != "無法分類":
+            logger.info(f"採用 LLM 判斷：{llm_scam_type}")
+            return llm_scam_type
+        
+        # 規則 3：如果 LLM 判斷為「無法分類」，但啟發式有分數 (>= 1)，採啟發式
+        if (llm_scam_type == "無法分類" or llm_scam_type is None) and top_score > 0:
+             logger.info(f"LLM 無法分類，採用啟發式判斷：{heuristic_scam_type}")
+             return heuristic_scam_type
+        
+        # 規則 4：如果 LLM 和啟發式都沒結果
+        logger.info("LLM 與啟發式皆無明確結果，回傳 LLM 結果或 '無法分類'")
+        return llm_scam_type or "無法分類"
+
+    def _gated_scam_type(self, user_input: str) -> Optional[str]:
+        """信心閘門：啟發式命中數達門檻時直接回傳類型（不呼叫 LLM），否則回傳 None"""
+        if self.gate_enabled:
+            top_score = max(self._heuristic_score(user_input).values())
+            if top_score >= self.gate_min_score:
+                metrics.increment("classifier_gate.scam_type.skipped")
+                logger.info(f"詐騙類型啟發式已足夠明確（分數: {top_score}），略過 LLM")
+                return self.resolve_scam_type(user_input, None)
+        metrics.increment("classifier_gate.scam_type.llm")
+        return None
+
+    def _build_messages(self, user_input: str, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": self.system_prompt}]
+        # 對話歷史依分類階段的 token 預算整理（先前的格式化回覆改為摘要）
+        messages.extend(compact_history(history, "classify"))
+        messages.append({"role": "user", "content": user_input})
+        report_prompt("scam_type", messages)
+        return messages
 
     def classify_scam_type(
         self, 
@@ -103,52 +183,42 @@ class ScamClassifier:
         根據使用者輸入與對話歷史，分類詐騙類型 (混合式)
         """
         try:
-            # (此函式保持不變)
+            # 0. 信心閘門：啟發式命中數達門檻時不呼叫 LLM
+            gated = self._gated_scam_type(user_input)
+            if gated:
+                return gated
             
             # 1. LLM 判斷
-            messages = [{"role": "system", "content": self.system_prompt}]
-            messages.extend(history)
-            messages.append({"role": "user", "content": user_input})
-            
-            raw_result = self.ollama_client.send_chat_request(messages)
-            llm_scam_type = None
-            if raw_result:
-                for valid_type in VALID_SCAM_TYPES:
-                    if valid_type in raw_result:
-                        llm_scam_type = valid_type
-                        break
+            messages = self._build_messages(user_input, history)
             
-            logger.info(f"LLM 判斷類型：{llm_scam_type}（原始：{raw_result}）")
+            raw_result = self.cache.get_or_compute(
+                make_cache_key(user_input, history, self.ollama_client.default_model),
+                lambda: self.ollama_client.send_chat_request(messages)
+            )
+            llm_scam_type = self.parse_scam_type(raw_result)
+            return self.resolve_scam_type(user_input, llm_scam_type, raw_result)
 
-            # 2. 啟發式關鍵字判斷
-            heuristic_scores = self._heuristic_score(user_input)
-            sorted_scores = sorted(heuristic_scores.items(), key=lambda x: x[1], reverse=True)
-            heuristic_scam_type = sorted_scores[0][0]
-            top_score = sorted_scores[0][1]
-            
-            logger.info(f"啟發式判斷類型：{heuristic_scam_type} (分數: {top_score})")
-
-            # 3. 決策邏輯
-            
-            # 規則 1：如果啟發式分數很高（命中 >= 2 個關鍵字），且 LLM 判錯 (或判斷為 "無法分類")
-            if top_score >= 2 and llm_scam_type != heuristic_scam_type:
-                logger.warning(f"LLM 判斷 ({llm_scam_type}) 與高分啟發式 ({heuristic_scam_type}, score={top_score}) 衝突，採用啟發式。")
-                return heuristic_scam_type
-            
-            # 規則 2：如果 LLM 有成功判斷 (且與啟發式不衝突或啟發式分數低)，採用 LLM
-            if llm_scam_type and llm_scam_type != "無法分類":
-                logger.info(f"採用 LLM 判斷：{llm_scam_type}")
-                return llm_scam_type
-            
-            # 規則 3：如果 LLM 判斷為「無法分類」，但啟發式有分數 (>= 1)，採啟發式
-            if (llm_scam_type == "無法分類" or llm_scam_type is None) and top_score > 0:
-                 logger.info(f"LLM 無法分類，採用啟發式判斷：{heuristic_scam_type}")
-                 return heuristic_scam_type
-            
-            # 規則 4：如果 LLM 和啟發式都沒結果
-            logger.info("LLM 與啟發式皆無明確結果，回傳 LLM 結果或 '無法分類'")
-            return llm_scam_type or "無法分類"
+        except Exception as e:
+            logger.error(f"詐騙類型分類失敗：{str(e)}")
+            return "無法分類"
 
+    async def classify_scam_type_async(
+        self,
+        user_input: str,
+        history: List[Dict[str, str]]
+    ) -> str:
+        """classify_scam_type 的非同步版本（ASGI 路徑），判斷邏輯相同"""
+        try:
+            gated = self._gated_scam_type(user_input)
+            if gated:
+                return gated
+            messages = self._build_messages(user_input, history)
+            raw_result = await self.cache.get_or_compute_async(
+                make_cache_key(user_input, history, self.ollama_client.default_model),
+                lambda: self.ollama_client.send_chat_request_async(messages)
+            )
+            llm_scam_type = self.parse_scam_type(raw_result)
+            return self.resolve_scam_type(user_input, llm_scam_type, raw_result)
         except Exception as e:
             logger.error(f"詐騙類型分類失敗：{str(e)}")
             return "無法分類"
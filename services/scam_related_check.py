@@ -1,9 +1,37 @@
-import re
-from typing import List, Dict
+from typing import List, Dict, Optional
 from utils.ollama_client import OllamaClient
+from utils.ollama_balancer import resolve_backends
 from utils.log import logger
+from utils import metrics
+from utils.result_cache import get_classifier_cache, make_cache_key
+from utils.prompt_budget import compact_history, report_prompt
+from services.keyword_engine import get_keyword_engine
 from config import config
 
+# --- 【修改點：新增關鍵字】 ---
+RELATED_HIGH_SIGNAL_KEYWORDS = [
+    # 金融/轉帳/帳號類
+    "轉帳", "匯款", "帳戶", "銀行", "ATM", "監管帳戶", "凍結帳戶", "解除分期", "點數",
+    # 新增假客服關鍵字
+    "盜刷", "訂單錯誤", "重複扣款", "設定錯誤",
+    # 司法/執法威脅
+    "檢察官", "地檢署", "法院", "拘票", "傳票", "逮捕", "警察", "調查局",
+    # 操控指示/恐嚇
+    "不能透露", "保密", "全程監控", "不配合", "馬上逮捕", "立即轉帳", "立即匯款",
+    # 詐投/保證收益
+    "投資群組", "股票群組", "保證獲利", "高報酬", "穩賺不賠",
+    # 社交工程/客服詐騙
+    "客服", "簡訊連結", "驗證碼", "OTP", "匯款代碼", "代收貨款",
+]
+# --- 【修改結束】 ---
+
+# 相關性檢查判為 False 時的保守覆寫：命中這些高信號關鍵詞仍視為相關（與 LINE 一致）
+FALLBACK_HIGH_SIGNAL_KEYWORDS = [
+    "銀行", "客服", "帳戶", "帳號", "轉帳", "匯款", "ATM", "異常交易", "驗證碼", "OTP",
+    "檢察官", "法院", "拘票", "地檢署", "警察", "逮捕", "不配合", "保密"
+]
+
+
 class ScamRelatedChecker:
     def __init__(self):
         """
@@ -11,50 +39,36 @@ class ScamRelatedChecker:
         """
         ollama_config = config["ollama"]
         self.ollama_client = OllamaClient(
-            base_url=ollama_config["base_url"],
-            default_model=ollama_config["web_model"]
+            base_url=resolve_backends(ollama_config),
+            default_model=ollama_config["web_model"],
+            request_class="classify"
         )
+        # LLM 原始輸出快取（鍵：正規化輸入 + 歷史摘要 + 模型）
+        self.cache = get_classifier_cache("related")
         self.system_prompt = (
             "你是一個判斷使用者輸入是否與詐騙主題相關的助手。"
             "請用繁體中文回答，只回覆「是」或「否」，勿加其他內容。"
         )
 
-        # --- 【修改點：新增關鍵字】 ---
-        self._high_signal_keywords = [
-            # 金融/轉帳/帳號類
-            "轉帳", "匯款", "帳戶", "銀行", "ATM", "監管帳戶", "凍結帳戶", "解除分期", "點數",
-            # 新增假客服關鍵字
-            "盜刷", "訂單錯誤", "重複扣款", "設定錯誤",
-            # 司法/執法威脅
-            "檢察官", "地檢署", "法院", "拘票", "傳票", "逮捕", "警察", "調查局",
-            # 操控指示/恐嚇
-            "不能透露", "保密", "全程監控", "不配合", "馬上逮捕", "立即轉帳", "立即匯款",
-            # 詐投/保證收益
-            "投資群組", "股票群組", "保證獲利", "高報酬", "穩賺不賠",
-            # 社交工程/客服詐騙
-            "客服", "簡訊連結", "驗證碼", "OTP", "匯款代碼", "代收貨款",
-        ]
-        # --- 【修改結束】 ---
-        
-        # 連續多位數字（可能是帳號/卡號）
-        self._number_like_patterns = [
-            re.compile(r"\d{8,}")
-        ]
+        # 關鍵字表改由共用關鍵字引擎一次掃描（services/keyword_engine.py）
+        self._high_signal_keywords = RELATED_HIGH_SIGNAL_KEYWORDS
+        self.keywords = get_keyword_engine()
 
     def _heuristic_match(self, text: str) -> bool:
         t = (text or "").strip()
         if not t:
             return False
+        # 與其他分類器共用同一份掃描結果（以原始輸入為快取鍵）
+        features = self.keywords.scan(text)
         # 關鍵詞命中
-        for kw in self._high_signal_keywords:
-            if kw in t:
-                logger.info(f"[Heuristic] 命中關鍵詞：{kw}")
-                return True
+        hits = features.matched("high_signal", "related")
+        if hits:
+            logger.info(f"[Heuristic] 命中關鍵詞：{'、'.join(sorted(hits))}")
+            return True
         # 數字樣式命中
-        for pat in self._number_like_patterns:
-            if pat.search(t):
-                logger.info("[Heuristic] 命中長數字樣式（疑似帳號/卡號）")
-                return True
+        if features.long_number:
+            logger.info("[Heuristic] 命中長數字樣式（疑似帳號/卡號）")
+            return True
         return False
 
     @staticmethod
@@ -73,6 +87,32 @@ class ScamRelatedChecker:
         # 嚴格要求單字「是/否」；其他情況無法判斷
         return None
 
+    def resolve_related(
+        self,
+        user_input: str,
+        parsed: Optional[bool],
+        raw_result: Optional[str] = None
+    ) -> bool:
+        """
+        依啟發式與已解析的 LLM 判斷（可為 None）決定是否與詐騙相關
+        供 is_related 與合併分類器（CombinedClassifier）共用；無法判斷時保守視為相關
+        """
+        if self._heuristic_match(user_input):
+            return True
+        if parsed is None:
+            logger.warning(f"LLM 輸出無法判斷，原始結果：{raw_result!r}，保守視為相關")
+            return True
+        logger.info(f"詐騙相關性檢查（LLM）：{parsed}（原始：{raw_result}）")
+        return parsed
+
+    def _build_messages(self, user_input: str, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": self.system_prompt}]
+        # 對話歷史依分類階段的 token 預算整理（先前的格式化回覆改為摘要）
+        messages.extend(compact_history(history, "classify"))
+        messages.append({"role": "user", "content": user_input})
+        report_prompt("related", messages)
+        return messages
+
     def is_related(
         self, 
         user_input: str, 
@@ -91,21 +131,42 @@ class ScamRelatedChecker:
         try:
             # 1) 本地啟發式先行（降低漏判）
             if self._heuristic_match(user_input):
+                metrics.increment("classifier_gate.related.skipped")
                 return True
+            metrics.increment("classifier_gate.related.llm")
 
             # 2) 呼叫 LLM 嚴格判斷
-            messages = [{"role": "system", "content": self.system_prompt}]
-            messages.extend(history)
-            messages.append({"role": "user", "content": user_input})
+            messages = self._build_messages(user_input, history)
             
-            raw_result = self.ollama_client.send_chat_request(messages)
+            raw_result = self.cache.get_or_compute(
+                make_cache_key(user_input, history, self.ollama_client.default_model),
+                lambda: self.ollama_client.send_chat_request(messages)
+            )
             parsed = self._parse_llm_yes_no(raw_result)
-            if parsed is None:
-                logger.warning(f"LLM 輸出無法判斷，原始結果：{raw_result!r}，保守視為相關")
-                return True
-            logger.info(f"詐騙相關性檢查（LLM）：{parsed}（原始：{raw_result}）")
-            return parsed
+            return self.resolve_related(user_input, parsed, raw_result)
         
         except Exception as e:
             logger.error(f"詐騙相關性檢查失敗：{str(e)}")
-            return True  # 保守策略：失敗時視為相關，避免漏判
\ No newline at end of file
+            return True  # 保守策略：失敗時視為相關，避免漏判
+
+    async def is_related_async(
+        self,
+        user_input: str,
+        history: List[Dict[str, str]]
+    ) -> bool:
+        """is_related 的非同步版本（ASGI 路徑），判斷邏輯相同"""
+        try:
+            if self._heuristic_match(user_input):
+                metrics.increment("classifier_gate.related.skipped")
+                return True
+            metrics.increment("classifier_gate.related.llm")
+            messages = self._build_messages(user_input, history)
+            raw_result = await self.cache.get_or_compute_async(
+                make_cache_key(user_input, history, self.ollama_client.default_model),
+                lambda: self.ollama_client.send_chat_request_async(messages)
+            )
+            parsed = self._parse_llm_yes_no(raw_result)
+            return self.resolve_related(user_input, parsed, raw_result)
+        except Exception as e:
+            logger.error(f"詐騙相關性檢查失敗：{str(e)}")
+            return True
@@ -6,10 +6,25 @@ import yaml
 from typing import Any, List, Tuple, Optional
 # 確保 V3 已經從 config.paths 匯入
 from config.paths import CHROMA_DB_DIR, EMBEDDINGS_PATH, EMBEDDINGS_V2_PATH ,EMBEDDINGS_V3_PATH
+from src.vector_index import NumpyVectorIndex
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+def current_corpus_version() -> str:
+    """
+    目前語料版本：以優先使用的嵌入檔（V3 -> V2 -> V1）路徑、修改時間與大小組成
+    嵌入檔更新後版本即改變，供語意快取判斷是否失效
+    """
+    for path in (EMBEDDINGS_V3_PATH, EMBEDDINGS_V2_PATH, EMBEDDINGS_PATH):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        return f"{os.path.basename(path)}:{int(st.st_mtime)}:{st.st_size}"
+    return "empty"
+
+
 class DataLoader:
     def __init__(self, config):
         self.config = config
@@ -17,6 +32,13 @@ class DataLoader:
         self.client = None
         self.collection = None
         self.max_batch_size = 5461  # ChromaDB 最大批次限制
+        # 檢索後端（config.embedding.backend）：chroma 或 numpy（行程內向量索引，不經 Chroma）
+        embedding_config = (config or {}).get("embedding", {}) or {}
+        self.backend = embedding_config.get("backend", "chroma")
+        self.metric = embedding_config.get("metric", "l2")
+        # 語料文件（供 BM25 倒排索引使用）
+        self.documents: List[str] = []
+        self._lexical_index = None
 
     def _init_chroma_client(self, persist_dir: str = None, in_memory: bool = False):
         """
@@ -61,7 +83,11 @@ class DataLoader:
     def load_embeddings(self):
         """
         載入 embeddings 並建立或取得 collection（包含容錯處理）
+        numpy 後端：建立行程內向量索引作為 collection；已建立時不重建（語料更新需重新啟動）
         """
+        if self.backend == "numpy" and self.collection is not None:
+            return True
+
         def _try_load_pickle(path: str) -> Optional[Any]:
             try:
                 with open(path, "rb") as f:
@@ -142,6 +168,12 @@ class DataLoader:
                 logger.warning(f"解析嵌入資料結構失敗：{path} | {e}")
                 continue
 
+        if embedded_data is not None:
+            self.documents = [doc for doc, _ in embedded_data]
+
+        if self.backend == "numpy":
+            return self._build_numpy_index(embedded_data, used_path)
+
         # 初始化 chroma client（延後到這裡）
         if self.client is None:
             self._init_chroma_client(in_memory=False)
@@ -233,6 +265,37 @@ class DataLoader:
         logger.info(f"嵌入資料載入完成（來源：{used_path}，總數：{total}）")
         return True
 
+    def _build_numpy_index(self, embedded_data, used_path) -> bool:
+        """以嵌入資料建立行程內向量索引（無資料時建立空索引，避免啟動失敗）"""
+        embedded_data = embedded_data or []
+        if not embedded_data:
+            logger.warning("所有候選嵌入檔無法讀取或格式不符，建立空的向量索引")
+        try:
+            self.collection = NumpyVectorIndex(
+                [doc for doc, _ in embedded_data],
+                [emb for _, emb in embedded_data],
+                metric=self.metric
+            )
+        except Exception as e:
+            logger.error(f"建立向量索引失敗：{e}", exc_info=True)
+            self.collection = None
+            return False
+        logger.info(f"嵌入資料載入完成（numpy 後端，來源：{used_path}，總數：{self.collection.count()}）")
+        return True
+
+    def get_lexical_index(self):
+        """
+        取得語料的 BM25 倒排索引（jieba 斷詞；首次呼叫時以載入的文件建立，之後沿用，與向量索引同為啟動時的語料）
+        尚未載入任何文件時回傳 None
+        """
+        if not self.documents:
+            return None
+        # 延遲匯入：只有 hybrid / lexical 檢索模式才需要 jieba
+        from src.lexical_index import BM25Index
+        if self._lexical_index is None:
+            self._lexical_index = BM25Index(self.documents)
+        return self._lexical_index
+
     def get_collection(self):
         return self.collection
 
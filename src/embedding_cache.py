@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from utils.result_cache import TTLCache, normalize_text, register_cache
+from config import config
+from config.paths import STORAGE_BASE_DIR
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# 查詢向量快取設定（config.cache.embedding）
+_embedding_cache_config = (config.get("cache", {}) or {}).get("embedding", {}) or {}
+
+
+def embedding_key(text: str, model: str) -> str:
+    """快取鍵：embedding 模型 + 正規化文字"""
+    raw = f"{model}\x00{normalize_text(text)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(TTLCache):
+    def __init__(
+        self,
+        max_size: int = 4096,
+        ttl_seconds: float = 86400,
+        enabled: bool = True,
+        path: Optional[str] = None
+    ):
+        """
+        查詢向量快取（LRU + TTL）：相同文字與模型不再重複呼叫 Ollama embeddings
+        指定 path 時同時寫入 SQLite 檔案（WAL 模式），重新啟動時載入未過期的項目
+
+        Args:
+            max_size: 記憶體中最多筆數（同時為檔案保留的筆數上限）
+            ttl_seconds: 每筆向量的存活秒數
+            enabled: 停用時不快取
+            path: SQLite 檔案路徑；None 表示只存在記憶體
+        """
+        super().__init__("embedding", max_size=max_size, ttl_seconds=ttl_seconds, enabled=enabled)
+        self.path = path if self.enabled else None
+        self._local = threading.local()
+        self._writes = 0
+        self._prune_every = 200
+        self.loaded = 0
+        if self.path:
+            try:
+                self._init_store()
+            except sqlite3.Error as e:
+                logger.error(f"查詢向量快取檔案無法使用，改為只存在記憶體：{e}")
+                self.path = None
+
+    def _conn(self) -> sqlite3.Connection:
+        """每條執行緒一個連線（sqlite3 連線不可跨執行緒共用）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_store(self) -> None:
+        """建立資料表並載入未過期的項目（最近寫入者優先，至多 max_size 筆）"""
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings ("
+            "key TEXT PRIMARY KEY, "
+            "embedding BLOB NOT NULL, "
+            "expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_query_embeddings_expires ON query_embeddings (expires_at)")
+        now = time.time()
+        rows = conn.execute(
+            "SELECT key, embedding, expires_at FROM query_embeddings WHERE expires_at > ? "
+            "ORDER BY expires_at DESC LIMIT ?",
+            (now, self.max_size)
+        ).fetchall()
+        offset = time.monotonic() - now
+        with self._lock:
+            # 由舊到新放入，讓最近寫入者位於 LRU 尾端
+            for key, blob, expires_at in reversed(rows):
+                self._data[key] = (expires_at + offset, self._decode(blob))
+        self.loaded = len(rows)
+        logger.info(f"查詢向量快取：{self.path}（載入 {self.loaded} 筆）")
+
+    @staticmethod
+    def _encode(embedding: List[float]) -> bytes:
+        return array("d", embedding).tobytes()
+
+    @staticmethod
+    def _decode(blob: bytes) -> List[float]:
+        values = array("d")
+        values.frombytes(blob)
+        return values.tolist()
+
+    def set(self, key: str, value: Any) -> None:
+        super().set(key, value)
+        self._persist(key, value)
+
+    async def get_or_compute_async(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """非同步版本：寫入 SQLite 檔案（含定期清理）交由執行緒執行，不阻塞事件迴圈"""
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = await compute()
+        if value:
+            super().set(key, value)
+            if self.path:
+                await asyncio.to_thread(self._persist, key, value)
+        return value
+
+    def _persist(self, key: str, value: Any) -> None:
+        """寫入 SQLite 檔案（每 _prune_every 次寫入清理一次）"""
+        if not self.path or not value:
+            return
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, embedding, expires_at) VALUES (?, ?, ?)",
+                (key, self._encode(value), now + self.ttl_seconds)
+            )
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % self._prune_every == 0
+            if prune:
+                self._prune(conn, now)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"寫入查詢向量快取檔案失敗：{e}")
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        """刪除過期項目，並將檔案筆數限制在 max_size 以內"""
+        conn.execute("DELETE FROM query_embeddings WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM query_embeddings WHERE key IN ("
+            "SELECT key FROM query_embeddings ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,)
+        )
+
+    def clear(self) -> None:
+        super().clear()
+        if self.path:
+            try:
+                self._conn().execute("DELETE FROM query_embeddings")
+            except sqlite3.Error as e:
+                logger.warning(f"清空查詢向量快取檔案失敗：{e}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["path"] = self.path
+        stats["loaded"] = self.loaded
+        return stats
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """取得行程內共用的查詢向量快取（依 config.cache.embedding；統計併入 /api/health 的 caches）"""
+    def factory() -> EmbeddingCache:
+        path = None
+        if _embedding_cache_config.get("persist", False):
+            path = _embedding_cache_config.get("path") or os.path.join(STORAGE_BASE_DIR, "embedding_cache.sqlite3")
+        return EmbeddingCache(
+            max_size=int(_embedding_cache_config.get("max_size", 4096)),
+            ttl_seconds=float(_embedding_cache_config.get("ttl_seconds", 86400)),
+            enabled=bool(_embedding_cache_config.get("enabled", False)),
+            path=path
+        )
+    return register_cache("embedding", factory)
@@ -0,0 +1,100 @@
+import heapq
+import logging
+import math
+import re
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+import jieba
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# 至少含一個文字/數字字元的詞才納入索引（略過標點與空白）
+_WORD = re.compile(r"\w")
+# 停用詞：幾乎每篇文件都有、不具區辨力的虛詞與代名詞（不納入索引也不參與查詢）
+STOPWORDS = frozenset(
+    "的 了 是 我 你 他 她 它 們 我們 你們 他們 在 有 和 與 及 或 就 都 也 還 又 很 嗎 呢 吧 啊 呀 喔 哦 "
+    "這 那 這個 那個 這樣 那樣 一個 什麼 怎麼 為什麼 因為 所以 但是 可是 如果 而且 然後 "
+    "要 會 能 可以 說 到 被 把 給 讓 對 從 向 跟 之 其 而 但 並 個 等 嗯 欸 喂".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    斷詞（jieba 搜尋引擎模式：長詞同時產出其中的短詞，如「解除分期」→ 解除 / 分期 / 解除分期）
+    先做 NFKC 正規化並轉小寫，帳號、電話、LINE ID 等英數字串保留為單一詞；略過標點與停用詞
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return [token for token in jieba.cut_for_search(text) if _WORD.search(token) and token not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        """
+        以 jieba 斷詞建立的倒排索引，BM25 計分（不需 embedding，適合精確字詞：帳號、術語、LINE ID）
+
+        Args:
+            documents: 語料文件（順序即文件編號）
+            k1: 詞頻飽和參數
+            b: 文件長度正規化參數
+        """
+        started = time.monotonic()
+        self.documents: List[str] = list(documents)
+        self.k1 = float(k1)
+        self.b = float(b)
+        # 詞 -> [(文件編號, 詞頻)]
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._doc_lengths: List[int] = []
+        for doc_id, doc in enumerate(self.documents):
+            counts = Counter(tokenize(doc))
+            self._doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self._postings.setdefault(term, []).append((doc_id, tf))
+        total = len(self.documents)
+        avg_length = (sum(self._doc_lengths) / total) if total else 0.0
+        # 各文件的長度正規化項（查詢時直接取用）
+        self._norms = [
+            self.k1 * (1.0 - self.b + self.b * length / avg_length) if avg_length else self.k1
+            for length in self._doc_lengths
+        ]
+        # BM25 idf（+1 平滑，避免常見詞得到負分）
+        self._idf = {
+            term: math.log(1.0 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+        self.build_seconds = time.monotonic() - started
+        logger.info(
+            f"BM25 倒排索引建立完成：{total} 筆文件，{len(self._postings)} 個詞"
+            f"（{self.build_seconds * 1000:.0f} ms）"
+        )
+
+    def count(self) -> int:
+        return len(self.documents)
+
+    def search(self, text: str, n_results: int = 10, min_ratio: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        查詢：回傳 [(文件編號, BM25 分數)]，分數由高到低，無任何詞命中時為空列表
+        min_ratio：分數需達查詢可得最高分（每個命中詞的 idf × (k1 + 1) 之和）的此比例，
+        只命中少數常見詞的文件不列入
+        """
+        if not self._postings or n_results <= 0:
+            return []
+        scores: Dict[int, float] = {}
+        max_score = 0.0
+        for term, query_tf in Counter(tokenize(text)).items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            max_score += query_tf * idf * (self.k1 + 1.0)
+            for doc_id, tf in postings:
+                scores[doc_id] = scores.get(doc_id, 0.0) + query_tf * idf * tf * (self.k1 + 1.0) / (tf + self._norms[doc_id])
+        floor = max_score * min_ratio
+        hits = ((doc_id, score) for doc_id, score in scores.items() if score >= floor)
+        return heapq.nlargest(n_results, hits, key=lambda item: (item[1], -item[0]))
+
+    def search_documents(self, text: str, n_results: int = 10, min_ratio: float = 0.0) -> List[str]:
+        """查詢並回傳文件內容（分數由高到低）"""
+        return [self.documents[doc_id] for doc_id, _ in self.search(text, n_results, min_ratio)]
@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List
+from utils import metrics
+from src.line_dispatcher import event_partition_key
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+class MessageBatch:
+    def __init__(self, events: List):
+        """
+        同一使用者在合併視窗內連續送出的文字訊息（依收到順序）
+        回覆使用最後一則的 reply token（最新、最不容易逾期）
+        """
+        self.events = events
+
+    @property
+    def latest(self):
+        return self.events[-1]
+
+    @property
+    def source(self):
+        return self.latest.source
+
+    @property
+    def text(self) -> str:
+        return "\n".join(e.message.text.strip() for e in self.events if e.message.text.strip())
+
+
+class MessageCoalescer:
+    def __init__(
+        self,
+        on_flush: Callable[[MessageBatch], None],
+        window_seconds: float = 2.0,
+        max_wait_seconds: float = 8.0,
+        max_chars: int = 1000
+    ):
+        """
+        每位使用者的訊息合併視窗（debounce）：視窗內陸續收到的訊息合併為一次分析、只回覆一次
+
+        Args:
+            on_flush: 視窗結束時處理合併結果的函式
+            window_seconds: 最後一則訊息後再等待多久沒有新訊息即送出
+            max_wait_seconds: 自第一則訊息起最長等待秒數（避免持續輸入時遲遲不回覆）
+            max_chars: 合併後的長度上限；加入新訊息會超過時先送出目前內容
+        """
+        self.on_flush = on_flush
+        self.window_seconds = float(window_seconds)
+        self.max_wait_seconds = float(max_wait_seconds)
+        self.max_chars = int(max_chars)
+        self._lock = threading.Lock()
+        # key -> (第一則訊息時間, 事件列表, 計時器)
+        self._pending: Dict[str, tuple] = {}
+        self._generation = 0
+        logger.info(
+            f"LINE 訊息合併視窗啟用：window={self.window_seconds:.1f}s, max_wait={self.max_wait_seconds:.1f}s"
+        )
+
+    def add(self, event) -> None:
+        key = event_partition_key(event)
+        if not key:
+            # 無法辨識來源時不合併
+            self.on_flush(MessageBatch([event]))
+            return
+        text_len = len(event.message.text.strip())
+        ready = None
+        with self._lock:
+            now = time.monotonic()
+            first_at, events, timer = self._pending.pop(key, (now, [], None))
+            if timer is not None:
+                timer.cancel()
+            if events and sum(len(e.message.text.strip()) for e in events) + text_len > self.max_chars:
+                ready = MessageBatch(events)
+                first_at, events = now, []
+            events.append(event)
+            delay = min(self.window_seconds, max(0.0, first_at + self.max_wait_seconds - now))
+            # 以世代編號辨識計時器，避免已被取代（但已開始執行）的舊計時器提早送出
+            self._generation += 1
+            timer = threading.Timer(delay, self._flush, args=(key, self._generation))
+            timer.generation = self._generation
+            timer.daemon = True
+            self._pending[key] = (first_at, events, timer)
+            timer.start()
+        if ready is not None:
+            self._emit(ready)
+
+    def _flush(self, key: str, generation: int) -> None:
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None or entry[2].generation != generation:
+                return
+            del self._pending[key]
+        self._emit(MessageBatch(entry[1]))
+
+    def _emit(self, batch: MessageBatch) -> None:
+        metrics.increment("line.coalesce.batches")
+        metrics.increment("line.coalesce.messages", len(batch.events))
+        if len(batch.events) > 1:
+            logger.info(f"合併 {len(batch.events)} 則連續訊息為一次分析")
+        try:
+            self.on_flush(batch)
+        except Exception as e:
+            logger.error(f"處理合併訊息失敗：{e}", exc_info=True)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(entry[1]) for entry in self._pending.values())
+
+    def close(self) -> None:
+        """立即送出所有等待中的訊息（行程結束前呼叫）"""
+        with self._lock:
+            entries = list(self._pending.values())
+            self._pending.clear()
+        for _, events, timer in entries:
+            timer.cancel()
+            self._emit(MessageBatch(events))
@@ -0,0 +1,114 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List
+from utils import metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def event_partition_key(event) -> str:
+    """事件的分區鍵：同一使用者（或群組/聊天室）的事件進同一分區，確保依序處理"""
+    source = getattr(event, "source", None)
+    for attr in ("user_id", "group_id", "room_id"):
+        value = getattr(source, attr, None)
+        if value:
+            return value
+    return ""
+
+
+class LineEventDispatcher:
+    def __init__(self, handler: Callable, workers: int = 4, queue_size: int = 100):
+        """
+        LINE 事件背景處理：Webhook 驗證簽章後只負責入列並立即回應，事件由工作執行緒處理
+
+        依 source.user_id 分區（每個分區一條執行緒與一個有界佇列）：
+        同一使用者的訊息依序處理，不同使用者（含同一請求中的多個事件）可同時處理
+
+        Args:
+            handler: 處理單一事件的函式
+            workers: 分區（工作執行緒）數
+            queue_size: 每個分區的佇列上限
+        """
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        # 單一事件處理耗時的指數移動平均（預估排隊時間用）
+        self._service_seconds = 0.0
+        self._threads = [
+            threading.Thread(target=self._worker, args=(i,), name=f"line-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+        logger.info(f"LINE 事件背景處理啟動：{self.workers} 個分區，每區佇列上限 {self.queue_size}")
+
+    def _partition(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % self.workers
+
+    def predicted_wait(self, event) -> float:
+        """預估事件入列後需等待的秒數：該分區排隊數 × 平均處理耗時（尚無紀錄時為 0）"""
+        return self._queues[self._partition(event_partition_key(event))].qsize() * self._service_seconds
+
+    def submit(self, event) -> bool:
+        """
+        事件入列（不等待）；該分區佇列已滿時回傳 False，由呼叫端決定如何回應
+        """
+        q = self._queues[self._partition(event_partition_key(event))]
+        try:
+            q.put_nowait((time.monotonic(), event))
+        except queue.Full:
+            metrics.increment("line.queue.rejected")
+            logger.warning("LINE 事件佇列已滿，無法入列")
+            return False
+        metrics.increment("line.queue.enqueued")
+        self._report_depth()
+        return True
+
+    def _worker(self, index: int) -> None:
+        q = self._queues[index]
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                return
+            enqueued_at, event = item
+            metrics.observe("line.queue.wait_seconds", time.monotonic() - enqueued_at)
+            self._report_depth()
+            started = time.monotonic()
+            try:
+                self.handler(event)
+            except Exception as e:
+                logger.error(f"背景處理 LINE 事件失敗：{e}", exc_info=True)
+            finally:
+                elapsed = time.monotonic() - started
+                self._service_seconds = elapsed if self._service_seconds == 0.0 else self._service_seconds * 0.8 + elapsed * 0.2
+                q.task_done()
+
+    def depth(self) -> int:
+        """目前所有分區排隊中的事件數"""
+        return sum(q.qsize() for q in self._queues)
+
+    def _report_depth(self) -> None:
+        metrics.set_gauge("line.queue.depth", self.depth())
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "depth": self.depth(),
+            "avg_seconds": round(self._service_seconds, 3),
+            "partitions": [q.qsize() for q in self._queues],
+        }
+
+    def close(self, timeout: float = 5.0) -> None:
+        """送出停止訊號，等待工作執行緒處理完已入列的事件（最多 timeout 秒）"""
+        for q in self._queues:
+            q.put(None)
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
@@ -1,5 +1,8 @@
+import asyncio
+import atexit
 import logging
 import os
+import time
 try:
     import certifi
     _CA_PATH = certifi.where()
@@ -11,16 +14,31 @@ except Exception:
 from linebot.v3 import WebhookHandler
 from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.messaging import Configuration, ApiClient, MessagingApi, ReplyMessageRequest, TextMessage
+from linebot.v3.messaging import ApiException, PushMessageRequest
+from linebot.v3.messaging import AsyncApiClient, AsyncMessagingApi
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
+from src.line_dispatcher import LineEventDispatcher, event_partition_key
+from src.line_coalescer import MessageCoalescer, MessageBatch
+from storage.event_dedup_store import EventDedupStore
+from utils import metrics
+from utils.ollama_scheduler import scheduler, set_current_user
+from utils import deadline
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+# 背景佇列已滿時的即時回覆
+BUSY_REPLY = "⚠️ 目前詢問人數較多，請稍後再試。"
+# 單次分析的輸入長度上限（合併視窗合併後亦不超過）
+MAX_INPUT_CHARS = 1000
+
 class LineHandler:
-    def __init__(self, config, query_engine, response_generator):
+    def __init__(self, config, query_engine, response_generator, semantic_cache=None):
         self.config = config
         self.query_engine = query_engine
         self.response_generator = response_generator
+        # 可選：語意快取（近似重複的問題直接重用先前回覆，命中時只需一次 embedding）
+        self.semantic_cache = semantic_cache
         self.handler = WebhookHandler(config["line"]["channel_secret"])
         if _CA_PATH:
             self.configuration = Configuration(
@@ -29,12 +47,59 @@ class LineHandler:
             )
         else:
             self.configuration = Configuration(access_token=config["line"]["channel_access_token"])
+        line_config = config.get("line", {}) or {}
+        # 行程內共用一個 MessagingApi（底層 urllib3 連線池為執行緒安全），避免每次回覆重新 TLS 握手
+        self.configuration.connection_pool_maxsize = int(line_config.get("connection_pool_size", 20))
+        self.api_client = ApiClient(self.configuration)
+        self.messaging_api = MessagingApi(self.api_client)
+        # 非同步路徑的用戶端於事件迴圈中首次使用時建立（AsyncApiClient）
+        self._async_api_client = None
+        self._async_messaging_api = None
+        # reply token 有效期限（秒）：超過時不再嘗試 reply，直接改用 push
+        self.reply_token_ttl = float(line_config.get("reply_token_ttl", 50))
+        atexit.register(self.close)
         
         # 修改：使用 lambda 正確綁定 handle_text_message
-        self.handler.add(MessageEvent, message=TextMessageContent)(lambda event: self.handle_text_message(event))
+        self.handler.add(MessageEvent, message=TextMessageContent)(lambda event: self._handle_unique(event))
+
+        # 事件去重（config.line.dedup）：以 webhookEventId 認領，重送或重複的事件不再進入 RAG 流程
+        dedup_config = (config.get("line", {}) or {}).get("dedup", {}) or {}
+        self.dedup_store = None
+        if dedup_config.get("enabled", False):
+            self.dedup_store = EventDedupStore(
+                db_path=dedup_config.get("path") or None,
+                ttl_seconds=dedup_config.get("ttl_seconds", 86400),
+                max_entries=dedup_config.get("max_entries", 200000)
+            )
+
+        # 背景處理（config.line.dispatcher）：Webhook 驗證簽章、事件入列後立即回應，不等待 LLM
+        dispatcher_config = (config.get("line", {}) or {}).get("dispatcher", {}) or {}
+        self.dispatcher = None
+        if dispatcher_config.get("enabled", False):
+            self.dispatcher = LineEventDispatcher(
+                self.dispatch_event,
+                workers=dispatcher_config.get("workers", 4),
+                queue_size=dispatcher_config.get("queue_size", 100)
+            )
+
+        # 訊息合併視窗（config.line.coalesce）：同一使用者連續送出的多則訊息合併為一次分析
+        coalesce_config = (config.get("line", {}) or {}).get("coalesce", {}) or {}
+        self.coalescer = None
+        if coalesce_config.get("enabled", False):
+            self.coalescer = MessageCoalescer(
+                self._submit,
+                window_seconds=coalesce_config.get("window_seconds", 2.0),
+                max_wait_seconds=coalesce_config.get("max_wait_seconds", 8.0),
+                max_chars=MAX_INPUT_CHARS
+            )
 
     def handle_webhook(self, body, signature):
         try:
+            if self.dispatcher is not None or self.coalescer is not None:
+                # 僅驗證簽章並入列（或進入合併視窗），處理結果由背景執行緒回覆
+                self._accept(self.handler.parser.parse(body, signature))
+                logger.info("Webhook 事件已入列")
+                return True
             self.handler.handle(body, signature)
             logger.info("Webhook 處理成功")
             return True
@@ -45,57 +110,363 @@ class LineHandler:
             logger.error(f"處理 Webhook 時發生錯誤：{e}")
             return False
 
-    def handle_text_message(self, event):
-        """處理用戶發送的文字訊息"""
-        user_input = event.message.text.strip()
+    @staticmethod
+    def _is_text_message(event):
+        return isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent)
+
+    def _claim_event(self, event):
+        """
+        事件去重：首次收到（含先前未處理成功的重送）回傳 True；已認領過的事件回傳 False
+        """
+        if self.dedup_store is None:
+            return True
+        event_id = getattr(event, "webhook_event_id", None)
+        is_redelivery = bool(getattr(getattr(event, "delivery_context", None), "is_redelivery", False))
+        if is_redelivery:
+            metrics.increment("line.dedup.redeliveries")
+        if self.dedup_store.claim(event_id):
+            if is_redelivery:
+                logger.info(f"收到重送事件（先前未處理）：{event_id}")
+            return True
+        metrics.increment("line.dedup.duplicates")
+        logger.info(f"略過重複事件：{event_id}（isRedelivery={is_redelivery}）")
+        return False
+
+    def _release_event(self, event):
+        """處理失敗時釋放認領，讓 LINE 的重送（isRedelivery）可再次處理"""
+        if self.dedup_store is not None:
+            self.dedup_store.release(getattr(event, "webhook_event_id", None))
+
+    def _handle_unique(self, event):
+        if not self._claim_event(event):
+            return
+        try:
+            self.handle_text_message(event)
+        except Exception:
+            self._release_event(event)
+            raise
+
+    def dispatch_event(self, item):
+        """處理單一事件或合併後的訊息（背景工作執行緒呼叫）；目前僅處理文字訊息"""
+        if isinstance(item, MessageBatch):
+            self.handle_text_message(item.latest, user_input=item.text)
+        elif self._is_text_message(item):
+            self.handle_text_message(item)
+
+    def _accept(self, events):
+        """去重後的文字訊息交由合併視窗（啟用時）或背景佇列處理"""
+        for event in events:
+            if not self._is_text_message(event) or not self._claim_event(event):
+                continue
+            if self.coalescer is not None:
+                self.coalescer.add(event)
+            else:
+                self._submit(event)
+
+    def _submit(self, item):
+        """事件入列（未啟用背景處理時就地處理）；分區佇列已滿時立即回覆忙碌訊息（不進入 RAG 流程）"""
+        if self.dispatcher is None:
+            self.dispatch_event(item)
+            return
+        event = item.latest if isinstance(item, MessageBatch) else item
+        if deadline.ENABLED and self._event_age(event) + self.dispatcher.predicted_wait(event) > deadline.LINE_SECONDS:
+            # 負載卸除：預估排到時已超過時間預算，不入列
+            metrics.increment("line.shed")
+            logger.warning("預估排隊時間超過時間預算，回覆忙碌訊息")
+            self.reply_event(event, BUSY_REPLY)
+        elif not self.dispatcher.submit(item):
+            self.reply_event(event, BUSY_REPLY)
+
+    def handle_text_message(self, event, user_input=None):
+        """
+        處理用戶發送的文字訊息
+        user_input：合併視窗合併後的文字（未提供時使用事件本身的訊息）
+        """
+        user_input = (event.message.text if user_input is None else user_input).strip()
+        set_current_user(event_partition_key(event))  # Ollama 排程依使用者輪流
+        try:
+            precheck = self._precheck_reply(event, user_input)
+            if precheck:
+                self.reply_event(event, precheck)
+                return
+
+            self._start_deadline(event)
+            if self._should_shed():
+                self.reply_event(event, BUSY_REPLY)
+                return
+            try:
+                self._answer(event, user_input)
+            except deadline.DeadlineExceeded as e:
+                metrics.increment("line.shed")
+                logger.warning(f"{e}，回覆忙碌訊息")
+                self.reply_event(event, BUSY_REPLY)
+        finally:
+            # 分派執行緒、合併視窗計時執行緒與 WSGI 執行緒會重用，結束時清除時間預算與使用者識別
+            deadline.clear()
+            set_current_user(None)
+
+    def _answer(self, event, user_input):
+        """RAG 流程：語意快取 → 向量檢索 → 生成 → 回覆（時間預算用盡時拋出 DeadlineExceeded）"""
+        # 語意快取：先算一次 embedding，命中則直接回覆；未命中時沿用同一向量查詢資料庫
+        query_embedding = None
+        if self.semantic_cache is not None:
+            query_embedding = self.query_engine.embed(user_input)
+            cached = self.semantic_cache.lookup(query_embedding, namespace="line")
+            if cached:
+                self.reply_event(event, cached)
+                return
+
+        combined_data = self.query_engine.query(user_input, query_embedding=query_embedding)
+        if not combined_data:
+            # 後備策略：向量庫目前無資料或查無結果，改以使用者敘述作為上下文進行簡短分析
+            answer = self.response_generator.generate(user_input, self._fallback_context(user_input), mode="brief")
+            self._store_semantic_cache(query_embedding, answer)
+            self.reply_event(event, answer)
+            return
+
+        # answer = self.response_generator.generate(user_input, combined_data)
+        # 0528 - 呼叫 generate 時加入 mode="brief" 讓 LINE 回覆簡短開始
+        answer = self.response_generator.generate(user_input, combined_data, mode="brief")
+        # 0528 - 呼叫 generate 時加入 mode="brief" 讓 LINE 回覆簡短結束
+        self._store_semantic_cache(query_embedding, answer)
+        self.reply_event(event, answer)
+
+    def _start_deadline(self, event):
+        """LINE 訊息的時間預算自事件發生起算（含排隊與合併視窗的等待）"""
+        deadline.start(deadline.LINE_SECONDS - self._event_age(event))
+
+    def _should_shed(self):
+        """負載卸除：時間預算已用盡，或預估生成排隊時間超過剩餘預算"""
+        left = deadline.remaining()
+        if left is None:
+            return False
+        predicted = scheduler.predicted_wait(self.response_generator.ollama_client.request_class)
+        if not deadline.expired() and predicted <= left:
+            return False
+        metrics.increment("line.shed")
+        logger.warning(f"剩餘時間預算 {left:.1f}s 不足（預估排隊 {predicted:.1f}s），回覆忙碌訊息")
+        return True
+
+    def _precheck_reply(self, event, user_input):
+        """不需進入 RAG 流程的直接回覆（Console 驗證、空白、過長）；需繼續處理時回傳 None"""
         # LINE Webhook 驗證：若是 LINE Console verify 的 user_id，直接回 'OK'
         try:
             verify_user_id = (self.config.get("line", {}) or {}).get("verify_user_id", "")
             source_user_id = getattr(getattr(event, "source", None), "user_id", None)
             if verify_user_id and source_user_id == verify_user_id:
-                self.reply_message(event.reply_token, "OK")
-                return
+                return "OK"
         except Exception:
             # 安全起見，不因驗證流程影響正常訊息處理
             pass
         logger.info(f"收到用戶訊息：{user_input}")
 
         if not user_input:
-            self.reply_message(event.reply_token, "⚠️ 請輸入問題。")
-            return
+            return "⚠️ 請輸入問題。"
         
-        if len(user_input) > 1000:
-            self.reply_message(event.reply_token, "⚠️ 輸入過長，請簡化問題。")
+        if len(user_input) > MAX_INPUT_CHARS:
+            return "⚠️ 輸入過長，請簡化問題。"
+        return None
+
+    @staticmethod
+    def _fallback_context(user_input):
+        return (
+            "（資料庫目前無可用文件；請僅根據使用者敘述判斷是否為詐騙，並提供簡短理由與建議。）\n"
+            f"使用者敘述：{user_input}"
+        )
+
+    async def handle_webhook_async(self, body, signature):
+        """
+        handle_webhook 的非同步版本（ASGI 路徑）：驗證簽章後同時處理同一請求中的所有文字訊息
+        """
+        try:
+            events = self.handler.parser.parse(body, signature)
+        except InvalidSignatureError:
+            logger.error("簽名驗證失敗")
+            return False
+        except Exception as e:
+            logger.error(f"處理 Webhook 時發生錯誤：{e}")
+            return False
+        if self.dispatcher is not None or self.coalescer is not None:
+            # 背景處理模式：入列即回應（忙碌回覆為單次 HTTP 呼叫，交由執行緒避免阻塞事件迴圈）
+            await asyncio.to_thread(self._accept, events)
+            logger.info("Webhook 事件已入列")
+            return True
+        # 去重使用同步 SQLite（單筆寫入，毫秒級）
+        claimed = [event for event in events if self._is_text_message(event) and self._claim_event(event)]
+        results = await asyncio.gather(
+            *(self.handle_text_message_async(event) for event in claimed),
+            return_exceptions=True
+        )
+        failed = False
+        for event, result in zip(claimed, results):
+            if isinstance(result, Exception):
+                self._release_event(event)
+                logger.error(f"處理 Webhook 時發生錯誤：{result}")
+                failed = True
+        if failed:
+            return False
+        logger.info("Webhook 處理成功")
+        return True
+
+    async def handle_text_message_async(self, event):
+        """handle_text_message 的非同步版本：embedding / 生成走非同步 HTTP，Chroma 查詢於執行緒執行"""
+        user_input = event.message.text.strip()
+        set_current_user(event_partition_key(event))
+        try:
+            precheck = self._precheck_reply(event, user_input)
+            if precheck:
+                await self.reply_event_async(event, precheck)
+                return
+
+            self._start_deadline(event)
+            if self._should_shed():
+                await self.reply_event_async(event, BUSY_REPLY)
+                return
+            try:
+                await self._answer_async(event, user_input)
+            except deadline.DeadlineExceeded as e:
+                metrics.increment("line.shed")
+                logger.warning(f"{e}，回覆忙碌訊息")
+                await self.reply_event_async(event, BUSY_REPLY)
+        finally:
+            deadline.clear()
+            set_current_user(None)
+
+    async def _answer_async(self, event, user_input):
+        """_answer 的非同步版本"""
+        query_embedding = None
+        if self.semantic_cache is not None:
+            query_embedding = await self.query_engine.embed_async(user_input)
+            cached = self.semantic_cache.lookup(query_embedding, namespace="line")
+            if cached:
+                await self.reply_event_async(event, cached)
+                return
+
+        combined_data = await self.query_engine.query_async(user_input, query_embedding=query_embedding)
+        context = combined_data or self._fallback_context(user_input)
+        answer = await self.response_generator.generate_async(user_input, context, mode="brief")
+        self._store_semantic_cache(query_embedding, answer)
+        await self.reply_event_async(event, answer)
+
+    def _store_semantic_cache(self, query_embedding, answer):
+        """成功生成的回覆才寫入語意快取（錯誤訊息不快取）"""
+        if self.semantic_cache is None or not answer or answer.startswith("⚠️"):
             return
+        self.semantic_cache.store(query_embedding, answer, namespace="line")
 
-        combined_data = self.query_engine.query(user_input)
-        if not combined_data:
-            # 後備策略：向量庫目前無資料或查無結果，改以使用者敘述作為上下文進行簡短分析
-            fallback_context = (
-                "（資料庫目前無可用文件；請僅根據使用者敘述判斷是否為詐騙，並提供簡短理由與建議。）\n"
-                f"使用者敘述：{user_input}"
-            )
-            answer = self.response_generator.generate(user_input, fallback_context, mode="brief")
-            self.reply_message(event.reply_token, answer)
+    @staticmethod
+    def _event_age(event):
+        """事件發生至今的秒數（無時間戳記時為 0）"""
+        timestamp = getattr(event, "timestamp", None)
+        if not timestamp:
+            return 0.0
+        return max(0.0, time.time() - timestamp / 1000.0)
+
+    def _reply_token_expired(self, event):
+        """依事件時間判斷 reply token 是否已逾期（生成過慢時）"""
+        return self._event_age(event) > self.reply_token_ttl
+
+    @staticmethod
+    def _is_invalid_reply_token(error):
+        return isinstance(error, ApiException) and error.status == 400 and "reply token" in str(error.body or "").lower()
+
+    def reply_event(self, event, text):
+        """回覆事件：reply token 已逾期（或回覆時被判定無效）時改以 push 傳送給該使用者"""
+        user_id = getattr(getattr(event, "source", None), "user_id", None)
+        if user_id and self._reply_token_expired(event):
+            logger.warning("reply token 已逾期，改用 push 傳送")
+            self.push_message(user_id, text)
             return
+        self.reply_message(event.reply_token, text, user_id=user_id)
 
-        # answer = self.response_generator.generate(user_input, combined_data)
-        # 0528 - 呼叫 generate 時加入 mode="brief" 讓 LINE 回覆簡短開始
-        answer = self.response_generator.generate(user_input, combined_data, mode="brief")
-        # 0528 - 呼叫 generate 時加入 mode="brief" 讓 LINE 回覆簡短結束
-        self.reply_message(event.reply_token, answer)
+    def reply_message(self, reply_token, text, user_id=None):
+        """回應用戶訊息（提供 user_id 時，reply token 無效會改用 push）"""
+        try:
+            self.messaging_api.reply_message_with_http_info(
+                ReplyMessageRequest(
+                    reply_token=reply_token,
+                    messages=[TextMessage(text=text)]
+                )
+            )
+            logger.info(f"回覆訊息：{text[:50]}...")
+        except Exception as e:
+            if user_id and self._is_invalid_reply_token(e):
+                logger.warning("reply token 無效（可能已逾期），改用 push 傳送")
+                self.push_message(user_id, text)
+                return
+            logger.error(f"回覆訊息時發生錯誤：{e}")
 
-    def reply_message(self, reply_token, text):
-        """回應用戶訊息"""
+    def push_message(self, user_id, text):
+        """主動推播訊息給使用者（reply token 逾期時的備援）"""
         try:
-            with ApiClient(self.configuration) as api_client:
-                line_bot_api = MessagingApi(api_client)
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=reply_token,
-                        messages=[TextMessage(text=text)]
-                    )
+            self.messaging_api.push_message_with_http_info(
+                PushMessageRequest(to=user_id, messages=[TextMessage(text=text)])
+            )
+            logger.info(f"推播訊息：{text[:50]}...")
+        except Exception as e:
+            logger.error(f"推播訊息時發生錯誤：{e}")
+
+    def _get_async_messaging_api(self):
+        if self._async_messaging_api is None:
+            self._async_api_client = AsyncApiClient(self.configuration)
+            self._async_messaging_api = AsyncMessagingApi(self._async_api_client)
+        return self._async_messaging_api
+
+    async def reply_event_async(self, event, text):
+        """reply_event 的非同步版本"""
+        user_id = getattr(getattr(event, "source", None), "user_id", None)
+        if user_id and self._reply_token_expired(event):
+            logger.warning("reply token 已逾期，改用 push 傳送")
+            await self.push_message_async(user_id, text)
+            return
+        await self.reply_message_async(event.reply_token, text, user_id=user_id)
+
+    async def reply_message_async(self, reply_token, text, user_id=None):
+        """reply_message 的非同步版本（LINE SDK 的 AsyncApiClient，行程內共用）"""
+        try:
+            await self._get_async_messaging_api().reply_message_with_http_info(
+                ReplyMessageRequest(
+                    reply_token=reply_token,
+                    messages=[TextMessage(text=text)]
                 )
+            )
             logger.info(f"回覆訊息：{text[:50]}...")
         except Exception as e:
-            logger.error(f"回覆訊息時發生錯誤：{e}")
\ No newline at end of file
+            if user_id and self._is_invalid_reply_token(e):
+                logger.warning("reply token 無效（可能已逾期），改用 push 傳送")
+                await self.push_message_async(user_id, text)
+                return
+            logger.error(f"回覆訊息時發生錯誤：{e}")
+
+    async def push_message_async(self, user_id, text):
+        """push_message 的非同步版本"""
+        try:
+            await self._get_async_messaging_api().push_message_with_http_info(
+                PushMessageRequest(to=user_id, messages=[TextMessage(text=text)])
+            )
+            logger.info(f"推播訊息：{text[:50]}...")
+        except Exception as e:
+            logger.error(f"推播訊息時發生錯誤：{e}")
+
+    def close(self):
+        """關閉共用的 LINE API 連線池（行程結束時呼叫）"""
+        if self.coalescer is not None:
+            # 先送出合併視窗中等待的訊息，再等待背景佇列處理完畢
+            self.coalescer.close()
+            self.coalescer = None
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+            self.dispatcher = None
+        if self.api_client is not None:
+            self.api_client.close()
+            pool_manager = getattr(getattr(self.api_client, "rest_client", None), "pool_manager", None)
+            if pool_manager is not None:
+                pool_manager.clear()
+            self.api_client = None
+
+    async def aclose(self):
+        """關閉非同步 LINE API 用戶端（ASGI lifespan 結束時呼叫）"""
+        if self._async_api_client is not None:
+            await self._async_api_client.close()
+            self._async_api_client = None
+            self._async_messaging_api = None
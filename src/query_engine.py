@@ -1,48 +1,378 @@
-import ollama
-import os
+import asyncio
 import logging
+from utils.ollama_client import OllamaClient
+from utils.ollama_balancer import resolve_backends
+from utils import deadline
+from src.embedding_cache import embedding_key, get_embedding_cache
+from utils.prompt_budget import jaccard, shingles
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+# 檢索模式：vector（向量）、hybrid（向量 + BM25 以 RRF 融合）、lexical（僅 BM25，不需 embedding）
+RETRIEVAL_MODES = ("vector", "hybrid", "lexical")
+
+
+def retrieval_mode(config):
+    """設定的檢索模式（config.ollama.line.retrieval.mode，未設定為 vector）"""
+    mode = (((config or {}).get("retrieval", {}) or {}).get("mode") or "vector").lower()
+    if mode not in RETRIEVAL_MODES:
+        logger.warning(f"未知的檢索模式：{mode}，改用 vector")
+        return "vector"
+    return mode
+
+
 class QueryEngine:
-    def __init__(self, collection, config):
+    def __init__(self, collection, config, lexical_index=None):
+        """
+        Args:
+            collection: Chroma collection（或相同介面的向量索引）
+            config: config.ollama.line 區段
+            lexical_index: BM25 倒排索引（DataLoader.get_lexical_index；hybrid / lexical 模式需要）
+        """
         self.collection = collection
         self.config = config
+        # 依 config 的 backends / base_url 建立（可多後端負載平衡）的 Ollama 用戶端
+        self.ollama_client = OllamaClient(
+            resolve_backends(self.config or {}),
+            (self.config or {}).get("embedding_model") or (self.config or {}).get("model") or ""
+        )
+        # 查詢向量快取（config.cache.embedding；行程內共用，鍵含 embedding 模型）
+        self.embedding_cache = get_embedding_cache()
+        # 檢索設定（retrieval 子區段）：batch_size 為 embed_many / query_many 每批筆數
+        retrieval_config = (self.config or {}).get("retrieval", {}) or {}
+        self.batch_size = max(1, int(retrieval_config.get("batch_size", 64)))
+        # Ollama 不支援 /api/embed（舊版）時改為逐筆呼叫，之後不再嘗試批次
+        self._batch_supported = True
+        # 混合檢索：lexical_weight 為 BM25 在 RRF 中的權重（向量為 1 - lexical_weight），
+        # 兩邊各取 n_results * candidate_factor 筆候選再融合
+        self.lexical_index = lexical_index
+        self.mode = retrieval_mode(self.config)
+        self.lexical_weight = min(1.0, max(0.0, float(retrieval_config.get("lexical_weight", 0.5))))
+        self.rrf_k = float(retrieval_config.get("rrf_k", 60))
+        self.candidate_factor = max(1, int(retrieval_config.get("candidate_factor", 4)))
+        # BM25 門檻：分數需達查詢可得最高分的此比例（沒有向量距離可判斷相關性的文件靠此排除弱命中）
+        self.lexical_min_score = min(1.0, max(0.0, float(retrieval_config.get("lexical_min_score", 0.3))))
+        # 回傳筆數、距離上限（超過者視為不相關而捨棄，None 表示不限）與 MMR 去冗餘
+        self.n_results = max(1, int(retrieval_config.get("n_results", 3)))
+        max_distance = retrieval_config.get("max_distance")
+        self.max_distance = float(max_distance) if max_distance is not None else None
+        mmr_config = retrieval_config.get("mmr", {}) or {}
+        self.mmr_enabled = bool(mmr_config.get("enabled", False))
+        self.mmr_lambda = min(1.0, max(0.0, float(mmr_config.get("lambda", 0.5))))
+        self.mmr_fetch_factor = max(1, int(mmr_config.get("fetch_factor", 3)))
+        if self.mode != "vector" and self.lexical_index is None:
+            if self.collection is not None:
+                logger.warning(f"檢索模式 {self.mode} 需要 BM25 索引但尚未建立，改用 vector")
+            self.mode = "vector"
+
+    def _embedding_model(self):
+        model = (
+            (self.config or {}).get("embedding_model")
+            or (self.config or {}).get("model")
+        )
+        if not model:
+            raise KeyError("embedding model is not configured (expected 'embedding_model' or 'model')")
+        return model
+
+    def _query_embedding(self, user_input):
+        """取得查詢向量：先查快取，未命中才呼叫 Ollama（失敗時拋出例外）"""
+        model = self._embedding_model()
+        return self.embedding_cache.get_or_compute(
+            embedding_key(user_input, model),
+            lambda: self.ollama_client.embeddings(prompt=user_input, model=model)["embedding"]
+        )
 
-    def query(self, user_input):
-        if not self.collection:
-            logger.warning("資料庫尚未初始化")
+    async def _query_embedding_async(self, user_input):
+        """_query_embedding 的非同步版本"""
+        model = self._embedding_model()
+
+        async def compute():
+            response = await self.ollama_client.embeddings_async(prompt=user_input, model=model)
+            return response["embedding"]
+
+        return await self.embedding_cache.get_or_compute_async(embedding_key(user_input, model), compute)
+
+    def embed(self, user_input):
+        """將文字轉為查詢向量（失敗時回傳 None；時間預算用盡時拋出 DeadlineExceeded）"""
+        try:
+            return self._query_embedding(user_input)
+        except deadline.DeadlineExceeded:
+            # 時間預算用盡交由呼叫端改用快速回覆
+            raise
+        except Exception as e:
+            logger.error(f"產生查詢向量時發生錯誤：{e}")
             return None
 
+    async def embed_async(self, user_input):
+        """embed 的非同步版本（失敗時回傳 None）"""
         try:
-            base_url = (self.config or {}).get("base_url")
-            if base_url:
-                os.environ.setdefault("OLLAMA_HOST", base_url)
+            return await self._query_embedding_async(user_input)
+        except deadline.DeadlineExceeded:
+            # 時間預算用盡交由呼叫端改用快速回覆
+            raise
+        except Exception as e:
+            logger.error(f"產生查詢向量時發生錯誤：{e}")
+            return None
 
-            model = (
-                (self.config or {}).get("embedding_model")
-                or (self.config or {}).get("model")
-            )
-            if not model:
-                raise KeyError("embedding model is not configured (expected 'embedding_model' or 'model')")
+    def embed_many(self, texts):
+        """
+        批次取得查詢向量（順序同 texts，失敗者為 None）：先查快取，未命中者（相同文字只算一次）
+        每 batch_size 筆以一次 /api/embed 取得；時間預算用盡時拋出 DeadlineExceeded
+        """
+        texts = list(texts)
+        model = self._embedding_model()
+        keys = [embedding_key(text, model) for text in texts]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        pending = {}
+        for i, (key, embedding) in enumerate(zip(keys, embeddings)):
+            if embedding is None:
+                pending.setdefault(key, []).append(i)
+        pending_keys = list(pending)
+        for start in range(0, len(pending_keys), self.batch_size):
+            batch = pending_keys[start:start + self.batch_size]
+            vectors = self._embed_batch([texts[pending[key][0]] for key in batch], model)
+            for key, vector in zip(batch, vectors):
+                if vector:
+                    self.embedding_cache.set(key, vector)
+                for i in pending[key]:
+                    embeddings[i] = vector or None
+        return embeddings
 
-            response = ollama.embeddings(
-                prompt=user_input,
-                model=model
-            )
-            query_embedding = response["embedding"]
-
-            results = self.collection.query(query_embeddings=[query_embedding], n_results=3)
-            documents = results.get("documents", [[]])[0] if results else []
-            # 過濾空白/None 文件
-            documents = [d for d in documents if isinstance(d, str) and d.strip()]
-            
-            if not documents:
-                logger.warning("未找到相關資料")
-                return None
-            
-            return "\n\n".join(documents)
+    def _embed_batch(self, texts, model):
+        """一批文字的向量：優先使用批次 API，失敗時逐筆呼叫（個別失敗者為 None）"""
+        if self._batch_supported:
+            try:
+                return self.ollama_client.embed_batch(texts, model=model)
+            except deadline.DeadlineExceeded:
+                raise
+            except Exception as e:
+                if getattr(getattr(e, "response", None), "status_code", None) == 404:
+                    self._batch_supported = False
+                logger.warning(f"批次產生查詢向量失敗，改為逐筆呼叫：{e}")
+        vectors = []
+        for text in texts:
+            try:
+                vectors.append(self.ollama_client.embeddings(prompt=text, model=model)["embedding"])
+            except deadline.DeadlineExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"產生查詢向量時發生錯誤：{e}")
+                vectors.append(None)
+        return vectors
+
+    def query_many(self, texts, n_results=None):
+        """
+        批次查詢：批次取得查詢向量，每 batch_size 筆以一次多向量 Chroma 查詢取回相關文件
+        （hybrid 模式再與 BM25 結果融合；lexical 模式不取向量）
+        回傳與 texts 對應的列表，每筆為 {"documents": [...], "distances": [...]}（距離越小越相關，
+        只由 BM25 取得的文件距離為 None；向量取得失敗或查無資料時為空列表）；資料庫未初始化時回傳 None
+        n_results 預設為設定值；時間預算用盡時拋出 DeadlineExceeded
+        """
+        if not self._ready():
+            return None
+
+        n_results = n_results or self.n_results
+        texts = list(texts)
+        results = [{"documents": [], "distances": []} for _ in texts]
+        if self.mode == "lexical":
+            embeddings = [None] * len(texts)
+            indexed = list(enumerate(embeddings))
+        else:
+            embeddings = self.embed_many(texts)
+            indexed = [(i, embedding) for i, embedding in enumerate(embeddings) if embedding is not None]
+        for start in range(0, len(indexed), self.batch_size):
+            chunk = indexed[start:start + self.batch_size]
+            deadline.check("向量檢索")
+            try:
+                hits = self._retrieve(
+                    [texts[i] for i, _ in chunk], [embedding for _, embedding in chunk], n_results
+                )
+            except Exception as e:
+                logger.error(f"批次查詢時發生錯誤：{e}")
+                continue
+            for (i, _), hit in zip(chunk, hits):
+                results[i] = hit
+        return results
+
+    def _ready(self):
+        """檢索所需的索引是否已載入（lexical 模式只需 BM25 索引）"""
+        if self.mode == "lexical" or self.collection:
+            return True
+        logger.warning("資料庫尚未初始化")
+        return False
+
+    def search(self, user_input, query_embedding=None, n_results=None):
+        """
+        查詢資料庫，回傳 {"documents": [...], "distances": [...]}（距離越小越相關，只由 BM25 取得者為 None），
+        呼叫端可依距離決定後續流程；索引未初始化或查詢失敗時回傳 None
+        query_embedding：已算好的查詢向量（例如語意快取已計算過），避免重複 embedding
+        lexical 模式不需查詢向量；時間預算用盡時拋出 DeadlineExceeded
+        """
+        if not self._ready():
+            return None
+
+        try:
+            if query_embedding is None and self.mode != "lexical":
+                query_embedding = self._query_embedding(user_input)
+            deadline.check("向量檢索")
+            return self._retrieve([user_input], [query_embedding], n_results or self.n_results)[0]
+        except deadline.DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"查詢時發生錯誤：{e}")
-            return None
\ No newline at end of file
+            return None
+
+    async def search_async(self, user_input, query_embedding=None, n_results=None):
+        """
+        search 的非同步版本：embedding 走非同步 HTTP，Chroma 查詢（本地、同步）交由執行緒執行
+        """
+        if not self._ready():
+            return None
+
+        try:
+            if query_embedding is None and self.mode != "lexical":
+                query_embedding = await self._query_embedding_async(user_input)
+            deadline.check("向量檢索")
+            n_results = n_results or self.n_results
+            if self.mode == "lexical":
+                # BM25 查詢在記憶體內完成，不需交由執行緒
+                return self._retrieve([user_input], [None], n_results)[0]
+            hits = await asyncio.to_thread(self._retrieve, [user_input], [query_embedding], n_results)
+            return hits[0]
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"查詢時發生錯誤：{e}")
+            return None
+
+    def query(self, user_input, query_embedding=None, n_results=None):
+        """
+        查詢資料庫，回傳合併後的相關文件（查無資料時回傳 None：向量結果全部超過距離上限，且 hybrid / lexical 模式下
+        也沒有達到 BM25 門檻的字詞命中）
+        時間預算用盡時拋出 DeadlineExceeded
+        """
+        return self._combine(self.search(user_input, query_embedding, n_results))
+
+    async def query_async(self, user_input, query_embedding=None, n_results=None):
+        """query 的非同步版本"""
+        return self._combine(await self.search_async(user_input, query_embedding, n_results))
+
+    @staticmethod
+    def _combine(hit):
+        """合併文件作為 prompt 的資料庫內容"""
+        if hit is None:
+            return None
+        if not hit["documents"]:
+            logger.warning("未找到相關資料")
+            return None
+        return "\n\n".join(hit["documents"])
+
+    def _retrieve(self, texts, query_embeddings, n_results):
+        """
+        依檢索模式取回每筆查詢的 {"documents", "distances"}（lexical 模式不使用 query_embeddings）
+        距離上限套用於（融合後）已知向量距離的文件；啟用 MMR 時多取候選再去冗餘選出 n_results 筆
+        """
+        fetch = n_results * self.mmr_fetch_factor if self.mmr_enabled else n_results
+        return [self._select(hit, n_results) for hit in self._candidates(texts, query_embeddings, fetch)]
+
+    def _candidates(self, texts, query_embeddings, n_results):
+        if self.mode == "lexical":
+            return [self._lexical_hits(text, n_results) for text in texts]
+        if self.mode == "vector":
+            return [self._within_distance(hit) for hit in self._search_many(query_embeddings, n_results)]
+        candidates = n_results * self.candidate_factor
+        vector_hits = self._search_many(query_embeddings, candidates)
+        # 先融合再套用距離上限：向量距離過遠的文件即使也被 BM25 取回仍會捨棄
+        fused = [
+            self._within_distance(self._fuse(vector_hit, self._lexical_hits(text, candidates)))
+            for text, vector_hit in zip(texts, vector_hits)
+        ]
+        return [
+            {"documents": hit["documents"][:n_results], "distances": hit["distances"][:n_results]}
+            for hit in fused
+        ]
+
+    def _within_distance(self, hit):
+        """捨棄距離超過 max_distance 的文件（距離未知者為只由 BM25 取得、已達 lexical_min_score 門檻者，保留）"""
+        if self.max_distance is None:
+            return hit
+        pairs = [
+            (doc, dist) for doc, dist in zip(hit["documents"], hit["distances"])
+            if dist is None or dist <= self.max_distance
+        ]
+        return {"documents": [doc for doc, _ in pairs], "distances": [dist for _, dist in pairs]}
+
+    def _select(self, hit, n_results):
+        """
+        最大邊際相關（MMR）：依序挑選 λ·相關度 − (1−λ)·與已選文件的最大相似度 最高者
+        相關度：候選皆有向量距離時以距離線性換算為 0~1（最近者為 1），否則（含 BM25 / 融合結果）取自候選名次；
+        相似度為字元 3-gram Jaccard；未啟用 MMR 時直接取前 n_results 筆
+        """
+        documents, distances = hit["documents"], hit["distances"]
+        if not self.mmr_enabled or len(documents) <= 1:
+            return {"documents": documents[:n_results], "distances": distances[:n_results]}
+        count = len(documents)
+        grams = [shingles(doc) for doc in documents]
+        if all(dist is not None for dist in distances):
+            nearest, farthest = min(distances), max(distances)
+            spread = farthest - nearest
+            relevance = [1.0 - (dist - nearest) / spread if spread else 1.0 for dist in distances]
+        else:
+            relevance = [1.0 - i / count for i in range(count)]
+        redundancy = [0.0] * count
+        selected, remaining = [], list(range(count))
+        while remaining and len(selected) < n_results:
+            best = max(
+                remaining,
+                key=lambda i: self.mmr_lambda * relevance[i] - (1.0 - self.mmr_lambda) * redundancy[i]
+            )
+            selected.append(best)
+            remaining.remove(best)
+            for i in remaining:
+                redundancy[i] = max(redundancy[i], jaccard(grams[i], grams[best]))
+        return {"documents": [documents[i] for i in selected], "distances": [distances[i] for i in selected]}
+
+    def _lexical_hits(self, text, n_results):
+        """BM25 查詢結果（與 _search_many 相同格式，距離為 None）；分數未達 lexical_min_score 門檻者不列入"""
+        documents = [
+            doc for doc in self.lexical_index.search_documents(text, n_results, self.lexical_min_score)
+            if doc.strip()
+        ]
+        return {"documents": documents, "distances": [None] * len(documents)}
+
+    def _fuse(self, vector_hit, lexical_hit):
+        """
+        倒數排名融合（RRF）：分數 = Σ 權重 / (rrf_k + 名次)，同一文件在兩邊的分數相加，回傳全部候選（依分數排序）
+        保留向量距離（只由 BM25 取得者為 None）
+        """
+        scores, distances = {}, {}
+        vector_weight = 1.0 - self.lexical_weight
+        for rank, (doc, dist) in enumerate(zip(vector_hit["documents"], vector_hit["distances"]), 1):
+            scores[doc] = scores.get(doc, 0.0) + vector_weight / (self.rrf_k + rank)
+            distances.setdefault(doc, dist)
+        for rank, doc in enumerate(lexical_hit["documents"], 1):
+            scores[doc] = scores.get(doc, 0.0) + self.lexical_weight / (self.rrf_k + rank)
+            distances.setdefault(doc, None)
+        ranked = sorted(scores, key=lambda doc: scores[doc], reverse=True)
+        return {"documents": ranked, "distances": [distances[doc] for doc in ranked]}
+
+    def _search_many(self, query_embeddings, n_results):
+        """多向量 Chroma 查詢：回傳每個查詢向量的 {"documents", "distances"}（過濾空白/None 文件）"""
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=["documents", "distances"]
+        ) or {}
+        documents = results.get("documents") or []
+        distances = results.get("distances") or []
+        hits = []
+        for i in range(len(query_embeddings)):
+            docs = documents[i] if i < len(documents) else []
+            dists = distances[i] if i < len(distances) and distances[i] is not None else [None] * len(docs)
+            pairs = [(doc, dist) for doc, dist in zip(docs, dists) if isinstance(doc, str) and doc.strip()]
+            hits.append({
+                "documents": [doc for doc, _ in pairs],
+                "distances": [dist for _, dist in pairs],
+            })
+        return hits
@@ -1,16 +1,99 @@
-import ollama
-import os
 import logging
+import re
+from utils.ollama_client import OllamaClient
+from utils.ollama_balancer import resolve_backends
+from utils import deadline, metrics
+from utils.prompt_budget import build_context, report_prompt
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+# 風險等級後處理用的樣式（_postprocess 與 RiskLevelStream 共用）
+_PROBABILITY_FIELD = re.compile(r"詐騙\s*機率")
+_PERCENT = re.compile(r"(\d{1,3})\s*%")
+_PERCENT_VALUE = re.compile(r"：?\s*\d{1,3}\s*%")
+_RISK_LINE = re.compile(r"(詐騙風險\s*[:：]\s*).*")
+# 提前結束時需停在句末，避免截斷半句
+_SENTENCE_END = ("。", "！", "？", "!", "?", "\n")
+
+
+class RiskLevelStream:
+    def __init__(self):
+        """
+        風險等級後處理的逐行版本（串流生成時邊接收邊處理）：規則同 ResponseGenerator._postprocess，
+        但以行為單位套用（樣式不跨越換行）
+        - 「詐騙機率」改為「詐騙風險」
+        - 百分比依第一個出現的數值映射為高/低（>= 60% 為高）
+        - 全文皆無「高/低」時，「詐騙風險：」一行補為「高」（因此這類行會保留到確定為止才輸出）
+        """
+        self.level = None
+        self.has_level_word = False
+        self._buffer = ""
+        self._held = []
+
+    def _process(self, line):
+        line = _PROBABILITY_FIELD.sub("詐騙風險", line)
+        if self.level is None:
+            m = _PERCENT.search(line)
+            if m:
+                self.level = "高" if int(m.group(1)) >= 60 else "低"
+        if self.level is not None:
+            line = _PERCENT_VALUE.sub(f"：{self.level}", line)
+        return line
+
+    def _emit(self, line):
+        if "高" in line or "低" in line:
+            self.has_level_word = True
+        if self._held or ("詐騙風險" in line and not self.has_level_word):
+            self._held.append(line)
+            if not self.has_level_word:
+                return ""
+            released, self._held = "".join(self._held), []
+            return released
+        return line
+
+    def feed(self, chunk):
+        """加入生成片段，回傳已完成（處理後）的行"""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split("\n")
+        return "".join(self._emit(self._process(line) + "\n") for line in lines)
+
+    def finish(self):
+        """生成結束：處理最後一行並輸出保留中的內容"""
+        tail = self._emit(self._process(self._buffer)) if self._buffer else ""
+        self._buffer = ""
+        if self._held:
+            held, self._held = self._held, []
+            return "".join(_RISK_LINE.sub(r"\1高", line) for line in held)
+        return tail
+
+
 class ResponseGenerator:
     def __init__(self, config):
+        """
+        以 Ollama 生成回覆（設定為 config.ollama.line 區段）
+
+        生成參數（generation 子區段）：
+        - modes.<mode>：各模式的 Ollama options（num_predict 輸出上限、stop、temperature 等）
+        - stream：以串流生成，brief 模式達 brief_max_chars 後於句末提前結束
+        """
         self.config = config
+        # 依 config 的 backends / base_url 建立（可多後端負載平衡）的 Ollama 用戶端
+        self.ollama_client = OllamaClient(
+            resolve_backends(self.config or {}),
+            (self.config or {}).get("generation_model") or (self.config or {}).get("model") or "",
+            request_class="generate"
+        )
+        generation_config = (self.config or {}).get("generation", {}) or {}
+        self.mode_options = {
+            mode: dict(options or {}) for mode, options in (generation_config.get("modes", {}) or {}).items()
+        }
+        self.stream = bool(generation_config.get("stream", False))
+        self.brief_max_chars = int(generation_config.get("brief_max_chars", 0))
 
     # 0528 - 新增 mode 參數開始
-    def generate(self, user_input, combined_data, mode="detailed"):
+    def _build_prompt(self, user_input, combined_data, mode="detailed"):
+        """組合完整 prompt（system prompt + 資料庫內容 + 使用者問題）"""
         if mode == "brief":
             system_prompt = """
         你是一個專業的詐騙分析助手。你收到的「資料庫內容」可能包含「詐騙案例」和「合法的官方流程」。
@@ -35,43 +118,118 @@ class ResponseGenerator:
 # 資料庫內容如下：
 # """
         user_prompt = f"請根據上述資料，回答用戶提出的問題：{user_input}"
-        full_prompt = system_prompt + "\n" + combined_data + "\n" + user_prompt
+        # 資料庫內容去重並限制在 token 預算內（config.prompt_budget）
+        full_prompt = system_prompt + "\n" + build_context(combined_data) + "\n" + user_prompt
+        report_prompt("generate", full_prompt)
+        return full_prompt
+
+    def _generation_model(self):
+        model = (
+            (self.config or {}).get("generation_model")
+            or (self.config or {}).get("model")
+        )
+        if not model:
+            raise KeyError("generation model is not configured (expected 'generation_model' or 'model')")
+        return model
 
+    def _options(self, mode):
+        """該模式的 Ollama 生成參數（未設定時回傳 None，沿用模型預設）"""
+        return self.mode_options.get(mode) or None
+
+    def _postprocess(self, text):
+        """後處理：將任何「機率/百分比」改為風險等級（高/低），並統一欄位名稱"""
+        try:
+            s = text
+            # 將「詐騙機率」欄位名改為「詐騙風險」
+            s = _PROBABILITY_FIELD.sub("詐騙風險", s)
+            # 擷取百分比（若模型仍輸出），依閾值映射為高/低，並移除數字
+            # 閾值：>= 60% → 高，否則低
+            m = _PERCENT.search(s)
+            if m:
+                pct = int(m.group(1))
+                level = "高" if pct >= 60 else "低"
+                s = _PERCENT_VALUE.sub(f"：{level}", s)
+            # 若沒有百分比但寫了「風險等級：」之類的描述，嘗試規範成「高/低」
+            # 若偵測不到「高/低」，預設使用「高」作為保守提示
+            if ("詐騙風險" in s) and ("高" not in s and "低" not in s):
+                s = _RISK_LINE.sub(r"\1高", s)
+            return s
+        except Exception:
+            return text
+
+    def generate(self, user_input, combined_data, mode="detailed"):
+        full_prompt = self._build_prompt(user_input, combined_data, mode)
+
+        try:
+            if self.stream:
+                return self._generate_stream(full_prompt, mode)
+            output = self.ollama_client.generate(
+                model=self._generation_model(), prompt=full_prompt, options=self._options(mode)
+            )
+            return self._postprocess(output["response"])
+        except deadline.DeadlineExceeded:
+            # 時間預算用盡（含排隊逾時）交由呼叫端改用快速回覆
+            raise
+        except Exception as e:
+            logger.error(f"生成回答時發生錯誤：{e}")
+            return "⚠️ 無法生成回答，請稍後再試。"
+
+    def _generate_stream(self, full_prompt, mode):
+        """
+        串流生成：邊接收邊套用風險等級後處理；brief 模式內容達 brief_max_chars 後於句末提前結束
+        （關閉串流即停止 Ollama 解碼）
+        """
+        postprocessor = RiskLevelStream()
+        parts, raw = [], []
+        raw_chars = 0
+        completed = False
+        stream = self.ollama_client.stream_generate(
+            model=self._generation_model(), prompt=full_prompt, options=self._options(mode)
+        )
         try:
-            base_url = (self.config or {}).get("base_url")
-            if base_url:
-                os.environ.setdefault("OLLAMA_HOST", base_url)
+            while True:
+                try:
+                    chunk = next(stream)
+                except StopIteration as stop:
+                    completed = bool(stop.value)
+                    break
+                raw.append(chunk)
+                raw_chars += len(chunk)
+                parts.append(postprocessor.feed(chunk))
+                if (
+                    mode == "brief"
+                    and self.brief_max_chars
+                    and raw_chars >= self.brief_max_chars
+                    and chunk.rstrip(" ").endswith(_SENTENCE_END)
+                ):
+                    metrics.increment("generation.early_stops")
+                    logger.info(f"簡短回覆已達 {raw_chars} 字，提前結束生成")
+                    completed = True
+                    break
+        finally:
+            stream.close()
+        parts.append(postprocessor.finish())
+        text = "".join(parts)
+        if not "".join(raw).strip():
+            if deadline.expired():
+                raise deadline.DeadlineExceeded("生成超過時間預算")
+            return "⚠️ 無法生成回答，請稍後再試。"
+        if not completed:
+            logger.warning("串流生成中斷，回覆已生成的部分內容")
+        return text
+
+    async def generate_async(self, user_input, combined_data, mode="detailed"):
+        """generate 的非同步版本（ASGI 路徑；非串流，同樣套用各模式的生成參數）"""
+        full_prompt = self._build_prompt(user_input, combined_data, mode)
 
-            model = (
-                (self.config or {}).get("generation_model")
-                or (self.config or {}).get("model")
+        try:
+            output = await self.ollama_client.generate_async(
+                model=self._generation_model(), prompt=full_prompt, options=self._options(mode)
             )
-            if not model:
-                raise KeyError("generation model is not configured (expected 'generation_model' or 'model')")
-
-            output = ollama.generate(model=model, prompt=full_prompt)
-            text = output["response"]
-
-            # 後處理：將任何「機率/百分比」改為風險等級（高/低），並統一欄位名稱
-            try:
-                import re
-                s = text
-                # 將「詐騙機率」欄位名改為「詐騙風險」
-                s = re.sub(r"詐騙\s*機率", "詐騙風險", s)
-                # 擷取百分比（若模型仍輸出），依閾值映射為高/低，並移除數字
-                # 閾值：>= 60% → 高，否則低
-                m = re.search(r"(\d{1,3})\s*%", s)
-                if m:
-                    pct = int(m.group(1))
-                    level = "高" if pct >= 60 else "低"
-                    s = re.sub(r"：?\s*\d{1,3}\s*%", f"：{level}", s)
-                # 若沒有百分比但寫了「風險等級：」之類的描述，嘗試規範成「高/低」
-                # 若偵測不到「高/低」，預設使用「高」作為保守提示
-                if ("詐騙風險" in s) and ("高" not in s and "低" not in s):
-                    s = re.sub(r"(詐騙風險\s*[:：]\s*).*", r"\1高", s)
-                return s
-            except Exception:
-                return text
+            return self._postprocess(output["response"])
+        except deadline.DeadlineExceeded:
+            # 時間預算用盡（含排隊逾時）交由呼叫端改用快速回覆
+            raise
         except Exception as e:
             logger.error(f"生成回答時發生錯誤：{e}")
-            return "⚠️ 無法生成回答，請稍後再試。"
\ No newline at end of file
+            return "⚠️ 無法生成回答，請稍後再試。"
@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_size: int = 1000,
+        ttl_seconds: float = 3600,
+        version_fn: Optional[Callable[[], str]] = None
+    ):
+        """
+        語意快取：以問題的 embedding 找出餘弦相似度達門檻的既有回覆，近似重複的問題直接重用
+
+        Args:
+            threshold: 餘弦相似度門檻（0~1，越高越嚴格）
+            max_size: 最大筆數（超過時淘汰最舊者）
+            ttl_seconds: 每筆資料存活秒數
+            version_fn: 回傳目前語料版本的函式；版本改變時整個快取失效
+        """
+        self.threshold = float(threshold)
+        self.max_size = int(max_size)
+        self.ttl_seconds = float(ttl_seconds)
+        self.version_fn = version_fn
+        self._version = version_fn() if version_fn else ""
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, cache_config: Dict, version_fn: Optional[Callable[[], str]] = None) -> Optional["SemanticCache"]:
+        """依 config.cache.semantic 建立；未啟用時回傳 None"""
+        cache_config = cache_config or {}
+        if not cache_config.get("enabled", False):
+            return None
+        return cls(
+            threshold=cache_config.get("threshold", 0.95),
+            max_size=cache_config.get("max_size", 1000),
+            ttl_seconds=cache_config.get("ttl_seconds", 3600),
+            version_fn=version_fn
+        )
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> Optional[np.ndarray]:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        if vec.ndim != 1 or norm == 0.0:
+            return None
+        return vec / norm
+
+    def _check_version(self) -> None:
+        """語料版本改變時清空快取（呼叫端需持有鎖）"""
+        if not self.version_fn:
+            return
+        try:
+            version = self.version_fn()
+        except Exception as e:
+            logger.warning(f"取得語料版本失敗：{e}")
+            return
+        if version != self._version:
+            if self._entries:
+                logger.info(f"語料版本變更（{self._version} -> {version}），清空語意快取 {len(self._entries)} 筆")
+            self._entries.clear()
+            self._version = version
+
+    def lookup(self, embedding: Optional[List[float]], namespace: str = "") -> Optional[str]:
+        """
+        找出同一 namespace 中相似度最高且達門檻的快取回覆
+
+        Args:
+            embedding: 問題的 embedding
+            namespace: 區隔不同用途/上下文（例如 LINE 與 Web、不同對話歷史）
+
+        Returns:
+            Optional[str]: 命中時回傳快取回覆，否則 None
+        """
+        if embedding is None:
+            return None
+        query = self._normalize(embedding)
+        if query is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._check_version()
+            best_id, best_score = None, -1.0
+            for entry_id, (ns, vec, value, expires_at) in list(self._entries.items()):
+                if now >= expires_at:
+                    del self._entries[entry_id]
+                    continue
+                if ns != namespace or vec.shape != query.shape:
+                    continue
+                score = float(np.dot(vec, query))
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is not None and best_score >= self.threshold:
+                self.hits += 1
+                logger.info(f"語意快取命中（namespace={namespace or '-'}, similarity={best_score:.4f}）")
+                return self._entries[best_id][2]
+            self.misses += 1
+            return None
+
+    def store(self, embedding: Optional[List[float]], value: str, namespace: str = "") -> None:
+        """寫入一筆快取（embedding 無效或回覆為空時略過）"""
+        if embedding is None or not value:
+            return
+        vec = self._normalize(embedding)
+        if vec is None:
+            return
+        with self._lock:
+            self._check_version()
+            self._entries[self._next_id] = (namespace, vec, value, time.monotonic() + self.ttl_seconds)
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "corpus_version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,117 @@
+import logging
+import time
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+VALID_METRICS = ("cosine", "l2")
+
+
+class NumpyVectorIndex:
+    def __init__(self, documents: Sequence[str], embeddings: Sequence[Sequence[float]], metric: str = "cosine"):
+        """
+        行程內向量索引（精確 top-k）：語料向量存成連續的 float32 矩陣，查詢以一次矩陣乘法 + argpartition 完成
+        介面與 QueryEngine 使用到的 Chroma collection 相同（query / count），可直接取代
+
+        Args:
+            documents: 文件列表
+            embeddings: 與 documents 對應的向量（維度需一致，不一致或空向量者略過）
+            metric: cosine（列向量預先正規化，距離 = 1 - 餘弦相似度）
+                    或 l2（平方歐氏距離，與 Chroma collection 預設的距離相同）
+        """
+        if metric not in VALID_METRICS:
+            raise ValueError(f"不支援的距離：{metric}（可用：{', '.join(VALID_METRICS)}）")
+        self.metric = metric
+        started = time.monotonic()
+        rows, docs, ids = [], [], []
+        dim = None
+        skipped = 0
+        for i, (doc, emb) in enumerate(zip(documents, embeddings)):
+            if emb is None or len(emb) == 0 or (dim is not None and len(emb) != dim):
+                skipped += 1
+                continue
+            dim = len(emb)
+            rows.append(emb)
+            docs.append(doc)
+            # 與 DataLoader 寫入 Chroma 時的 id 相同，方便比對兩種後端的結果
+            ids.append(f"id_{i}")
+        if skipped:
+            logger.warning(f"向量索引略過 {skipped} 筆空向量或維度不一致的資料")
+        self.documents: List[str] = docs
+        self.ids: List[str] = ids
+        self.dim = dim or 0
+        matrix = np.asarray(rows, dtype=np.float32).reshape(len(rows), self.dim)
+        if metric == "cosine":
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0.0] = 1.0
+            matrix = matrix / norms
+            self._sq_norms = None
+        else:
+            self._sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.build_seconds = time.monotonic() - started
+        logger.info(
+            f"向量索引建立完成：{len(self.documents)} 筆，維度 {self.dim}，metric={metric}"
+            f"（{self.build_seconds * 1000:.0f} ms）"
+        )
+
+    def count(self) -> int:
+        return len(self.documents)
+
+    def _distances(self, queries: np.ndarray) -> np.ndarray:
+        """查詢向量（m x dim）對全部文件的距離（m x n）"""
+        scores = queries @ self.matrix.T
+        if self.metric == "cosine":
+            return 1.0 - scores
+        q_sq = np.einsum("ij,ij->i", queries, queries)[:, None]
+        return np.maximum(q_sq - 2.0 * scores + self._sq_norms[None, :], 0.0)
+
+    def query(
+        self,
+        query_embeddings: Optional[Sequence[Sequence[float]]] = None,
+        n_results: int = 10,
+        include: Optional[Sequence[str]] = None,
+        **kwargs
+    ) -> Dict[str, list]:
+        """
+        批次精確 top-k 查詢，回傳格式同 Chroma collection.query：
+        {"ids": [[...]], "documents": [[...]], "distances": [[...]]}（每個查詢向量一列，距離由小到大）
+        include 僅為相容 Chroma 介面而接受，固定回傳上述三項
+        """
+        if query_embeddings is None:
+            raise ValueError("NumpyVectorIndex 只支援 query_embeddings 查詢")
+        if len(query_embeddings) == 0:
+            return {"ids": [], "documents": [], "distances": []}
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        if not self.documents or n_results <= 0:
+            return {
+                "ids": [[] for _ in range(len(queries))],
+                "documents": [[] for _ in range(len(queries))],
+                "distances": [[] for _ in range(len(queries))],
+            }
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"查詢向量維度 {queries.shape[1]} 與索引維度 {self.dim} 不符")
+        if self.metric == "cosine":
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            norms[norms == 0.0] = 1.0
+            queries = queries / norms
+
+        distances = self._distances(queries)
+        k = min(int(n_results), distances.shape[1])
+        if k < distances.shape[1]:
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), (len(queries), k))
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_distances = np.take_along_axis(top_distances, order, axis=1)
+        return {
+            "ids": [[self.ids[j] for j in row] for row in top.tolist()],
+            "documents": [[self.documents[j] for j in row] for row in top.tolist()],
+            "distances": top_distances.tolist(),
+        }
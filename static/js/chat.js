@@ -23,6 +23,105 @@ document.addEventListener('DOMContentLoaded', () => {
         return now.toLocaleTimeString('zh-TW', { hour: '2-digit', minute: '2-digit' });
     };
 
+    // 建立機器人訊息泡泡（串流時逐步更新內容）
+    const appendBotMessage = (html) => {
+        const botMessage = document.createElement("div");
+        botMessage.className = "msg bot";
+        botMessage.innerHTML = `
+            <div class="avatar"></div>
+            <div class="bubble">${html}</div>
+            <div class="timestamp">${getCurrentTime()}</div>
+        `;
+        chatbox.appendChild(botMessage);
+        scrollToBottom();
+        return botMessage.querySelector(".bubble");
+    };
+
+    const escapeHtml = (text) => text
+        .replace(/&/g, "&amp;")
+        .replace(/</g, "&lt;")
+        .replace(/>/g, "&gt;");
+
+    const toHtml = (text) => escapeHtml(text).replace(/\n/g, '<br>');
+
+    // 解析一則 SSE 訊息（event / data 欄位）
+    const parseSseEvent = (raw) => {
+        let event = "message";
+        const dataLines = [];
+        raw.split("\n").forEach(line => {
+            if (line.startsWith("event:")) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith("data:")) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        if (!dataLines.length) {
+            return null;
+        }
+        return { event, data: JSON.parse(dataLines.join("\n")) };
+    };
+
+    // 呼叫 /api/ask/stream：分析內容邊生成邊顯示，完成後換成格式化回覆
+    const askQuestion = async (payload) => {
+        const bubble = appendBotMessage('<span class="typing">分析中…</span>');
+        let header = "";
+        let streamed = "";
+        const render = () => {
+            bubble.innerHTML = toHtml(header ? `${header}\n\n${streamed}` : streamed);
+            scrollToBottom();
+        };
+
+        try {
+            const response = await fetch("/api/ask/stream", {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify(payload)
+            });
+            if (!response.ok || !response.body) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder("utf-8");
+            let buffer = "";
+            let finished = false;
+            while (!finished) {
+                const { value, done } = await reader.read();
+                if (done) {
+                    break;
+                }
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                    const message = parseSseEvent(buffer.slice(0, boundary));
+                    buffer = buffer.slice(boundary + 2);
+                    if (!message) {
+                        continue;
+                    }
+                    const { event, data } = message;
+                    if (event === "token") {
+                        streamed += data.text;
+                        render();
+                    } else if (event === "header") {
+                        header = data.header;
+                        render();
+                    } else if (event === "done" || event === "error") {
+                        bubble.innerHTML = toHtml(data.answer || streamed);
+                        scrollToBottom();
+                        finished = true;
+                    }
+                }
+            }
+            if (!finished) {
+                throw new Error("串流中斷");
+            }
+        } catch (error) {
+            console.error("錯誤:", error);
+            bubble.innerHTML = streamed ? toHtml(streamed) : "⚠️ 發生錯誤，請稍後再試";
+            scrollToBottom();
+        }
+    };
+
     // 修改位置 3：控制聊天頁面的問題輸入和回覆
     window.sendQuestion = () => {
         const question = questionInput.value.trim();
@@ -36,7 +135,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const userMessage = document.createElement("div");
         userMessage.className = "msg user";
         userMessage.innerHTML = `
-            <div class="bubble">${question}</div>
+            <div class="bubble">${escapeHtml(question)}</div>
             <div class="timestamp">${getCurrentTime()}</div>
             <div class="read-receipt">已讀</div>
         `;
@@ -47,87 +146,16 @@ document.addEventListener('DOMContentLoaded', () => {
         if (navigator.geolocation) {
             navigator.geolocation.getCurrentPosition(
                 (position) => {
-                    const latitude = position.coords.latitude;
-                    const longitude = position.coords.longitude;
-
-                    fetch("/api/ask", {
-                        method: "POST",
-                        headers: { "Content-Type": "application/json" },
-                        body: JSON.stringify({
-                            question: question,
-                            latitude: latitude,
-                            longitude: longitude
-                        })
-                    })
-                    .then(response => {
-                        if (!response.ok) {
-                            throw new Error(`HTTP ${response.status}`);
-                        }
-                        return response.json();
-                    })
-                    .then(data => {
-                        const formattedAnswer = data.answer.replace(/\n/g, '<br>');
-                        const botMessage = document.createElement("div");
-                        botMessage.className = "msg bot";
-                        botMessage.innerHTML = `
-                            <div class="avatar"></div>
-                            <div class="bubble">${formattedAnswer}</div>
-                            <div class="timestamp">${getCurrentTime()}</div>
-                        `;
-                        chatbox.appendChild(botMessage);
-                        scrollToBottom();
-                    })
-                    .catch(error => {
-                        console.error("錯誤:", error);
-                        const errorMessage = document.createElement("div");
-                        errorMessage.className = "msg bot";
-                        errorMessage.innerHTML = `
-                            <div class="avatar"></div>
-                            <div class="bubble">⚠️ 發生錯誤，請稍後再試</div>
-                            <div class="timestamp">${getCurrentTime()}</div>
-                        `;
-                        chatbox.appendChild(errorMessage);
-                        scrollToBottom();
+                    askQuestion({
+                        question: question,
+                        latitude: position.coords.latitude,
+                        longitude: position.coords.longitude
                     });
                 },
                 (error) => {
                     console.warn("❌ 無法取得位置：", error.message);
                     // 若定位失敗也照樣送出問題，但不含位置
-                    fetch("/api/ask", {
-                        method: "POST",
-                        headers: { "Content-Type": "application/json" },
-                        body: JSON.stringify({ question: question })
-                    })
-                    .then(response => {
-                        if (!response.ok) {
-                            throw new Error(`HTTP ${response.status}`);
-                        }
-                        return response.json();
-                    })
-                    .then(data => {
-                        const formattedAnswer = data.answer.replace(/\n/g, '<br>');
-                        const botMessage = document.createElement("div");
-                        botMessage.className = "msg bot";
-                        botMessage.innerHTML = `
-                            <div class="avatar"></div>
-                            <div class="bubble">${formattedAnswer}</div>
-                            <div class="timestamp">${getCurrentTime()}</div>
-                        `;
-                        chatbox.appendChild(botMessage);
-                        scrollToBottom();
-                    })
-                    .catch(error => {
-                        console.error("錯誤:", error);
-                        const errorMessage = document.createElement("div");
-                        errorMessage.className = "msg bot";
-                        errorMessage.innerHTML = `
-                            <div class="avatar"></div>
-                            <div class="bubble">⚠️ 發生錯誤，請稍後再試</div>
-                            <div class="timestamp">${getCurrentTime()}</div>
-                        `;
-                        chatbox.appendChild(errorMessage);
-                        scrollToBottom();
-                    });
+                    askQuestion({ question: question });
                 }
             );
         } else {
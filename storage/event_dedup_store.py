@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from utils.log import logger
+from config.paths import STORAGE_BASE_DIR
+
+
+class EventDedupStore:
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        ttl_seconds: float = 86400,
+        max_entries: int = 200000
+    ):
+        """
+        Webhook 事件去重（以 webhookEventId 為鍵的 TTL 已處理集合）
+        儲存於 SQLite（WAL 模式），多個 worker 行程共用同一檔案，以主鍵衝突確保同一事件只被認領一次
+        處理失敗的事件以 release 釋放，LINE 重送時可再次處理
+
+        Args:
+            db_path: SQLite 檔案路徑（預設 storage/webhook_events.sqlite3）
+            ttl_seconds: 事件 ID 保留秒數（需涵蓋 LINE 重送的期間）
+            max_entries: 最多保留筆數（超過時刪除最舊者）
+        """
+        self.db_path = db_path or os.path.join(STORAGE_BASE_DIR, "webhook_events.sqlite3")
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_entries = int(max_entries)
+        self._local = threading.local()
+        self._claims = 0
+        self._prune_every = 200
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen_events ("
+                "event_id TEXT PRIMARY KEY, "
+                "expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_seen_events_expires ON seen_events (expires_at)")
+        logger.info(f"Webhook 事件去重啟用：{self.db_path}（ttl={self.ttl_seconds:.0f}s, max_entries={self.max_entries}）")
+
+    def _conn(self) -> sqlite3.Connection:
+        """每條執行緒一個連線（sqlite3 連線不可跨執行緒共用）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def claim(self, event_id: str) -> bool:
+        """
+        認領事件：首次出現（或先前紀錄已過期）回傳 True，重複事件回傳 False
+        儲存失敗時回傳 True（寧可重複處理也不漏回覆）
+        """
+        if not event_id:
+            return True
+        now = time.time()
+        try:
+            conn = self._conn()
+            # 過期紀錄視為不存在，讓同一 ID 可再次認領
+            conn.execute("DELETE FROM seen_events WHERE event_id = ? AND expires_at <= ?", (event_id, now))
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO seen_events (event_id, expires_at) VALUES (?, ?)",
+                (event_id, now + self.ttl_seconds)
+            )
+            claimed = cur.rowcount == 1
+            self._claims += 1
+            if self._claims % self._prune_every == 0:
+                self._prune(conn, now)
+            return claimed
+        except sqlite3.Error as e:
+            logger.error(f"Webhook 事件去重失敗，照常處理：{e}")
+            return True
+
+    def release(self, event_id: str) -> None:
+        """釋放認領（處理失敗時呼叫），讓 LINE 重送的同一事件可再次被認領"""
+        if not event_id:
+            return
+        try:
+            self._conn().execute("DELETE FROM seen_events WHERE event_id = ?", (event_id,))
+        except sqlite3.Error as e:
+            logger.error(f"釋放 Webhook 事件認領失敗：{e}")
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        """刪除過期紀錄，並將筆數限制在 max_entries 以內"""
+        conn.execute("DELETE FROM seen_events WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM seen_events WHERE event_id IN ("
+            "SELECT event_id FROM seen_events ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def stats(self) -> Dict[str, object]:
+        try:
+            size = self._conn().execute("SELECT COUNT(*) FROM seen_events").fetchone()[0]
+        except sqlite3.Error:
+            size = None
+        return {"size": size, "ttl_seconds": self.ttl_seconds, "max_entries": self.max_entries}
@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Dict, Optional, Union
+from utils.log import logger
+from config import config
+
+# 熔斷設定（config.ollama.circuit_breaker）
+_breaker_config = (config.get("ollama", {}) or {}).get("circuit_breaker", {}) or {}
+FAILURE_THRESHOLD = int(_breaker_config.get("failure_threshold", 3))     # 連續失敗（含過慢）幾次後熔斷
+SLOW_CALL_SECONDS = float(_breaker_config.get("slow_call_seconds", 8))   # 超過此秒數的呼叫視為失敗
+RESET_SECONDS = float(_breaker_config.get("reset_seconds", 20))          # 熔斷後多久進入半開（試探）
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        """
+        熔斷器：連續失敗或過慢達門檻後熔斷（open），期間呼叫端直接走降級路徑；
+        經過 RESET_SECONDS 後半開（half_open），只放行一個試探請求，成功即恢復（closed）
+
+        Args:
+            name: 名稱（用於日誌）
+        """
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self, now: float) -> None:
+        if self.state == OPEN and now - self.opened_at >= RESET_SECONDS:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+            logger.info(f"熔斷器半開，允許試探請求：{self.name}")
+
+    def allow_request(self) -> bool:
+        """是否放行本次請求（半開時僅放行一個試探請求）"""
+        with self._lock:
+            now = time.monotonic()
+            self._refresh(now)
+            if self.state == CLOSED:
+                return True
+            # 試探請求未回報結果（例如串流被中途放棄）超過 RESET_SECONDS 時，允許再次試探
+            stale_probe = now - self._probe_started >= RESET_SECONDS
+            if self.state == HALF_OPEN and (not self._probe_in_flight or stale_probe):
+                self._probe_in_flight = True
+                self._probe_started = now
+                return True
+            return False
+
+    def is_open(self) -> bool:
+        """
+        呼叫是否會被拒絕，供呼叫端決定是否直接降級：熔斷中，或半開且已有試探請求進行中
+        半開而尚無試探請求時回傳 False，讓呼叫端照常送出請求，由 allow_request 放行試探
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refresh(now)
+            if self.state == HALF_OPEN:
+                return self._probe_in_flight and now - self._probe_started < RESET_SECONDS
+            return self.state == OPEN
+
+    def record_success(self, elapsed: float = 0.0, slow_seconds: Optional[float] = SLOW_CALL_SECONDS) -> None:
+        """回報成功；耗時超過 slow_seconds 仍視為失敗（None 表示不以耗時判斷）"""
+        if slow_seconds is not None and elapsed > slow_seconds:
+            logger.warning(f"Ollama 呼叫過慢（{elapsed:.1f}s > {slow_seconds:.1f}s），計入熔斷失敗：{self.name}")
+            self.record_failure()
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"熔斷器恢復：{self.name}")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= FAILURE_THRESHOLD:
+                if self.state != OPEN:
+                    logger.warning(f"熔斷器開啟（連續失敗 {self.failures} 次），{RESET_SECONDS:.0f} 秒內改用降級模式：{self.name}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def status(self) -> Dict[str, Union[str, int]]:
+        with self._lock:
+            self._refresh(time.monotonic())
+            return {"state": self.state, "failures": self.failures}
@@ -0,0 +1,67 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+from config import config
+
+# 時間預算設定（config.deadline）
+_deadline_config = config.get("deadline", {}) or {}
+ENABLED = bool(_deadline_config.get("enabled", False))
+WEB_SECONDS = float(_deadline_config.get("web_seconds", 20))        # /api/ask 單次請求的時間預算
+LINE_SECONDS = float(_deadline_config.get("line_seconds", 45))      # LINE 訊息（自事件發生起算）的時間預算
+MIN_STAGE_SECONDS = float(_deadline_config.get("min_stage_seconds", 0.5))  # 剩餘時間低於此值即不再送出新的呼叫
+
+# 目前請求的截止時間（time.monotonic()），None 表示不限時
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """請求的時間預算已用盡（呼叫端應改用快速回覆）"""
+
+
+def start(seconds: Optional[float]) -> None:
+    """
+    設定目前請求的時間預算（秒）；未啟用或 seconds 為 None 時不限時
+    透過 contextvars 傳遞：同一執行緒後續呼叫、asyncio task 與 copy_context 送出的工作皆沿用
+    """
+    if not ENABLED or seconds is None:
+        _deadline.set(None)
+        return
+    _deadline.set(time.monotonic() + float(seconds))
+
+
+def clear() -> None:
+    """清除目前的時間預算（請求結束時呼叫，避免重用的執行緒沿用舊的截止時間）"""
+    _deadline.set(None)
+
+
+def remaining() -> Optional[float]:
+    """剩餘秒數（可能為負）；不限時回傳 None"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    """剩餘時間是否已不足以執行新的階段"""
+    left = remaining()
+    return left is not None and left < MIN_STAGE_SECONDS
+
+
+def check(stage: str) -> None:
+    """階段開始前檢查，預算不足時拋出 DeadlineExceeded"""
+    if expired():
+        raise DeadlineExceeded(f"時間預算已用盡，略過：{stage}")
+
+
+def clamp(timeout: float, stage: str = "") -> float:
+    """
+    以剩餘預算限制本次呼叫的逾時秒數（不限時時原樣回傳）
+    預算不足時拋出 DeadlineExceeded
+    """
+    left = remaining()
+    if left is None:
+        return float(timeout)
+    if left < MIN_STAGE_SECONDS:
+        raise DeadlineExceeded(f"時間預算已用盡，略過：{stage}" if stage else "時間預算已用盡")
+    return min(float(timeout), left)
@@ -1,6 +1,9 @@
 import requests
 from typing import Optional
 from utils.log import logger
+from utils import deadline
+
+GEO_TIMEOUT = 5  # 反查逾時（秒），另受請求的時間預算限制
 
 class GeoReverser:
     def __init__(self, user_agent: str = "ScamAnalyzer/1.0 (admin@example.com)"):
@@ -12,6 +15,7 @@ class GeoReverser:
         """
         self.base_url = "https://nominatim.openstreetmap.org/reverse"
         self.headers = {"User-Agent": user_agent}
+        self._async_client = None  # 非同步路徑首次使用時建立（httpx.AsyncClient）
 
     def reverse_geo(
         self, 
@@ -29,39 +33,79 @@ class GeoReverser:
             str: 縣市名稱（如：台北市），失敗時回傳「未知地區」
         """
         try:
-            # 組合API參數
-            params = {
-                "format": "json",
-                "lat": latitude,
-                "lon": longitude,
-                "accept-language": "zh-TW"  # 要求回傳中文結果
-            }
-            
             # 發送反查請求
             response = requests.get(
                 url=self.base_url,
-                params=params,
+                params=self._params(latitude, longitude),
                 headers=self.headers,
-                timeout=5
+                timeout=deadline.clamp(GEO_TIMEOUT, "地理反查")
             )
             response.raise_for_status()
-            result = response.json()
-            
-            # 提取縣市（優先取county，無則取city）
-            address = result.get("address", {})
-            county = address.get("county") or address.get("city")
-            
-            if not county:
-                logger.warning(f"經緯度({latitude},{longitude})無法解析縣市")
-                return "未知地區"
-            
-            # 統一「臺」為「台」（如：臺北市 → 台北市）
-            return county.strip().replace("臺", "台")
+            return self._parse_county(response.json(), latitude, longitude)
+
+        except deadline.DeadlineExceeded as e:
+            logger.warning(str(e))
+            return "未知地區"
         
         except Exception as e:
             logger.error(f"地理位置反查失敗：{str(e)}")
             return "未知地區"
 
+    async def reverse_geo_async(
+        self,
+        latitude: float,
+        longitude: float
+    ) -> str:
+        """
+        reverse_geo 的非同步版本（httpx，共用連線；ASGI 路徑使用）
+        """
+        try:
+            if self._async_client is None:
+                import httpx
+                self._async_client = httpx.AsyncClient(headers=self.headers, timeout=GEO_TIMEOUT)
+            response = await self._async_client.get(
+                self.base_url,
+                params=self._params(latitude, longitude),
+                timeout=deadline.clamp(GEO_TIMEOUT, "地理反查")
+            )
+            response.raise_for_status()
+            return self._parse_county(response.json(), latitude, longitude)
+        except deadline.DeadlineExceeded as e:
+            logger.warning(str(e))
+            return "未知地區"
+        except Exception as e:
+            logger.error(f"地理位置反查失敗：{str(e)}")
+            return "未知地區"
+
+    async def aclose(self) -> None:
+        """關閉非同步連線（ASGI lifespan 結束時呼叫）"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    @staticmethod
+    def _params(latitude: float, longitude: float) -> dict:
+        """組合API參數"""
+        return {
+            "format": "json",
+            "lat": latitude,
+            "lon": longitude,
+            "accept-language": "zh-TW"  # 要求回傳中文結果
+        }
+
+    @staticmethod
+    def _parse_county(result: dict, latitude: float, longitude: float) -> str:
+        """提取縣市（優先取county，無則取city）"""
+        address = result.get("address", {})
+        county = address.get("county") or address.get("city")
+        
+        if not county:
+            logger.warning(f"經緯度({latitude},{longitude})無法解析縣市")
+            return "未知地區"
+        
+        # 統一「臺」為「台」（如：臺北市 → 台北市）
+        return county.strip().replace("臺", "台")
+
     def update_location_stats(self, county: str, stats_path: str = None) -> None:
         """
         更新縣市查詢次數統計。優先寫入資料庫（LocationStatsDAO），若 MySQL 停用或失敗則回退 JSON。
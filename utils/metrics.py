@@ -0,0 +1,52 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Any
+
+# 行程內的簡易指標（計數器 / 量測值 / 分佈），供 /api/metrics 匯出
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, float] = {}
+_observations: Dict[str, Dict[str, float]] = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    """計數器累加"""
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """設定量測值（例如佇列長度）"""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """記錄一筆觀測值（例如等待秒數），保留次數、總和與最大值"""
+    with _lock:
+        obs = _observations.get(name)
+        if obs is None:
+            obs = {"count": 0, "sum": 0.0, "max": 0.0}
+            _observations[name] = obs
+        obs["count"] += 1
+        obs["sum"] += value
+        obs["max"] = max(obs["max"], value)
+
+
+def get_counter(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> Dict[str, Any]:
+    """回傳目前所有指標（分佈另附平均值）"""
+    with _lock:
+        observations = {
+            name: {**obs, "avg": (obs["sum"] / obs["count"]) if obs["count"] else 0.0}
+            for name, obs in _observations.items()
+        }
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "observations": observations,
+        }
@@ -0,0 +1,178 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import requests
+from utils.log import logger
+from utils.ollama_balancer import resolve_backends
+from utils.ollama_client import get_session, MODEL_KEEP_ALIVE
+from config import config
+
+# 模型常駐設定（config.ollama.residency）
+_residency_config = (config.get("ollama", {}) or {}).get("residency", {}) or {}
+PING_INTERVAL = float(_residency_config.get("ping_interval", 240))    # 續約間隔（秒），需小於 keep_alive
+WARMUP_TIMEOUT = float(_residency_config.get("warmup_timeout", 120))  # 載入模型的逾時（秒，冷啟動需數秒至數十秒）
+PS_TIMEOUT = float(_residency_config.get("ps_timeout", 2))            # 查詢已載入模型（/api/ps）的逾時（秒）
+
+
+def configured_models(ollama_config: Dict) -> List[Tuple[str, str, str]]:
+    """
+    列出設定中實際會用到的 (後端URL, 模型, 類型)；類型為 chat 或 embed（決定暖機使用的 API）
+    Web：ollama.web_model（分類與分析）；LINE：ollama.line.model（生成）與 embedding_model（查詢向量）
+    """
+    ollama_config = ollama_config or {}
+    line_config = ollama_config.get("line", {}) or {}
+    wanted = []
+    if ollama_config.get("web_model"):
+        wanted += [(url, ollama_config["web_model"], "chat") for url in resolve_backends(ollama_config)]
+    line_urls = resolve_backends(line_config)
+    if line_config.get("model"):
+        wanted += [(url, line_config["model"], "chat") for url in line_urls]
+    if line_config.get("embedding_model"):
+        wanted += [(url, line_config["embedding_model"], "embed") for url in line_urls]
+    # 同一後端同一模型只需暖機一次（embedding 與生成共用同一模型時以 chat 為準）
+    unique: Dict[Tuple[str, str], str] = {}
+    for url, model, kind in wanted:
+        if unique.get((url, model)) != "chat":
+            unique[(url, model)] = kind
+    return [(url, model, kind) for (url, model), kind in unique.items()]
+
+
+def _model_matches(name: str, model: str) -> bool:
+    """/api/ps 回傳的名稱含 tag（如 mistral:latest），未指定 tag 的設定視為 latest"""
+    return name == model or (":" not in model and name == f"{model}:latest")
+
+
+class ModelResidencyManager:
+    def __init__(self, models: List[Tuple[str, str, str]], keep_alive=MODEL_KEEP_ALIVE, interval: float = PING_INTERVAL):
+        """
+        模型常駐管理：啟動時預先載入設定的模型，並在背景定期以 keep_alive 請求續約
+        （被卸載的模型會重新載入），避免閒置後第一個請求承擔載入時間；常駐狀態取自 /api/ps
+
+        Args:
+            models: (後端URL, 模型, 類型) 列表，見 configured_models
+            keep_alive: 模型常駐時間（Ollama keep_alive 格式，如 "30m"、3600、-1 表示永久）
+            interval: 背景續約間隔（秒）
+        """
+        self.models = models
+        self.keep_alive = keep_alive if keep_alive is not None else "30m"
+        self.interval = max(1.0, float(interval))
+        self._lock = threading.Lock()
+        # 後端URL -> {模型名稱: 到期時間字串}；None 表示查詢失敗
+        self._resident: Dict[str, Optional[Dict[str, str]]] = {}
+        self._last_warm: Dict[Tuple[str, str], float] = {}
+        self._checked_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """啟動背景執行緒（立即暖機全部模型，之後定期續約）；重複呼叫不會重複啟動"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="ollama-residency", daemon=True)
+            self._thread.start()
+        logger.info(
+            f"Ollama 模型常駐管理啟動：{len(self.models)} 個模型，keep_alive={self.keep_alive}，"
+            f"每 {self.interval:.0f} 秒續約"
+        )
+
+    def _loop(self) -> None:
+        self.refresh()
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def refresh(self) -> None:
+        """
+        對所有設定的模型送出 keep_alive 續約（已載入者立即回應，未載入者重新載入），
+        再查詢各後端 /api/ps 更新常駐清單
+        """
+        for url, model, kind in self.models:
+            if self._stop.is_set():
+                return
+            self.warm(url, model, kind)
+        for url in sorted({url for url, _, _ in self.models}):
+            self._resident_models(url)
+        self._checked_at = time.time()
+
+    def _resident_models(self, url: str) -> Optional[Dict[str, str]]:
+        try:
+            response = get_session(url).get(f"{url}/api/ps", timeout=PS_TIMEOUT)
+            response.raise_for_status()
+            models = {m.get("name", ""): m.get("expires_at", "") for m in response.json().get("models", [])}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"查詢 Ollama 已載入模型失敗：{url}（{e}）")
+            models = None
+        with self._lock:
+            self._resident[url] = models
+        return models
+
+    def warm(self, url: str, model: str, kind: str = "chat") -> bool:
+        """
+        送出載入/續約請求：生成模型以空 prompt 呼叫 /api/generate（只載入、不生成），
+        embedding 模型以短字串呼叫 /api/embeddings；皆帶 keep_alive
+        直接送到指定後端（不經負載平衡與排程，確保每台後端都載入）
+        """
+        if kind == "embed":
+            path, payload = "/api/embeddings", {"model": model, "prompt": "ping", "keep_alive": self.keep_alive}
+        else:
+            path, payload = "/api/generate", {"model": model, "prompt": "", "stream": False, "keep_alive": self.keep_alive}
+        started = time.monotonic()
+        try:
+            response = get_session(url).post(f"{url}{path}", json=payload, timeout=(3, WARMUP_TIMEOUT))
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Ollama 模型暖機失敗：{model}@{url}（{e}）")
+            return False
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._last_warm[(url, model)] = time.time()
+        logger.info(f"Ollama 模型已載入/續約：{model}@{url}（{elapsed:.1f}s）")
+        return True
+
+    def status(self) -> Dict[str, object]:
+        """各後端設定模型的常駐狀態（取自最近一次背景檢查）"""
+        with self._lock:
+            backends = {}
+            for url, model, kind in self.models:
+                resident = self._resident.get(url)
+                expires_at = None
+                if resident:
+                    expires_at = next((exp for name, exp in resident.items() if _model_matches(name, model)), None)
+                backends.setdefault(url, []).append({
+                    "model": model,
+                    "kind": kind,
+                    "resident": None if resident is None else expires_at is not None,
+                    "expires_at": expires_at,
+                    "last_warm": self._last_warm.get((url, model)),
+                })
+            return {
+                "keep_alive": self.keep_alive,
+                "interval": self.interval,
+                "checked_at": self._checked_at or None,
+                "backends": backends,
+            }
+
+    def close(self) -> None:
+        self._stop.set()
+
+
+_manager: Optional[ModelResidencyManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_residency_manager() -> Optional[ModelResidencyManager]:
+    """取得行程內共用的模型常駐管理（未啟用時回傳 None）"""
+    global _manager
+    if not _residency_config.get("enabled", False):
+        return None
+    with _manager_lock:
+        if _manager is None:
+            _manager = ModelResidencyManager(configured_models(config.get("ollama", {}) or {}))
+        return _manager
+
+
+def start_residency_manager() -> None:
+    """應用啟動時呼叫：啟用時於背景暖機並定期續約"""
+    manager = get_residency_manager()
+    if manager is not None:
+        manager.start()
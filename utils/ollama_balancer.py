@@ -0,0 +1,184 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import requests
+from utils.log import logger
+from utils.circuit_breaker import CircuitBreaker
+from config import config
+
+# 負載平衡設定（config.ollama.balancer）
+_balancer_config = (config.get("ollama", {}) or {}).get("balancer", {}) or {}
+HEALTH_INTERVAL = float(_balancer_config.get("health_interval", 15))   # 健康檢查間隔（秒）
+HEALTH_TIMEOUT = float(_balancer_config.get("health_timeout", 2))      # 健康檢查逾時（秒）
+MAX_FAILURES = int(_balancer_config.get("max_failures", 2))            # 連續失敗幾次後暫時剔除
+EJECT_SECONDS = float(_balancer_config.get("eject_seconds", 30))       # 剔除持續時間（秒）
+
+
+def resolve_backends(section: Dict) -> List[str]:
+    """
+    從 config 區段取得後端清單：優先使用 backends（列表），否則退回單一 base_url
+
+    Args:
+        section: config["ollama"] 或其子區段（如 config["ollama"]["line"]）
+
+    Returns:
+        List[str]: 後端 URL 列表
+    """
+    section = section or {}
+    backends = section.get("backends") or []
+    if isinstance(backends, str):
+        backends = [backends]
+    if not backends:
+        backends = [section.get("base_url") or "http://localhost:11434"]
+    return [b.rstrip("/") for b in backends]
+
+
+class Backend:
+    def __init__(self, url: str):
+        """
+        單一 Ollama 後端的狀態（進行中請求數、連續失敗次數、剔除期限）
+        """
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+
+class BackendPool:
+    def __init__(self, urls: List[str]):
+        """
+        多後端負載平衡：以進行中請求數最少者優先，失敗或健康檢查不通過的節點暫時剔除
+
+        Args:
+            urls: 後端 URL 列表
+        """
+        self.backends = [Backend(u) for u in urls]
+        # 整組後端共用的熔斷器（所有節點皆失敗或過慢時熔斷）
+        self.breaker = CircuitBreaker(",".join(urls))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+        # 單一後端時無從切換，不需背景健康檢查
+        if len(self.backends) > 1 and HEALTH_INTERVAL > 0:
+            self._health_thread = threading.Thread(
+                target=self._health_loop, name="ollama-health", daemon=True
+            )
+            self._health_thread.start()
+
+    def _pick(self) -> Backend:
+        """選出可用且進行中請求最少的後端（同分隨機）；全部被剔除時選最早恢復者"""
+        now = time.monotonic()
+        available = [b for b in self.backends if b.is_available(now)]
+        if not available:
+            return min(self.backends, key=lambda b: b.ejected_until)
+        least = min(b.outstanding for b in available)
+        return random.choice([b for b in available if b.outstanding == least])
+
+    @contextmanager
+    def acquire(self) -> Iterator[Backend]:
+        """
+        取得一個後端並計入進行中請求數；離開時自動扣回
+        呼叫端以 report_success / report_failure 回報結果
+        """
+        with self._lock:
+            backend = self._pick()
+            backend.outstanding += 1
+        try:
+            yield backend
+        finally:
+            with self._lock:
+                backend.outstanding -= 1
+
+    def report_success(self, backend: Backend) -> None:
+        with self._lock:
+            backend.failures = 0
+            backend.ejected_until = 0.0
+
+    def report_failure(self, backend: Backend) -> None:
+        with self._lock:
+            backend.failures += 1
+            if backend.failures >= MAX_FAILURES and len(self.backends) > 1:
+                backend.ejected_until = time.monotonic() + EJECT_SECONDS
+                logger.warning(f"Ollama 後端連續失敗 {backend.failures} 次，暫時剔除 {EJECT_SECONDS:.0f} 秒：{backend.url}")
+
+    def probe(self, backend: Backend) -> bool:
+        """對 /api/tags 進行健康檢查，並更新後端狀態"""
+        from utils.ollama_client import get_session
+        try:
+            response = get_session(backend.url).get(f"{backend.url}/api/tags", timeout=HEALTH_TIMEOUT)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            with self._lock:
+                was_available = backend.is_available(time.monotonic())
+                backend.failures = max(backend.failures, MAX_FAILURES)
+                backend.ejected_until = time.monotonic() + EJECT_SECONDS
+            if was_available:
+                logger.warning(f"Ollama 後端健康檢查失敗，暫時剔除：{backend.url}（{e}）")
+            return False
+        with self._lock:
+            recovered = not backend.is_available(time.monotonic())
+            backend.failures = 0
+            backend.ejected_until = 0.0
+        if recovered:
+            logger.info(f"Ollama 後端健康檢查恢復：{backend.url}")
+        return True
+
+    def _health_loop(self) -> None:
+        while not self._stop.wait(HEALTH_INTERVAL):
+            for backend in self.backends:
+                self.probe(backend)
+
+    def status(self) -> Dict[str, object]:
+        """回傳各後端與熔斷器狀態（供健康檢查 API 使用）"""
+        now = time.monotonic()
+        with self._lock:
+            backends = [
+                {
+                    "url": b.url,
+                    "available": b.is_available(now),
+                    "outstanding": b.outstanding,
+                    "failures": b.failures,
+                }
+                for b in self.backends
+            ]
+        return {"backends": backends, "circuit_breaker": self.breaker.status()}
+
+    def close(self) -> None:
+        self._stop.set()
+
+
+# 相同後端組合共用同一個 pool（行程內），讓進行中請求數在所有用戶端間一致
+_pools: Dict[Tuple[str, ...], BackendPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_backend_pool(urls: Union[str, List[str]]) -> BackendPool:
+    """
+    取得指定後端組合的共用 BackendPool
+
+    Args:
+        urls: 單一 URL 或 URL 列表
+    """
+    if isinstance(urls, str):
+        urls = [urls]
+    key = tuple(sorted(u.rstrip("/") for u in urls))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = BackendPool(list(key))
+            _pools[key] = pool
+            if len(key) > 1:
+                logger.info(f"建立 Ollama 多後端負載平衡：{list(key)}")
+        return pool
+
+
+def all_pools_status() -> Dict[str, Dict[str, object]]:
+    """回傳所有 BackendPool 的狀態"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {",".join(key): pool.status() for key, pool in pools.items()}
@@ -1,25 +1,304 @@
+import atexit
+import json
+import threading
+import time
 import requests
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Iterator, Optional, Tuple, Union
 from utils.log import logger
+from config import config
+from utils.ollama_balancer import get_backend_pool
+from utils.circuit_breaker import SLOW_CALL_SECONDS
+from utils.ollama_scheduler import scheduler
+from utils import deadline
+from utils.deadline import DeadlineExceeded
+
+# 非同步路徑（ASGI，app/asgi.py）才需要 httpx；同步部署未安裝時不影響
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 非同步呼叫的 HTTP 例外（未安裝 httpx 時為空，except 子句不會因存取 None 的屬性而失敗）
+_ASYNC_HTTP_ERRORS = (httpx.HTTPError,) if httpx is not None else ()
+
+# 連線設定（config.ollama.http），所有 OllamaClient 共用
+_http_config = (config.get("ollama", {}) or {}).get("http", {}) or {}
+POOL_SIZE = int(_http_config.get("pool_size", 16))
+KEEP_ALIVE = bool(_http_config.get("keep_alive", True))
+CONNECT_TIMEOUT = float(_http_config.get("connect_timeout", 3))
+READ_TIMEOUT = float(_http_config.get("timeout", 10))
+GENERATE_TIMEOUT = float(_http_config.get("generate_timeout", 120))  # 長篇生成（/api/generate）的讀取逾時
+
+# 模型常駐時間（config.ollama.residency.keep_alive）：每次呼叫帶上 keep_alive，避免模型閒置後被卸載
+# 未設定時不帶（沿用 Ollama 伺服器預設，約 5 分鐘）
+MODEL_KEEP_ALIVE = ((config.get("ollama", {}) or {}).get("residency", {}) or {}).get("keep_alive")
+
+# 每個 base_url 一個連線池化的 Session（行程內共用，建立時加鎖）
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(base_url: str) -> requests.Session:
+    """
+    取得指定 base_url 共用的 requests.Session（keep-alive + 連線池）
+    
+    Args:
+        base_url: Ollama伺服器URL
+    
+    Returns:
+        requests.Session: 行程內共用的 Session
+    """
+    base_url = base_url.rstrip("/")
+    session = _sessions.get(base_url)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            session = requests.Session()
+            # pool_block=True：連線數達上限時等待釋放，避免無上限建立新連線
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, pool_block=True)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["Connection"] = "keep-alive" if KEEP_ALIVE else "close"
+            _sessions[base_url] = session
+            logger.info(f"建立 Ollama 連線池：{base_url}（pool_size={POOL_SIZE}, keep_alive={KEEP_ALIVE}）")
+    return session
+
+
+def close_sessions() -> None:
+    """關閉所有共用 Session（行程結束時呼叫）"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+atexit.register(close_sessions)
+
+# 非同步用戶端（每個 base_url 一個 httpx.AsyncClient，綁定 ASGI 伺服器的事件迴圈）
+_async_clients: Dict[str, "httpx.AsyncClient"] = {}
+
+
+def get_async_client(base_url: str) -> "httpx.AsyncClient":
+    """
+    取得指定 base_url 共用的 httpx.AsyncClient（連線池上限與同步 Session 相同）
+    僅能在事件迴圈中使用；連線數達上限時等待釋放（不設 pool 逾時）
+    """
+    if httpx is None:
+        raise RuntimeError("非同步 Ollama 呼叫需要安裝 httpx（pip install httpx）")
+    base_url = base_url.rstrip("/")
+    client = _async_clients.get(base_url)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=POOL_SIZE,
+                max_keepalive_connections=POOL_SIZE if KEEP_ALIVE else 0
+            ),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=None)
+        )
+        _async_clients[base_url] = client
+        logger.info(f"建立 Ollama 非同步連線池：{base_url}（pool_size={POOL_SIZE}, keep_alive={KEEP_ALIVE}）")
+    return client
+
+
+async def close_async_clients() -> None:
+    """關閉所有非同步用戶端（ASGI lifespan 結束時呼叫）"""
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+class OllamaUnavailableError(RuntimeError):
+    """熔斷器開啟中，請求未送出（呼叫端應改走降級/啟發式路徑）"""
+
+
+class OllamaDeadlineError(OllamaUnavailableError, DeadlineExceeded):
+    """請求的時間預算已用盡（排隊或呼叫逾時），呼叫端比照熔斷改走降級/啟發式路徑"""
+
 
 class OllamaClient:
-    def __init__(self, base_url: str, default_model: str):
+    def __init__(self, base_url: Union[str, List[str]], default_model: str, request_class: str = "chat"):
         """
-        初始化Ollama API用戶端
+        初始化Ollama API用戶端（同一 base_url 的用戶端共用連線池）
         
         Args:
-            base_url: Ollama伺服器URL（如：http://localhost:11434）
+            base_url: Ollama伺服器URL（如：http://localhost:11434），
+                      或多個後端URL列表（依進行中請求數最少者分派，失敗節點暫時剔除）
             default_model: 預設使用的模型（如：mistral）
+            request_class: 准入排程的請求類別（classify / chat / generate；
+                           Embeddings 一律為 embed），決定排隊優先序與同時送出上限
         """
-        self.base_url = base_url.rstrip("/")  # 確保URL結尾無斜線
+        urls = [base_url] if isinstance(base_url, str) else list(base_url)
+        self.backend_urls = [u.rstrip("/") for u in urls]  # 確保URL結尾無斜線
+        self.base_url = self.backend_urls[0]
         self.default_model = default_model
-        self.chat_endpoint = f"{self.base_url}/api/chat"  # 聊天API端點
+        self.request_class = request_class
+        self.pool = get_backend_pool(self.backend_urls)
+
+    def is_degraded(self) -> bool:
+        """後端熔斷中（呼叫會立即失敗），呼叫端可直接改用啟發式"""
+        return self.pool.breaker.is_open()
+
+    @staticmethod
+    def _read_timeout(timeout: Optional[float], path: str) -> Tuple[float, bool]:
+        """
+        本次呼叫的讀取逾時：未指定時使用設定值，並以請求剩餘的時間預算為上限
+        回傳 (逾時秒數, 是否因時間預算而縮短)；預算已用盡時拋出 OllamaDeadlineError
+        """
+        requested = float(timeout) if timeout is not None else READ_TIMEOUT
+        try:
+            read_timeout = deadline.clamp(requested, path)
+        except DeadlineExceeded as e:
+            raise OllamaDeadlineError(str(e)) from e
+        return read_timeout, read_timeout < requested
+
+    @staticmethod
+    def _timeout(read_timeout: float) -> Tuple[float, float]:
+        """組合 (連線逾時, 讀取逾時)"""
+        return (min(CONNECT_TIMEOUT, read_timeout), read_timeout)
+
+    @staticmethod
+    def _with_keep_alive(request_data: Dict) -> Dict:
+        """加上設定的 keep_alive（呼叫端已指定時不覆寫）"""
+        if MODEL_KEEP_ALIVE is None or "keep_alive" in request_data:
+            return request_data
+        return {**request_data, "keep_alive": MODEL_KEEP_ALIVE}
+
+    def _request_class(self, path: str) -> str:
+        """請求的排程類別：Embeddings 固定為 embed，其餘依用戶端設定"""
+        return "embed" if path in ("/api/embeddings", "/api/embed") else self.request_class
+
+    def _slow_call_seconds(self, path: str) -> Optional[float]:
+        """
+        非串流呼叫的過慢門檻：回應要等整段生成完成才送出，耗時隨輸出長度增加
+        長篇生成（chat / generate 類別、/api/generate）與批次 embedding 不以耗時判斷，只計逾時與錯誤
+        """
+        if path in ("/api/generate", "/api/embed") or self._request_class(path) in ("chat", "generate"):
+            return None
+        return SLOW_CALL_SECONDS
+
+    def _post_json(self, path: str, request_data: Dict, timeout: Optional[float] = None) -> Dict:
+        """
+        選擇後端送出非串流POST請求並回傳JSON（例外交由呼叫端處理）
+        連線錯誤、逾時與 5xx 會回報為後端失敗；因時間預算縮短而逾時者不計入
+        """
+        breaker = self.pool.breaker
+        if not breaker.allow_request():
+            raise OllamaUnavailableError(f"Ollama 熔斷中，略過請求：{path}")
+        # 先取得排程名額（依類別優先序/使用者輪流），再選擇後端送出
+        try:
+            with scheduler.slot(self._request_class(path)):
+                return self._send(path, request_data, timeout)
+        except DeadlineExceeded as e:
+            if isinstance(e, OllamaDeadlineError):
+                raise
+            raise OllamaDeadlineError(str(e)) from e
+
+    def _send(self, path: str, request_data: Dict, timeout: Optional[float]) -> Dict:
+        """已取得排程名額後選擇後端送出（_post_json 內部使用）"""
+        breaker = self.pool.breaker
+        read_timeout, clamped = self._read_timeout(timeout, path)
+        with self.pool.acquire() as backend:
+            started = time.monotonic()
+            try:
+                response = get_session(backend.url).post(
+                    url=f"{backend.url}{path}",
+                    json=self._with_keep_alive(request_data),
+                    timeout=self._timeout(read_timeout)  # 設定超時時間，避免阻塞
+                )
+                response.raise_for_status()  # 若狀態碼非2xx，拋出異常
+            except requests.exceptions.Timeout as e:
+                if clamped:
+                    # 請求自身的時間預算用盡，不代表後端異常
+                    raise OllamaDeadlineError(f"Ollama 呼叫超過時間預算：{path}") from e
+                self.pool.report_failure(backend)
+                breaker.record_failure()
+                raise
+            except requests.exceptions.RequestException as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status is None or status >= 500:
+                    self.pool.report_failure(backend)
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+            except Exception:
+                # 回應格式錯誤等其他異常也視為後端失敗
+                breaker.record_failure()
+                raise
+            self.pool.report_success(backend)
+            breaker.record_success(time.monotonic() - started, self._slow_call_seconds(path))
+            return response.json()
+
+    async def _post_json_async(self, path: str, request_data: Dict, timeout: Optional[float] = None) -> Dict:
+        """
+        _post_json 的非同步版本（httpx）：同樣經由排程、負載平衡與熔斷器，例外交由呼叫端處理
+        """
+        breaker = self.pool.breaker
+        if not breaker.allow_request():
+            raise OllamaUnavailableError(f"Ollama 熔斷中，略過請求：{path}")
+        try:
+            async with scheduler.slot_async(self._request_class(path)):
+                return await self._send_async(path, request_data, timeout)
+        except DeadlineExceeded as e:
+            if isinstance(e, OllamaDeadlineError):
+                raise
+            raise OllamaDeadlineError(str(e)) from e
+
+    async def _send_async(self, path: str, request_data: Dict, timeout: Optional[float]) -> Dict:
+        """已取得排程名額後選擇後端送出（_post_json_async 內部使用）"""
+        breaker = self.pool.breaker
+        read_timeout, clamped = self._read_timeout(timeout, path)
+        with self.pool.acquire() as backend:
+            client = get_async_client(backend.url)
+            started = time.monotonic()
+            try:
+                response = await client.post(
+                    f"{backend.url}{path}",
+                    json=self._with_keep_alive(request_data),
+                    timeout=httpx.Timeout(
+                        read_timeout,
+                        connect=min(CONNECT_TIMEOUT, read_timeout),
+                        pool=None
+                    )
+                )
+                response.raise_for_status()
+                result = response.json()
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code >= 500:
+                    self.pool.report_failure(backend)
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+            except httpx.TimeoutException as e:
+                if clamped:
+                    raise OllamaDeadlineError(f"Ollama 呼叫超過時間預算：{path}") from e
+                self.pool.report_failure(backend)
+                breaker.record_failure()
+                raise
+            except httpx.RequestError:
+                # 連線錯誤
+                self.pool.report_failure(backend)
+                breaker.record_failure()
+                raise
+            except Exception:
+                breaker.record_failure()
+                raise
+            self.pool.report_success(backend)
+            breaker.record_success(time.monotonic() - started, self._slow_call_seconds(path))
+            return result
 
     def send_chat_request(
         self, 
         messages: List[Dict[str, str]], 
         model: Optional[str] = None, 
-        stream: bool = False
+        stream: bool = False,
+        response_format: Optional[str] = None,
+        timeout: Optional[float] = None
     ) -> Optional[str]:
         """
         傳送請求到Ollama Chat API
@@ -27,7 +306,9 @@ class OllamaClient:
         Args:
             messages: 對話歷史（含system prompt、user input）
             model: 自訂模型（預設使用初始化時的default_model）
-            stream: 是否開啟串流模式（此專案用於非串流）
+            stream: 是否開啟串流模式（開啟時內部逐段接收後合併為完整內容）
+            response_format: 輸出格式限制（如 "json"，要求模型輸出合法JSON）
+            timeout: 本次呼叫的讀取逾時秒數（預設 config.ollama.http.timeout）
         
         Returns:
             Optional[str]: Ollama回應內容（失敗時回傳None）
@@ -39,21 +320,302 @@ class OllamaClient:
                 "messages": messages,
                 "stream": stream
             }
+            if response_format:
+                request_data["format"] = response_format
+
+            if stream:
+                return "".join(self._iter_stream(request_data, timeout)).strip() or None
             
-            # 發送POST請求
-            response = requests.post(
-                url=self.chat_endpoint,
-                json=request_data,
-                timeout=10  # 設定超時時間，避免阻塞
-            )
-            response.raise_for_status()  # 若狀態碼非2xx，拋出異常
+            # 發送POST請求（共用連線池）
+            result = self._post_json("/api/chat", request_data, timeout)
             
             # 解析回應（非串流模式）
-            return response.json()["message"]["content"].strip()
+            return result["message"]["content"].strip()
         
+        except OllamaUnavailableError as e:
+            logger.warning(str(e))
+            return None
         except requests.exceptions.RequestException as e:
             logger.error(f"Ollama API請求失敗：{str(e)}")
             return None
         except KeyError as e:
             logger.error(f"Ollama回應格式錯誤（缺少欄位）：{str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    async def send_chat_request_async(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None,
+        response_format: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Optional[str]:
+        """
+        send_chat_request 的非同步版本（非串流；失敗時回傳 None）
+        """
+        request_data = {
+            "model": model or self.default_model,
+            "messages": messages,
+            "stream": False
+        }
+        if response_format:
+            request_data["format"] = response_format
+        try:
+            result = await self._post_json_async("/api/chat", request_data, timeout)
+            return result["message"]["content"].strip()
+        except OllamaUnavailableError as e:
+            logger.warning(str(e))
+            return None
+        except _ASYNC_HTTP_ERRORS as e:
+            logger.error(f"Ollama API請求失敗：{str(e)}")
+            return None
+        except KeyError as e:
+            logger.error(f"Ollama回應格式錯誤（缺少欄位）：{str(e)}")
+            return None
+        except ValueError as e:
+            # 回應內容不是合法 JSON（response.json() 失敗），與同步路徑一樣回傳 None 交由呼叫端降級
+            logger.error(f"Ollama回應格式錯誤（非JSON）：{str(e)}")
+            return None
+
+    def _iter_stream(self, request_data: Dict, timeout: Optional[float] = None, path: str = "/api/chat") -> Iterator[str]:
+        """
+        以串流模式呼叫Chat/Generate API，逐段產出內容（Ollama 以每行一個JSON物件回傳）
+        串流期間持續計入該後端的進行中請求數；例外交由呼叫端處理
+        呼叫端提前關閉生成器時連線隨即關閉，Ollama 停止生成
+        """
+        breaker = self.pool.breaker
+        if not breaker.allow_request():
+            raise OllamaUnavailableError("Ollama 熔斷中，略過串流請求")
+        # 串流期間持續佔用排程名額
+        try:
+            with scheduler.slot(self.request_class):
+                yield from self._stream(request_data, timeout, path)
+        except DeadlineExceeded as e:
+            if isinstance(e, OllamaDeadlineError):
+                raise
+            raise OllamaDeadlineError(str(e)) from e
+
+    def _stream(self, request_data: Dict, timeout: Optional[float], path: str) -> Iterator[str]:
+        """已取得排程名額後選擇後端串流接收（_iter_stream 內部使用）"""
+        breaker = self.pool.breaker
+        read_timeout, clamped = self._read_timeout(timeout, path)
+        with self.pool.acquire() as backend:
+            started = time.monotonic()
+            first_chunk_elapsed = None
+            try:
+                with get_session(backend.url).post(
+                    url=f"{backend.url}{path}",
+                    json=self._with_keep_alive(request_data),
+                    stream=True,
+                    timeout=self._timeout(read_timeout)  # 連線/兩段資料之間的最長等待
+                ) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        if first_chunk_elapsed is None:
+                            # 串流以首段延遲判斷是否過慢
+                            first_chunk_elapsed = time.monotonic() - started
+                        data = json.loads(line)
+                        if data.get("error"):
+                            raise ValueError(data["error"])
+                        if path == "/api/chat":
+                            content = (data.get("message") or {}).get("content")
+                        else:
+                            content = data.get("response")
+                        if content:
+                            yield content
+                        if data.get("done"):
+                            break
+                        left = deadline.remaining()
+                        if left is not None and left <= 0:
+                            # 時間預算用盡：停止接收，已產出的內容由呼叫端保留
+                            raise OllamaDeadlineError("Ollama 串流超過時間預算，提前結束")
+            except OllamaDeadlineError:
+                raise
+            except requests.exceptions.Timeout as e:
+                if clamped:
+                    raise OllamaDeadlineError("Ollama 串流超過時間預算") from e
+                self.pool.report_failure(backend)
+                breaker.record_failure()
+                raise
+            except requests.exceptions.RequestException as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status is None or status >= 500:
+                    self.pool.report_failure(backend)
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+            except Exception:
+                # 回應格式錯誤等其他異常也視為後端失敗
+                breaker.record_failure()
+                raise
+            self.pool.report_success(backend)
+            breaker.record_success(first_chunk_elapsed or 0.0)
+
+    def stream_chat_request(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Iterator[str]:
+        """
+        串流傳送請求到Ollama Chat API，逐段產出回應內容
+
+        Args:
+            messages: 對話歷史（含system prompt、user input）
+            model: 自訂模型（預設使用初始化時的default_model）
+            timeout: 兩段資料之間的讀取逾時秒數（預設 config.ollama.http.timeout）
+
+        Yields:
+            str: 回應內容片段（失敗時停止產出，已產出的內容保留）
+
+        Returns:
+            bool: 生成器結束值，完整接收為 True，中途失敗為 False
+        """
+        request_data = {
+            "model": model or self.default_model,
+            "messages": messages,
+            "stream": True
+        }
+        try:
+            yield from self._iter_stream(request_data, timeout)
+            return True
+        except OllamaUnavailableError as e:
+            logger.warning(str(e))
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Ollama 串流請求失敗：{str(e)}")
+        except ValueError as e:
+            logger.error(f"Ollama 串流回應格式錯誤：{str(e)}")
+        return False
+
+    def embeddings(self, prompt: str, model: Optional[str] = None, timeout: Optional[float] = None) -> Dict:
+        """
+        呼叫Ollama Embeddings API（回傳格式同 ollama.embeddings：{"embedding": [...]}）
+        失敗時拋出例外（熔斷中為 OllamaUnavailableError），由呼叫端處理
+        """
+        return self._post_json(
+            "/api/embeddings",
+            {"model": model or self.default_model, "prompt": prompt},
+            timeout
+        )
+
+    def embed_batch(self, inputs: List[str], model: Optional[str] = None, timeout: Optional[float] = None) -> List[List[float]]:
+        """
+        呼叫Ollama Embed API（/api/embed），一次請求取得多筆文字的向量，順序與 inputs 相同
+        失敗時拋出例外（熔斷中為 OllamaUnavailableError；舊版 Ollama 無此 API 時為 HTTP 404），由呼叫端處理
+
+        Args:
+            inputs: 文字列表
+            model: 自訂模型（預設使用初始化時的default_model）
+            timeout: 讀取逾時秒數（預設 config.ollama.http.generate_timeout，批次較單筆耗時）
+        """
+        if not inputs:
+            return []
+        response = self._post_json(
+            "/api/embed",
+            {"model": model or self.default_model, "input": list(inputs)},
+            timeout if timeout is not None else GENERATE_TIMEOUT
+        )
+        embeddings = response.get("embeddings") or []
+        if len(embeddings) != len(inputs):
+            raise ValueError(f"Ollama Embed 回傳 {len(embeddings)} 筆向量，預期 {len(inputs)} 筆")
+        return embeddings
+
+    def generate(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        options: Optional[Dict] = None,
+        timeout: Optional[float] = None
+    ) -> Dict:
+        """
+        呼叫Ollama Generate API（非串流，回傳格式同 ollama.generate：{"response": "..."}）
+        失敗時拋出例外（熔斷中為 OllamaUnavailableError），由呼叫端處理
+        """
+        request_data = {
+            "model": model or self.default_model,
+            "prompt": prompt,
+            "stream": False
+        }
+        if options:
+            request_data["options"] = options
+        return self._post_json(
+            "/api/generate",
+            request_data,
+            timeout if timeout is not None else GENERATE_TIMEOUT
+        )
+
+    def stream_generate(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        options: Optional[Dict] = None,
+        timeout: Optional[float] = None
+    ) -> Iterator[str]:
+        """
+        串流呼叫Ollama Generate API，逐段產出生成內容
+        呼叫端可隨時 close() 提前結束（連線關閉，Ollama 隨即停止生成，省下其餘解碼時間）
+
+        Args:
+            prompt: 完整 prompt
+            model: 自訂模型（預設使用初始化時的default_model）
+            options: 生成參數（num_predict、stop、temperature 等）
+            timeout: 兩段資料之間的讀取逾時秒數（預設 config.ollama.http.generate_timeout）
+
+        Yields:
+            str: 生成內容片段（失敗時停止產出，已產出的內容保留）
+
+        Returns:
+            bool: 生成器結束值，完整接收為 True，中途失敗為 False
+        """
+        request_data = {
+            "model": model or self.default_model,
+            "prompt": prompt,
+            "stream": True
+        }
+        if options:
+            request_data["options"] = options
+        try:
+            yield from self._iter_stream(
+                request_data,
+                timeout if timeout is not None else GENERATE_TIMEOUT,
+                path="/api/generate"
+            )
+            return True
+        except OllamaUnavailableError as e:
+            logger.warning(str(e))
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Ollama 串流生成失敗：{str(e)}")
+        except ValueError as e:
+            logger.error(f"Ollama 串流回應格式錯誤：{str(e)}")
+        return False
+
+    async def embeddings_async(self, prompt: str, model: Optional[str] = None, timeout: Optional[float] = None) -> Dict:
+        """embeddings 的非同步版本（失敗時拋出例外）"""
+        return await self._post_json_async(
+            "/api/embeddings",
+            {"model": model or self.default_model, "prompt": prompt},
+            timeout
+        )
+
+    async def generate_async(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        options: Optional[Dict] = None,
+        timeout: Optional[float] = None
+    ) -> Dict:
+        """generate 的非同步版本（失敗時拋出例外）"""
+        request_data = {
+            "model": model or self.default_model,
+            "prompt": prompt,
+            "stream": False
+        }
+        if options:
+            request_data["options"] = options
+        return await self._post_json_async(
+            "/api/generate",
+            request_data,
+            timeout if timeout is not None else GENERATE_TIMEOUT
+        )
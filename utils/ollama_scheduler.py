@@ -0,0 +1,295 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, AsyncIterator, Optional
+from utils.log import logger
+from utils import metrics
+from utils import deadline
+from config import config
+
+# 排程設定（config.ollama.scheduler）
+_scheduler_config = (config.get("ollama", {}) or {}).get("scheduler", {}) or {}
+
+# 請求類別預設值：priority 越小越優先；max_concurrency 為該類別同時送出的上限
+DEFAULT_CLASSES = {
+    "embed": {"priority": 0, "max_concurrency": 4},      # 查詢向量（快）
+    "classify": {"priority": 1, "max_concurrency": 4},   # 意圖/相關性/類型分類（短輸出）
+    "chat": {"priority": 2, "max_concurrency": 3},       # Web 詐騙分析
+    "generate": {"priority": 3, "max_concurrency": 2},   # LINE 長篇生成
+}
+
+# 目前請求所屬的使用者（公平排隊用）；由路由在處理請求前設定
+_current_user: ContextVar[str] = ContextVar("ollama_current_user", default="")
+
+
+def set_current_user(user_key: Optional[str]) -> None:
+    """設定目前請求的使用者識別（Web 為 session_id、LINE 為 user_id）"""
+    _current_user.set(user_key or "")
+
+
+def get_current_user() -> str:
+    return _current_user.get()
+
+
+class _Waiter:
+    __slots__ = ("request_class", "user", "enqueued_at", "granted", "event", "loop", "future")
+
+    def __init__(self, request_class: str, user: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.request_class = request_class
+        self.user = user
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self) -> None:
+        """取得執行名額（呼叫端需持有排程器的鎖）"""
+        self.granted = True
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class OllamaScheduler:
+    def __init__(self, max_concurrency: int, classes: Dict[str, Dict], enabled: bool = True):
+        """
+        Ollama 呼叫的准入排程：所有呼叫先取得名額才送出
+
+        - 全域上限 max_concurrency，另有各類別上限（長篇生成不會佔滿所有名額）
+        - 有名額釋出時，依類別優先序（embed > classify > chat > generate）挑選等待者
+        - 同一類別內依使用者輪流（round-robin），單一使用者的大量請求不會阻擋其他人
+        - 記錄各類別的排隊等待時間與排隊/執行中數量（utils.metrics）
+
+        Args:
+            max_concurrency: 全域同時送出的上限
+            classes: 類別設定 {name: {"priority": int, "max_concurrency": int}}
+            enabled: 停用時不排隊，直接送出
+        """
+        self.enabled = bool(enabled)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.classes = {
+            name: {
+                "priority": int(opts.get("priority", 99)),
+                "max_concurrency": max(1, int(opts.get("max_concurrency", 1))),
+            }
+            for name, opts in classes.items()
+        }
+        self._order = sorted(self.classes, key=lambda name: self.classes[name]["priority"])
+        self._lock = threading.Lock()
+        self._in_flight_total = 0
+        self._in_flight: Dict[str, int] = {name: 0 for name in self.classes}
+        # 各類別單次呼叫耗時的指數移動平均（預估排隊時間用）
+        self._service_seconds: Dict[str, float] = {name: 0.0 for name in self.classes}
+        # 類別 -> (使用者 -> 等待者佇列)，使用者依輪流順序排列
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {name: OrderedDict() for name in self.classes}
+
+    def _resolve_class(self, request_class: str) -> str:
+        return request_class if request_class in self.classes else self._order[-1]
+
+    def _can_run(self, request_class: str) -> bool:
+        return (
+            self._in_flight_total < self.max_concurrency
+            and self._in_flight[request_class] < self.classes[request_class]["max_concurrency"]
+        )
+
+    def _dispatch(self) -> None:
+        """依優先序把可用名額分配給等待者（呼叫端需持有鎖）"""
+        granted = True
+        while granted:
+            granted = False
+            for name in self._order:
+                queue = self._queues[name]
+                if not queue or not self._can_run(name):
+                    continue
+                user, waiters = next(iter(queue.items()))
+                waiter = waiters.popleft()
+                # 輪到下一位使用者；此使用者若仍有請求則排到最後
+                del queue[user]
+                if waiters:
+                    queue[user] = waiters
+                self._in_flight_total += 1
+                self._in_flight[name] += 1
+                waiter.wake()
+                granted = True
+                break
+        self._report()
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        queue = self._queues[waiter.request_class]
+        queue.setdefault(waiter.user, deque()).append(waiter)
+        self._dispatch()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        """等待者放棄（逾時/取消）：未取得名額則移出佇列，已取得則歸還"""
+        if waiter.granted:
+            self._release_locked(waiter.request_class)
+            return
+        queue = self._queues[waiter.request_class]
+        waiters = queue.get(waiter.user)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del queue[waiter.user]
+        self._report()
+
+    def _release_locked(self, request_class: str) -> None:
+        self._in_flight_total -= 1
+        self._in_flight[request_class] -= 1
+        self._dispatch()
+
+    def _observe_wait(self, waiter: _Waiter) -> None:
+        metrics.observe(f"ollama_scheduler.{waiter.request_class}.wait_seconds", time.monotonic() - waiter.enqueued_at)
+
+    def acquire(self, request_class: str, timeout: Optional[float] = None) -> bool:
+        """
+        取得名額（阻塞等待）；逾時回傳 False
+        """
+        if not self.enabled:
+            return True
+        waiter = _Waiter(self._resolve_class(request_class), get_current_user())
+        with self._lock:
+            self._enqueue(waiter)
+        if not waiter.event.wait(timeout):
+            with self._lock:
+                if not waiter.granted:
+                    self._remove(waiter)
+                    metrics.increment(f"ollama_scheduler.{waiter.request_class}.timeouts")
+                    return False
+        self._observe_wait(waiter)
+        return True
+
+    async def acquire_async(self, request_class: str) -> None:
+        """取得名額（非同步等待）；等待中被取消時自動移出佇列或歸還名額"""
+        if not self.enabled:
+            return
+        waiter = _Waiter(self._resolve_class(request_class), get_current_user(), asyncio.get_running_loop())
+        with self._lock:
+            self._enqueue(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                self._remove(waiter)
+            raise
+        self._observe_wait(waiter)
+
+    def release(self, request_class: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._release_locked(self._resolve_class(request_class))
+
+    def _record_service(self, request_class: str, elapsed: float) -> None:
+        with self._lock:
+            previous = self._service_seconds[request_class]
+            self._service_seconds[request_class] = elapsed if previous == 0.0 else previous * 0.8 + elapsed * 0.2
+
+    def predicted_wait(self, request_class: str) -> float:
+        """
+        預估新請求的排隊秒數：排在前面（同類別與更高優先類別）的請求數 / 類別上限 × 平均耗時
+        尚無耗時紀錄時回傳 0
+        """
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            request_class = self._resolve_class(request_class)
+            priority = self.classes[request_class]["priority"]
+            limit = self.classes[request_class]["max_concurrency"]
+            ahead = sum(
+                sum(len(w) for w in self._queues[name].values())
+                for name in self.classes
+                if self.classes[name]["priority"] <= priority
+            )
+            free = max(0, min(
+                self.max_concurrency - self._in_flight_total,
+                limit - self._in_flight[request_class]
+            ))
+            if ahead < free:
+                return 0.0
+            rounds = (ahead - free) // limit + 1
+            return rounds * self._service_seconds[request_class]
+
+    @contextmanager
+    def slot(self, request_class: str) -> Iterator[None]:
+        """以名額包住一次呼叫（同步）；排隊時間受請求的時間預算限制，逾時拋出 DeadlineExceeded"""
+        request_class = self._resolve_class(request_class) if self.enabled else request_class
+        if not self.acquire(request_class, timeout=deadline.remaining()):
+            raise deadline.DeadlineExceeded(f"等待 Ollama 排程名額超過時間預算：{request_class}")
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(request_class)
+            if self.enabled:
+                self._record_service(request_class, time.monotonic() - started)
+
+    @asynccontextmanager
+    async def slot_async(self, request_class: str) -> AsyncIterator[None]:
+        """以名額包住一次呼叫（非同步）；排隊時間受請求的時間預算限制"""
+        request_class = self._resolve_class(request_class) if self.enabled else request_class
+        left = deadline.remaining()
+        try:
+            await asyncio.wait_for(self.acquire_async(request_class), None if left is None else max(0.0, left))
+        except asyncio.TimeoutError:
+            metrics.increment(f"ollama_scheduler.{request_class}.timeouts")
+            raise deadline.DeadlineExceeded(f"等待 Ollama 排程名額超過時間預算：{request_class}")
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(request_class)
+            if self.enabled:
+                self._record_service(request_class, time.monotonic() - started)
+
+    def _report(self) -> None:
+        for name in self.classes:
+            metrics.set_gauge(f"ollama_scheduler.{name}.queued", sum(len(w) for w in self._queues[name].values()))
+            metrics.set_gauge(f"ollama_scheduler.{name}.in_flight", self._in_flight[name])
+
+    def status(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight_total,
+                "classes": {
+                    name: {
+                        **self.classes[name],
+                        "in_flight": self._in_flight[name],
+                        "queued": sum(len(w) for w in self._queues[name].values()),
+                        "avg_seconds": round(self._service_seconds[name], 3),
+                    }
+                    for name in self._order
+                },
+            }
+
+
+def _build_scheduler() -> OllamaScheduler:
+    classes = {name: dict(opts) for name, opts in DEFAULT_CLASSES.items()}
+    for name, opts in (_scheduler_config.get("classes", {}) or {}).items():
+        classes.setdefault(name, {}).update(opts or {})
+    scheduler = OllamaScheduler(
+        max_concurrency=int(_scheduler_config.get("max_concurrency", 8)),
+        classes=classes,
+        enabled=bool(_scheduler_config.get("enabled", False)),
+    )
+    if scheduler.enabled:
+        summary = ", ".join(
+            f"{name}(p={scheduler.classes[name]['priority']}, max={scheduler.classes[name]['max_concurrency']})"
+            for name in scheduler._order
+        )
+        logger.info(f"Ollama 准入排程啟用：全域上限 {scheduler.max_concurrency}；{summary}")
+    return scheduler
+
+
+# 行程內共用的排程器（所有 OllamaClient 經由此取得名額）
+scheduler = _build_scheduler()
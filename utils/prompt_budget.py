@@ -0,0 +1,180 @@
+import re
+from typing import Dict, List, Optional, Union
+from utils.log import logger
+from utils import metrics
+from config import config
+
+# Prompt 預算設定（config.prompt_budget）
+_budget_config = config.get("prompt_budget", {}) or {}
+ENABLED = bool(_budget_config.get("enabled", False))
+# 各階段對話歷史的 token 上限（classify：意圖/相關性/類型分類，analyze：Web 詐騙分析）
+HISTORY_TOKENS: Dict[str, int] = {"classify": 256, "analyze": 768}
+HISTORY_TOKENS.update({k: int(v) for k, v in (_budget_config.get("history_tokens", {}) or {}).items()})
+CONTEXT_TOKENS = int(_budget_config.get("context_tokens", 1200))   # RAG 資料庫內容的 token 上限
+CHUNK_TOKENS = int(_budget_config.get("chunk_tokens", 500))        # 單一段落的 token 上限（避免一段佔滿預算）
+SUMMARY_CHARS = int(_budget_config.get("summary_chars", 80))       # 先前回覆摘要的字數上限
+DEDUP_SIMILARITY = float(_budget_config.get("dedup_similarity", 0.85))  # 段落相似度（字元 3-gram Jaccard）達此值視為重複
+
+_CJK = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_NORMALIZE = re.compile(r"[\s\W_]+")
+_SENTENCE_END = re.compile(r"[。！？!?\n]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算 token 數（不依賴特定模型的 tokenizer）：中日文字元各約 1 個 token，其餘約 4 個字元 1 個 token
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截斷至 token 上限內，盡量停在句末"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text[:lo]
+    ends = [m.end() for m in _SENTENCE_END.finditer(cut)]
+    if ends and ends[-1] >= len(cut) // 2:
+        cut = cut[:ends[-1]]
+    return cut.rstrip() + "…"
+
+
+def summarize_reply(text: str) -> str:
+    """
+    將先前的助手回覆縮為摘要：格式化回覆（📌 詐騙類型 / 📊 詐騙風險 / 🔍 分析內容）只保留類型、風險與分析首句，
+    其他回覆截斷至 SUMMARY_CHARS
+    """
+    if "📌 詐騙類型：" not in text:
+        return text if len(text) <= SUMMARY_CHARS else text[:SUMMARY_CHARS].rstrip() + "…"
+    scam_type = re.search(r"📌 詐騙類型：(.*)", text)
+    risk = re.search(r"📊 詐騙風險：(.*)", text)
+    analysis = text.split("🔍 分析內容：", 1)[1] if "🔍 分析內容：" in text else ""
+    analysis = analysis.split("🧠 查證建議：", 1)[0].strip()
+    first = _SENTENCE_END.split(analysis, 1)[0].strip() if analysis else ""
+    if len(first) > SUMMARY_CHARS:
+        first = first[:SUMMARY_CHARS].rstrip() + "…"
+    parts = []
+    if scam_type:
+        parts.append(f"詐騙類型：{scam_type.group(1).strip()}")
+    if risk:
+        parts.append(f"詐騙風險：{risk.group(1).strip()}")
+    if first:
+        parts.append(f"摘要：{first}")
+    return "（先前分析）" + "；".join(parts)
+
+
+def compact_history(history: List[Dict[str, str]], stage: str) -> List[Dict[str, str]]:
+    """
+    依階段的 token 預算整理對話歷史：助手回覆改為摘要，自最近一輪往前保留至預算用盡
+    未啟用時原樣回傳
+    """
+    if not ENABLED or not history:
+        return history
+    budget = HISTORY_TOKENS.get(stage, HISTORY_TOKENS["classify"])
+    kept: List[Dict[str, str]] = []
+    used = 0
+    for message in reversed(history):
+        content = message.get("content", "")
+        if message.get("role") == "assistant":
+            content = summarize_reply(content)
+        tokens = estimate_tokens(content)
+        if used + tokens > budget:
+            remaining = budget - used
+            # 最近一則，或已保留回覆對應的提問：截斷後保留（避免只剩回覆而缺少提問）
+            if not kept or (message.get("role") == "user" and remaining >= 16):
+                content = truncate_to_tokens(content, remaining)
+                kept.append({**message, "content": content})
+                used += estimate_tokens(content)
+            break
+        kept.append({**message, "content": content})
+        used += tokens
+    kept.reverse()
+    # 對話需從使用者訊息開始
+    while kept and kept[0].get("role") == "assistant":
+        used -= estimate_tokens(kept.pop(0)["content"])
+    metrics.observe(f"prompt_tokens.{stage}.history", used)
+    return kept
+
+
+def shingles(text: str) -> set:
+    """字元 3-gram 集合（去除空白與標點後），供段落相似度比較"""
+    normalized = _NORMALIZE.sub("", text or "")
+    return {normalized[i:i + 3] for i in range(max(1, len(normalized) - 2))}
+
+
+def jaccard(a: set, b: set) -> float:
+    """兩個 3-gram 集合的 Jaccard 相似度（0~1）"""
+    union = a | b
+    return len(a & b) / len(union) if union else 0.0
+
+
+def _is_duplicate(chunk: str, kept: List[str]) -> bool:
+    """完全相同、包含於已保留段落，或 3-gram 相似度達門檻者視為重複"""
+    normalized = _NORMALIZE.sub("", chunk)
+    if not normalized:
+        return True
+    grams = shingles(chunk)
+    for other in kept:
+        other_normalized = _NORMALIZE.sub("", other)
+        if normalized in other_normalized:
+            return True
+        if jaccard(grams, shingles(other)) >= DEDUP_SIMILARITY:
+            return True
+    return False
+
+
+def build_context(documents: Union[str, List[str]], max_tokens: Optional[int] = None) -> str:
+    """
+    組合 RAG 資料庫內容：段落去重、單段截斷至 CHUNK_TOKENS、依檢索順序保留至 max_tokens（預設 CONTEXT_TOKENS）
+    documents 可為文件列表或 QueryEngine.query 合併後的字串（以空行分段）；未啟用時原樣回傳
+    """
+    if isinstance(documents, str):
+        if not ENABLED:
+            return documents
+        chunks = [c.strip() for c in re.split(r"\n\s*\n", documents)]
+    else:
+        if not ENABLED:
+            return "\n\n".join(documents)
+        chunks = [c.strip() for d in documents for c in re.split(r"\n\s*\n", d or "")]
+    budget = CONTEXT_TOKENS if max_tokens is None else int(max_tokens)
+    kept: List[str] = []
+    used = 0
+    dropped = 0
+    for chunk in chunks:
+        if not chunk or _is_duplicate(chunk, kept):
+            dropped += 1 if chunk else 0
+            continue
+        chunk = truncate_to_tokens(chunk, CHUNK_TOKENS)
+        tokens = estimate_tokens(chunk)
+        if used + tokens > budget:
+            remaining = budget - used
+            if remaining >= 32:
+                chunk = truncate_to_tokens(chunk, remaining)
+                kept.append(chunk)
+                used += estimate_tokens(chunk)
+            break
+        kept.append(chunk)
+        used += tokens
+    if dropped:
+        logger.info(f"RAG 內容去除 {dropped} 段重複段落")
+    metrics.observe("prompt_tokens.context", used)
+    return "\n\n".join(kept)
+
+
+def report_prompt(stage: str, messages_or_prompt: Union[str, List[Dict[str, str]]]) -> int:
+    """記錄送出的 prompt 估算 token 數（metrics：prompt_tokens.<stage>），回傳 token 數"""
+    if isinstance(messages_or_prompt, str):
+        tokens = estimate_tokens(messages_or_prompt)
+    else:
+        tokens = sum(estimate_tokens(m.get("content", "")) for m in messages_or_prompt)
+    metrics.observe(f"prompt_tokens.{stage}", tokens)
+    return tokens
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from utils.log import logger
+from config import config
+
+# 分類器結果快取設定（config.cache.classifier）
+_classifier_cache_config = (config.get("cache", {}) or {}).get("classifier", {}) or {}
+
+
+def normalize_text(text: str) -> str:
+    """
+    正規化輸入文字作為快取鍵：全形/半形統一（NFKC）、去除頭尾空白、合併連續空白、英文轉小寫
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def history_digest(history: Optional[List[Dict[str, str]]]) -> str:
+    """對話歷史摘要（SHA-1），讓相同輸入在不同上下文下不會共用結果"""
+    payload = json.dumps(history or [], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(user_input: str, history: Optional[List[Dict[str, str]]], model: str) -> str:
+    """組合快取鍵：正規化輸入 + 歷史摘要 + 模型名稱"""
+    raw = f"{model}\x00{history_digest(history)}\x00{normalize_text(user_input)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    def __init__(self, name: str, max_size: int = 1024, ttl_seconds: float = 600, enabled: bool = True):
+        """
+        執行緒安全的 LRU + TTL 快取
+
+        Args:
+            name: 快取名稱（用於統計與日誌）
+            max_size: 最大筆數（超過時淘汰最久未使用者）
+            ttl_seconds: 每筆資料的存活秒數
+            enabled: 停用時 get 永遠未命中、set 不寫入
+        """
+        self.name = name
+        self.max_size = max(0, int(max_size))
+        self.ttl_seconds = float(ttl_seconds)
+        self.enabled = bool(enabled) and self.max_size > 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """取得快取值；不存在或已過期時回傳 None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if time.monotonic() >= expires_at:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """
+        命中時直接回傳；未命中時呼叫 compute，結果非空才寫入
+        （失敗/空結果不快取，避免把暫時性錯誤固定住）
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = compute()
+        if value:
+            self.set(key, value)
+        return value
+
+    async def get_or_compute_async(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """get_or_compute 的非同步版本（compute 回傳 awaitable）"""
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = await compute()
+        if value:
+            self.set(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# 具名快取（行程內共用），供健康檢查 API 匯出統計
+_caches: Dict[str, TTLCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_classifier_cache(name: str) -> TTLCache:
+    """
+    取得分類器 LLM 結果快取（依 config.cache.classifier 設定）
+
+    Args:
+        name: 分類器名稱（如 intent / related / scam_type）
+    """
+    return register_cache(
+        name,
+        lambda: TTLCache(
+            name,
+            max_size=int(_classifier_cache_config.get("max_size", 2048)),
+            ttl_seconds=float(_classifier_cache_config.get("ttl_seconds", 1800)),
+            enabled=bool(_classifier_cache_config.get("enabled", True)),
+        )
+    )
+
+
+def register_cache(name: str, factory: Callable[[], TTLCache]) -> TTLCache:
+    """取得具名快取，不存在時以 factory 建立並登錄"""
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = factory()
+            _caches[name] = cache
+            logger.info(f"建立快取：{name}（max_size={cache.max_size}, ttl={cache.ttl_seconds:.0f}s, enabled={cache.enabled}）")
+        return cache
+
+
+def all_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """回傳所有具名快取的命中統計"""
+    with _caches_lock:
+        caches = dict(_caches)
+    return {name: cache.stats() for name, cache in caches.items()}